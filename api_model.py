@@ -12,7 +12,7 @@ from datetime import datetime
 import pandas as pd
 
 from tqdm.asyncio import tqdm as async_tqdm
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Callable
 import asyncio
 import aiohttp
 import sys
@@ -23,7 +23,7 @@ from config import (
     TEXT_DATA_FILENAME, ACTIVITY_CODES_FILENAME, SII_DATA_FILENAME,
     RESULTS_DIR, RESUMEN_RUBROS_ADICIONALES,
     LLM_MODEL_NAME_API, LLM_TEMPERATURE, INNER_WORKERS, OUTER_WORKERS,
-    OLLAMA_BASE_URL, CLASSIFICATION_RESULTS_DIR,URL_DEEP,URL_GPT
+    OLLAMA_BASE_URL, CLASSIFICATION_RESULTS_DIR,URL_DEEP,URL_GPT, S3_MAX_WORKERS, API_MAX_TOKENS_PROMPT
 )
 
 from data.loader import LoadTexts, load_activity_codes_data, load_sii_data_complete, load_data_and_preprocess
@@ -31,11 +31,20 @@ from data.preprocessor import (
     texto_legible_y_anonimo, extraer_info_concatenada 
 )
 from llm.prompts import (
-    generar_prompt_completar_texto, generar_prompt_clasificacion, generar_prompt2
+    generar_prompt_completar_texto, generar_prompt_clasificacion_presupuestado, generar_prompt2, anotar_repeticiones
 )
+from llm.tokens import estimar_tokens, get_estadisticas_prompts, log_stats_prompts
  
-from openai import OpenAI
+from llm.cache import llave_llm, respuesta_con_cache, get_llm_cache, disable_llm_cache
+from llm.policy import get_politica, configurar_politicas, log_stats_politicas
 from utils.helpers import *
+from utils.http_client import crear_sesion_http, EstadisticasConexiones
+from utils.result_store import crear_escritor, BACKENDS_RESULTADOS
+from utils.loop_monitor import MonitorLatenciaLoop
+from utils.concurrency import LimitadorAdaptativo
+from utils.manifest import (
+    manifiesto_de, ETAPA_COMPLETACION, ETAPA_CLASIFICACION, ESTADO_OK, ESTADO_SIN_DATOS, ESTADO_ERROR
+)
 from dotenv import load_dotenv
 # from data.get_data_bucket import *
 
@@ -52,30 +61,21 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 DEEP_API_KEY = os.getenv("DEEP_API_KEY")
 
- 
-# --- Función para llamada sincrónica a LLM ---
-def call_llm(prompt: str, model: str, temp: float, api_key: str, base_url: str) -> str:
-    """Llama a la API de OpenAI/DeepSeek (sincrónica) y devuelve SOLO el texto de salida."""
-    client = OpenAI(api_key=api_key, base_url=base_url)
-    try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=temp
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        return f"Error: {e}"
-
 
 # --- Función para llamada asíncrona a LLM ---
 async def _async_call_llm(
     session: aiohttp.ClientSession, prompt: str, model: str, temp: float,
-    api_key: str, base_url: str, semaphore: asyncio.Semaphore
+    api_key: str, base_url: str, limitador: LimitadorAdaptativo,
+    timeout: float = 180, es_valida: Callable[[str], bool] = lambda respuesta: True,
+    etapa: str = "completación"
 ) -> str:
     """
     Realiza una única llamada a la API de OpenAI/DeepSeek de forma asíncrona.
-    Usa semáforo para limitar la concurrencia.
+    La concurrencia la regula un límite adaptativo (AIMD) y los errores transitorios se reintentan
+    según la política de la `etapa` (`timeout` es su deadline por intento, salvo que se entregue
+    --deadline). Las respuestas exitosas (y que cumplen
+    `es_valida`) se guardan en la cache compartida de respuestas del LLM (la llave incluye
+    la URL base, no la API key).
     """
     url = f"{base_url}/chat/completions"   #   ruta final para usar un solo nombre de url
     headers = {"Authorization": f"Bearer {api_key}"}
@@ -84,16 +84,22 @@ async def _async_call_llm(
         "messages": [{"role": "user", "content": prompt}],
         "temperature": temp
     }
+    politica = get_politica(etapa, deadline=timeout)
 
-    async with semaphore:
-        try:
-            async with session.post(url, json=payload, headers=headers, timeout=180) as response:
+    async def _llamar() -> str:
+        async with limitador:
+            async with session.post(url, json=payload, headers=headers, timeout=politica.timeout_http()) as response:
                 response.raise_for_status()
                 data = await response.json()
                 return data["choices"][0]["message"]["content"].strip()
-        except (aiohttp.ClientError, asyncio.TimeoutError, Exception) as e:
-            logging.error(f"Error en la llamada para el prompt '{prompt[:30]}...': {e}")
-            return f"Error: {e}"
+
+    try:
+        return await respuesta_con_cache(
+            llave_llm(base_url, model, temp, {}, prompt), lambda: politica.ejecutar(_llamar), es_valida
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError, Exception) as e:
+        logging.error(f"Error en la llamada para el prompt '{prompt[:30]}...': {e}")
+        return f"Error: {e}"
 
 
 # --- Orquestador principal (nivel RUT) ---
@@ -122,21 +128,43 @@ async def ejecutar_prueba_async(
     respuestas_por_rut = {}
     prompts_por_rut = {}
 
-    semaphore = asyncio.Semaphore(args.inner_workers)  # Limita el número de llamadas concurrentes
+    # Estado por RUT y etapa, junto a los archivos de salida de cada una (para --resume)
+    manifest_completacion = manifiesto_de(RESULTS_DIR)
+    manifest_clasificacion = manifiesto_de(CLASSIFICATION_RESULTS_DIR)
+    # Escrituras en un hilo aparte para no frenar el event loop
+    almacen_completacion = crear_escritor(args.results_backend, RESULTS_DIR, "salida_rubro")
+    almacen_clasificacion = crear_escritor(args.results_backend, CLASSIFICATION_RESULTS_DIR, "clasificacion")
+
+    # Límites adaptativos de llamadas concurrentes (parten en inner_workers / class_workers)
+    limitador = LimitadorAdaptativo("completación", inicial=args.inner_workers)
+    limitador_clasificacion = LimitadorAdaptativo("clasificación", inicial=args.class_workers)
+
+    # Una sola sesión HTTP (pool keep-alive) para todos los RUTs y etapas
+    estadisticas_http = EstadisticasConexiones()
+    # El tope de conexiones debe cubrir el máximo de ambos límites: si no, las llamadas esperarían
+    # una conexión con el cupo del límite tomado y el límite lo confundiría con latencia del servidor
+    max_conexiones = limitador.maximo + limitador_clasificacion.maximo
+    session = crear_sesion_http(
+        limit=max_conexiones, limit_per_host=max_conexiones, estadisticas=estadisticas_http
+    )
 
     # --- Proceso interno para un RUT ---
     async def process_rut(rut: str) -> None:
-        """Procesa todos los documentos de un RUT de forma secuencial."""
+        """Completa los documentos de un RUT y luego lo clasifica, sin bloquear el event loop."""
         textos_emisor = all_data["_rut_dict"].get(rut, {}).get("emisor", [])
         if not textos_emisor:
+            manifest_completacion.registrar(rut, ETAPA_COMPLETACION, ESTADO_SIN_DATOS)
+            manifest_clasificacion.registrar(rut, ETAPA_CLASIFICACION, ESTADO_SIN_DATOS)
             return
 
-        # Generar prompts de completación de texto
-        prompts = [
-            generar_prompt_completar_texto(
-                extraer_info_concatenada(texto_legible_y_anonimo(txt, False))
-            )
-            for txt in textos_emisor]
+        # Generar prompts de completación de texto (una sola vez por resumen distinto)
+        resumenes, repeticiones = agrupar_repetidos(
+            [extraer_info_concatenada(texto_legible_y_anonimo(txt, False)) for txt in textos_emisor]
+        )
+        get_estadisticas_prompts("completación").registrar_duplicados(len(textos_emisor) - len(resumenes))
+        prompts = [generar_prompt_completar_texto(resumen) for resumen in resumenes]
+        for p in prompts:
+            get_estadisticas_prompts("completación").registrar(estimar_tokens(p))
         
         prompts_por_rut[rut] = prompts
         
@@ -144,15 +172,15 @@ async def ejecutar_prueba_async(
         url= URL_GPT if args.llm_model=="gpt-4o" else URL_DEEP    
 
         # Llamar a la API de forma concurrente
-        async with aiohttp.ClientSession() as session:
-            tasks = [
-                _async_call_llm(session, p, model, temp, api_key,url, semaphore)
-                for p in prompts
-            ]
-            responses = await asyncio.gather(*tasks)
+        tasks = [
+            _async_call_llm(session, p, model, temp, api_key,url, limitador)
+            for p in prompts
+        ]
+        responses = await asyncio.gather(*tasks)
 
         # Filtrar solo respuestas válidas
-        responses = [resp for resp in responses if resp and not resp.startswith("Error:")]
+        exitosas = [(resp, n) for resp, n in zip(responses, repeticiones) if resp and not resp.startswith("Error:")]
+        responses = [resp for resp, _ in exitosas]
 
         # Guardar resultados intermedios
         respuestas_por_rut[rut] = responses
@@ -163,20 +191,31 @@ async def ejecutar_prueba_async(
             "documentos_receptor_original": all_data["_rut_dict"].get(rut, {}).get("receptor"),
             "completaciones_emisor_limpias": responses,
             "completaciones_receptor_limpias": [],
+            "repeticiones_completaciones_emisor": [n for _, n in exitosas],
         }
-        guardar_pickle(output, f"salida_rubro_{rut}.pkl", RESULTS_DIR)
+        await almacen_completacion.guardar(
+            rut, output, manifest_completacion.al_guardar(rut, ETAPA_COMPLETACION, ESTADO_OK if responses else ESTADO_ERROR)
+        )
         
-        # Crear prompt para clasificación económica
-        prompt_class = generar_prompt_clasificacion(
-            output.get('completaciones_emisor_limpias', []),
+        # Crear prompt para clasificación económica (solo las completaciones que caben en API_MAX_TOKENS_PROMPT)
+        prompt_class, descartadas = generar_prompt_clasificacion_presupuestado(
+            anotar_repeticiones(output['completaciones_emisor_limpias'], output['repeticiones_completaciones_emisor']),
             output.get('completaciones_receptor_limpias', []), # SOLO EMISOR por ahora
             RESUMEN_RUBROS_ADICIONALES,
             output.get('giros_declarados_rut', []),
-            generar_prompt2
+            generar_prompt2,
+            API_MAX_TOKENS_PROMPT
         )
+        get_estadisticas_prompts("clasificación").registrar(estimar_tokens(prompt_class))
+        if descartadas:
+            get_estadisticas_prompts("clasificación").registrar_recorte(descartadas)
+            logging.warning(f"RUT {rut}: {descartadas}/{len(responses)} completaciones no caben en el prompt de clasificación y se omiten.")
         
-        # Llamada sincrónica para clasificación
-        response_json = call_llm(prompt_class, model , temp, api_key, url)
+        # Llamada asíncrona para clasificación (600 s, el timeout por defecto del SDK de OpenAI)
+        response_json = await _async_call_llm(
+            session, prompt_class, model, temp, api_key, url, limitador_clasificacion,
+            timeout=600, es_valida=lambda r: bool(extraer_contenido_entre_llaves(r)), etapa="clasificación"
+        )
         logging.info(f"Clasificación recibida: {response_json}")
 
         try:
@@ -193,10 +232,28 @@ async def ejecutar_prueba_async(
             output['clasificacion_economica'] = ["API_ERROR"]
             output['justification'] = "Error en llamada a la API"
 
-        guardar_pickle(output, f"clasificacion_{rut}.pkl", CLASSIFICATION_RESULTS_DIR)
+        await almacen_clasificacion.guardar(
+            rut, output, manifest_clasificacion.al_guardar(rut, ETAPA_CLASIFICACION, ESTADO_OK if response_json else ESTADO_ERROR)
+        )
 
     # Ejecutar en paralelo por RUT
-    await async_tqdm.gather(*(process_rut(r) for r in ruts), desc="Procesando RUTs")
+    monitor = MonitorLatenciaLoop().iniciar()
+    try:
+        async with session:
+            await async_tqdm.gather(*(process_rut(r) for r in ruts), desc="Procesando RUTs")
+    finally:
+        await monitor.detener()
+        # También ante Ctrl-C: lo ya encolado queda en disco antes de salir
+        almacen_completacion.cerrar()
+        almacen_clasificacion.cerrar()
+    estadisticas_http.log_stats("Conexiones HTTP")
+    limitador.log_stats()
+    limitador_clasificacion.log_stats()
+    log_stats_politicas()
+    log_stats_prompts()
+    almacen_completacion.log_stats("Resultados (completación)")
+    almacen_clasificacion.log_stats("Resultados (clasificación)")
+    monitor.log_stats()
 
     logging.info("Proceso completado para todos los RUTs.")
     return respuestas_por_rut, prompts_por_rut
@@ -214,11 +271,13 @@ if __name__ == "__main__":
     )
 
     parser.add_argument("--new-bucket-data", action="store_true", help="Si se buscan datos directamente en S3.")
+    parser.add_argument("--s3-workers", type=int, default=S3_MAX_WORKERS, help="Descargas S3 simultáneas con --new-bucket-data.")
     parser.add_argument("--llm-model", type=str, default=LLM_MODEL_NAME_API, help="Nombre del modelo LLM a usar.")
     parser.add_argument("--llm-temperature", type=float, default=LLM_TEMPERATURE)
     parser.add_argument("--max-docs-per-rut", type=int, default=5, help="Máximo número de documentos a procesar por RUT.")
     parser.add_argument("--solo-un-rubro", action="store_true", help="Limita a un solo rubro del SII por RUT.")
     parser.add_argument("--inner_workers", type=int, default=INNER_WORKERS, help="Workers para llamadas a la API dentro de un RUT.")
+    parser.add_argument("--class_workers", type=int, default=OUTER_WORKERS, help="Clasificaciones simultáneas (independiente de inner_workers).")
     parser.add_argument(
         "--output-dir",
         type=str,
@@ -226,8 +285,17 @@ if __name__ == "__main__":
         help="Directorio donde se guardarán los resultados de la clasificación."
     )
     parser.add_argument("--tipo_muestreo", type=str, default="aleatorio", help="Tipo de muestreo sobre textos de cliente.")
+    parser.add_argument("--no-llm-cache", action="store_true", help="No consultar ni guardar respuestas en la cache del LLM.")
+    parser.add_argument("--resume", action="store_true", help="Omite los RUTs ya clasificados según el manifiesto de results_clas.")
+    parser.add_argument("--results-backend", choices=BACKENDS_RESULTADOS, default="pickle", help="Un pickle por RUT o shards JSONL rotativos.")
+    parser.add_argument("--max-intentos", type=int, default=None, help="Intentos por llamada al LLM ante 429/5xx/timeouts (por defecto LLM_MAX_INTENTOS).")
+    parser.add_argument("--deadline", type=float, default=None, help="Segundos máximos de espera de la respuesta por intento (por defecto LLM_DEADLINE_INTENTO).")
+    parser.add_argument("--hedge", action="store_true", help="Lanza un duplicado de las llamadas que superan la latencia p95 (gana la primera respuesta).")
 
     args = parser.parse_args()
+    if args.no_llm_cache:
+        disable_llm_cache()
+    configurar_politicas(args.max_intentos, args.deadline, args.hedge or None)
 
 
     # --- Obtener lista de RUTs ---
@@ -240,6 +308,9 @@ if __name__ == "__main__":
         ruts = sorted(list(set(ruts)))  # Eliminar duplicados
         logging.info(f"Total RUTs únicos a procesar: {len(ruts)}")
 
+    if args.resume:
+        ruts = manifiesto_de(CLASSIFICATION_RESULTS_DIR).pendientes(ruts, ETAPA_CLASIFICACION)
+
     if not ruts:
         logging.warning("No hay RUTs para procesar. Finalizando.")
         sys.exit(0)
@@ -256,6 +327,8 @@ if __name__ == "__main__":
             new_bucket_data=args.new_bucket_data
         )
 
+        if get_llm_cache() is not None:
+            get_llm_cache().log_stats()
         logging.info("Resultados de la ejecución:")
         for rut, prompts in prompts_generados.items():
             logging.info(f"RUT {rut}: {len(prompts)} prompts generados.")
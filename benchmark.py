@@ -0,0 +1,695 @@
+#benchmark.py
+
+import argparse
+import logging
+import time
+import tracemalloc
+from typing import Any, Callable, List, Tuple
+
+# --- Configuración de logging global ---
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+# =========================================================
+# --- UTILIDADES DE MEDICIÓN ---
+# =========================================================
+
+def medir(funcion: Callable[[], Any], repeticiones: int = 1) -> Tuple[Any, float]:
+    """Ejecuta `funcion` varias veces y devuelve (último resultado, mejor tiempo en segundos)."""
+    mejor = float("inf")
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return resultado, mejor
+
+
+def medir_memoria(funcion: Callable[[], Any]) -> int:
+    """Devuelve el peak de memoria (bytes) asignada por Python durante `funcion`."""
+    tracemalloc.start()
+    try:
+        funcion()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+# =========================================================
+# --- EXTRACCIÓN DE CAMPOS DTE (XML) ---
+# =========================================================
+
+def _dte_sintetico(i: int, lineas_detalle: int) -> bytes:
+    """Genera un DTE (ISO-8859-1) con `lineas_detalle` líneas de detalle y firma."""
+    detalle = "".join(
+        f"<Detalle><NroLinDet>{j}</NroLinDet><NmbItem>Producto {j} año {i}</NmbItem>"
+        f"<QtyItem>{j}</QtyItem><UnmdItem>UN</UnmdItem><PrcItem>{100 + j}</PrcItem>"
+        f"<MontoItem>{j * (100 + j)}</MontoItem></Detalle>"
+        for j in range(1, lineas_detalle + 1)
+    )
+    xml = (
+        '<?xml version="1.0" encoding="ISO-8859-1"?>'
+        "<SetDTE><DTE><Documento><Encabezado>"
+        f"<IdDoc><TipoDTE>33</TipoDTE><FchEmis>2024-03-{1 + i % 28:02d}</FchEmis><FmaPago>1</FmaPago></IdDoc>"
+        f"<Emisor><RUTEmisor>{76000000 + i}-K</RUTEmisor><RznSoc>Comercial Ñandú {i}</RznSoc>"
+        "<GiroEmis>VENTA AL POR MENOR</GiroEmis><Acteco>471100</Acteco><Acteco>479100</Acteco></Emisor>"
+        f"<Receptor><RUTRecep>{12000000 + i}-5</RUTRecep><RznSocRecep>Cliente {i}</RznSocRecep>"
+        "<GiroRecep>PARTICULAR</GiroRecep></Receptor>"
+        "<Totales><MntNeto>1000</MntNeto><TasaIVA>19</TasaIVA><IVA>190</IVA><MntTotal>1190</MntTotal></Totales>"
+        f"</Encabezado>{detalle}<TED><DD><RE>76000000-K</RE><FRMT>{'A' * 172}</FRMT></DD></TED></Documento>"
+        f"<Signature><SignedInfo>{'B' * 1500}</SignedInfo><X509Certificate>{'C' * 2000}</X509Certificate></Signature>"
+        "</DTE></SetDTE>"
+    )
+    return xml.encode("latin1")
+
+
+def benchmark_xml(n_docs: int, lineas_detalle: int) -> None:
+    """Compara xml_to_dict + extract_fields contra extract_fields_from_bytes."""
+    from data.get_data_bucket import decode_s3_body, parse_xml_string, extract_fields, extract_fields_from_bytes
+
+    docs = [_dte_sintetico(i, lineas_detalle) for i in range(n_docs)]
+
+    def actual() -> List[Tuple[str, str, str]]:
+        return [extract_fields(parse_xml_string(decode_s3_body(d))) for d in docs]
+
+    def rapido() -> List[Tuple[str, str, str]]:
+        return [extract_fields_from_bytes(d) for d in docs]
+
+    res_actual, t_actual = medir(actual, 3)
+    res_rapido, t_rapido = medir(rapido, 3)
+    assert res_actual == res_rapido, "Los extractores no producen el mismo resultado."
+
+    # Peak por documento: los resultados se descartan para medir solo las estructuras intermedias
+    peak_actual = medir_memoria(lambda: [extract_fields(parse_xml_string(decode_s3_body(d))) and None for d in docs[:50]])
+    peak_rapido = medir_memoria(lambda: [extract_fields_from_bytes(d) and None for d in docs[:50]])
+
+    logging.info("XML: %d documentos con %d líneas de detalle (resultados idénticos)", n_docs, lineas_detalle)
+    logging.info("  xml_to_dict + extract_fields: %8.1f docs/s | peak %.2f MB", n_docs / t_actual, peak_actual / 1e6)
+    logging.info("  extract_fields_from_bytes:    %8.1f docs/s | peak %.2f MB", n_docs / t_rapido, peak_rapido / 1e6)
+    logging.info("  speedup: x%.1f", t_actual / t_rapido)
+
+
+# =========================================================
+# --- DESCARGA DE XML DESDE S3 ---
+# =========================================================
+
+class _S3Simulado:
+    """
+    Sustituto local de un cliente boto3 S3 (list_objects_v2 paginado y get_object) con latencia
+    fija por solicitud. Cada `falla_cada` objetos, get_object lanza EndpointConnectionError.
+    """
+
+    def __init__(self, docs_por_rut: dict, latencia: float, falla_cada: int = 0):
+        self.docs_por_rut = docs_por_rut
+        self.latencia = latencia
+        self.falla_cada = falla_cada
+        self.fallidas = set()
+
+    def get_paginator(self, operacion: str) -> "_S3Simulado":
+        assert operacion == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket: str, Prefix: str):
+        time.sleep(self.latencia)
+        rut = Prefix.split("/")[1]
+        keys = [f"{Prefix}{j:05d}.xml" for j in range(len(self.docs_por_rut.get(rut, [])))]
+        for i in range(0, len(keys), 1000):
+            yield {"Contents": [{"Key": key, "ETag": f'"{key}"'} for key in keys[i:i + 1000]]}
+
+    def get_object(self, Bucket: str, Key: str) -> dict:
+        import io
+        from botocore.exceptions import EndpointConnectionError
+
+        time.sleep(self.latencia)
+        _, rut, archivo = Key.split("/")
+        j = int(archivo.removesuffix(".xml"))
+        if self.falla_cada and (int(rut) + j) % self.falla_cada == 0:
+            self.fallidas.add(Key)
+            raise EndpointConnectionError(endpoint_url="http://s3-simulado")
+        return {"Body": io.BytesIO(self.docs_por_rut[rut][j]), "ETag": f'"{Key}"'}
+
+
+def benchmark_s3(n_ruts: int, docs_por_rut: int, workers: int, latencia: float, falla_cada: int) -> None:
+    """Descarga secuencial (1 worker) contra el pool de hilos de descargar_textos_ruts, con un S3 simulado."""
+    import data.get_data_bucket as get_data_bucket
+
+    docs = {str(1000 + i): [_dte_sintetico(i * docs_por_rut + j, 5) for j in range(docs_por_rut)] for i in range(n_ruts)}
+    ruts = list(docs)
+    get_s3_cache = get_data_bucket.get_s3_cache
+    get_data_bucket.get_s3_cache = lambda: None  # sin cache en disco: se mide la descarga
+    logging.getLogger().setLevel(logging.CRITICAL)  # cada objeto fallido registra un error
+    try:
+        resultados = {}
+        for nombre, n_workers in (("secuencial", 1), (f"{workers} workers", workers)):
+            cliente = _S3Simulado(docs, latencia, falla_cada)
+            textos, segundos = medir(lambda: get_data_bucket.descargar_textos_ruts(cliente, "bucket", ruts, n_workers))
+            resultados[nombre] = (textos, segundos, len(cliente.fallidas))
+    finally:
+        get_data_bucket.get_s3_cache = get_s3_cache
+        logging.getLogger().setLevel(logging.INFO)
+
+    (textos_sec, _, _), (textos_par, _, _) = resultados.values()
+    assert textos_sec == textos_par, "La descarga en paralelo no produce los mismos textos por RUT."
+
+    n_objetos = n_ruts * docs_por_rut
+    logging.info("S3: %d RUTs x %d objetos, %.0f ms por solicitud (textos por RUT idénticos y en orden)",
+                 n_ruts, docs_por_rut, 1000 * latencia)
+    for nombre, (textos, segundos, fallidas) in resultados.items():
+        logging.info("  %-12s %6.2fs, %8.1f objetos/s, %d objetos fallidos omitidos, %d textos",
+                     nombre, segundos, n_objetos / segundos, fallidas, sum(len(t) for t in textos.values()))
+
+
+# =========================================================
+# --- MAPEO CÓDIGO DE ACTIVIDAD -> RUBRO ---
+# =========================================================
+
+def _map_codes_to_rubros_original(tabla_codigo_to_rubro, label_codes: list) -> list:
+    """Implementación original (un filtro del DataFrame por etiqueta), usada como referencia."""
+    rubros = []
+    for code in label_codes:
+        try:
+            int_code = int(code)
+            filtered_df = tabla_codigo_to_rubro[tabla_codigo_to_rubro['Codigo'] == int_code]
+            if not filtered_df.empty:
+                rubros.append(filtered_df['Rubro'].unique()[0])
+            else:
+                rubros.append('SIN RUBRO')
+        except (TypeError, ValueError):
+            rubros.append('SIN RUBRO')
+    return rubros
+
+
+def benchmark_rubros(n_labels: int, n_codigos: int) -> None:
+    """Compara map_codes_to_rubros contra la implementación original sobre una muestra."""
+    import random
+    import pandas as pd
+    from data.preprocessor import map_codes_to_rubros
+
+    random.seed(0)
+    tabla = pd.DataFrame({
+        'Codigo': [100000 + i for i in range(n_codigos)],
+        'Rubro': [f"RUBRO {i % 21}" for i in range(n_codigos)],
+    })
+    universo = [str(100000 + i) for i in range(int(n_codigos * 1.2))] + ['', 'abc', None, '0047']
+    labels = [random.choice(universo) for _ in range(n_labels)]
+
+    muestra = labels[:min(n_labels, 20000)]
+    _, t_original = medir(lambda: _map_codes_to_rubros_original(tabla, muestra))
+    assert _map_codes_to_rubros_original(tabla, muestra) == map_codes_to_rubros(tabla, muestra), \
+        "El mapeo vectorizado no coincide con el original."
+    _, t_nuevo = medir(lambda: map_codes_to_rubros(tabla, labels), 3)
+
+    logging.info("Rubros: %d etiquetas, %d códigos (resultados idénticos en la muestra)", n_labels, n_codigos)
+    logging.info("  original:    %12.0f etiquetas/s (medido sobre %d)", len(muestra) / t_original, len(muestra))
+    logging.info("  vectorizado: %12.0f etiquetas/s (%.2fs en total)", n_labels / t_nuevo, t_nuevo)
+
+
+# =========================================================
+# --- EXTRACCIÓN DE RUTS Y GIRO DESDE TEXTOS ---
+# =========================================================
+
+def _extract_ruts_and_giros_original(texts_codes: list):
+    """Implementación original (seis búsquedas por texto), usada como referencia."""
+    import re
+    import numpy as np
+    ruts_emisor = np.array([
+        re.search(r'RUTEmisor:([0-9\-Kk]+)', text).group(1)
+        if re.search(r'RUTEmisor:([0-9\-Kk]+)', text) else None
+        for text in texts_codes
+    ])
+    ruts_receptor = np.array([
+        re.search(r'RUTRecep:([0-9\-Kk]+)', text).group(1)
+        if re.search(r'RUTRecep:([0-9\-Kk]+)', text) else None
+        for text in texts_codes
+    ])
+    rubro_receptor = np.array([
+        re.search(r'GiroRecep:(.*?)(?=\s\w+:|$)', text).group(1).strip()
+        if re.search(r'GiroRecep:(.*?)(?=\s\w+:|$)', text) else None
+        for text in texts_codes
+    ])
+    return ruts_emisor, ruts_receptor, rubro_receptor
+
+
+def _texto_sintetico(i: int, rng) -> str:
+    """Texto con el formato de textos_etiquetas_NEW_code.txt (algunos sin receptor o sin giro)."""
+    partes = [f"TipoDTE:33 FchEmis:2024-0{1 + i % 9}-1{i % 10}", f"RUTEmisor:{76000000 + i % 50000}-{i % 10}",
+              f"RznSocEmisor:Comercial {i % 977} SpA"]
+    if rng.random() > 0.05:
+        partes.append(f"RUTRecep:{10000000 + i % 300000}-K RznSocRecep:Cliente {i % 311}")
+    if rng.random() > 0.1:
+        partes.append(f"GiroRecep:{rng.choice(['VENTA DE ARTICULOS', 'TRANSPORTE', 'PARTICULAR', ''])}")
+    partes.append("MntNeto:1000 TasaIVA:19 IVA:190 MntTotal:1190 B2C:0")
+    partes.extend(f"NroLinDet:{j} NmbItem:Producto {j} QtyItem:1 PrcItem:10 MontoItem:10" for j in range(1, 4))
+    return " ".join(partes)
+
+
+def benchmark_extraccion(n_textos: int, n_procesos: int) -> None:
+    """Compara la extracción con patrones precompilados (y multiproceso) contra las seis búsquedas originales."""
+    import random
+    from data.preprocessor import extract_ruts_and_giros_from_texts_codes
+
+    rng = random.Random(0)
+    textos = [_texto_sintetico(i, rng) for i in range(n_textos)]
+
+    original, t_original = medir(lambda: _extract_ruts_and_giros_original(textos))
+    compilado, t_compilado = medir(lambda: extract_ruts_and_giros_from_texts_codes(textos))
+    paralelo, t_paralelo = medir(lambda: extract_ruts_and_giros_from_texts_codes(textos, n_procesos=n_procesos))
+    for res in (compilado, paralelo):
+        assert all(a.dtype == b.dtype and a.tolist() == b.tolist() for a, b in zip(original, res)), \
+            "La extracción no coincide con la original."
+
+    logging.info("Extracción RUTs/giro: %d textos (resultados idénticos)", n_textos)
+    logging.info("  original (6 búsquedas):  %10.0f textos/s", n_textos / t_original)
+    logging.info("  compilado (3 búsquedas): %10.0f textos/s", n_textos / t_compilado)
+    logging.info("  compilado, %d procesos:   %10.0f textos/s", n_procesos, n_textos / t_paralelo)
+
+
+# =========================================================
+# --- ESCRITURA DE RESULTADOS DESDE CÓDIGO ASYNC ---
+# =========================================================
+
+def _resultado_sintetico(i: int, n_docs: int) -> dict:
+    texto = "Producto de prueba con descripción larga " * 40
+    return {
+        "rut": f"{76000000 + i}-0",
+        "documentos_emisor_original": [texto] * n_docs,
+        "completaciones_emisor_limpias": [texto] * n_docs,
+    }
+
+
+async def _simular_escrituras(n_ruts: int, workers: int, n_docs: int, directorio: str, en_hilo: bool):
+    import asyncio
+    from utils.loop_monitor import MonitorLatenciaLoop
+    from utils.result_store import ResultadosPickle, EscritorResultados
+
+    almacen = ResultadosPickle(directorio, "salida_rubro")
+    escritor = EscritorResultados(almacen) if en_hilo else None
+    semaforo = asyncio.Semaphore(workers)
+    monitor = MonitorLatenciaLoop(intervalo=0.01).iniciar()
+
+    async def procesar(i: int) -> None:
+        async with semaforo:
+            await asyncio.sleep(0.005)  # simula la llamada HTTP
+            data = _resultado_sintetico(i, n_docs)
+            if escritor is not None:
+                await escritor.guardar(data["rut"], data)
+            else:
+                almacen.guardar(data["rut"], data)
+
+    await asyncio.gather(*(procesar(i) for i in range(n_ruts)))
+    if escritor is not None:
+        await escritor.drenar()
+        escritor.cerrar()
+    await monitor.detener()
+    return monitor
+
+
+def benchmark_escritura(n_ruts: int, workers: int, n_docs: int) -> None:
+    """Compara el atraso del event loop al guardar resultados en la corrutina contra el hilo escritor."""
+    import asyncio
+    import tempfile
+
+    logging.getLogger().setLevel(logging.WARNING)  # guardar_pickle registra cada archivo
+    resultados = {}
+    for nombre, en_hilo in (("síncrono en el loop", False), ("hilo escritor", True)):
+        with tempfile.TemporaryDirectory() as directorio:
+            monitor, segundos = medir(lambda: asyncio.run(
+                _simular_escrituras(n_ruts, workers, n_docs, directorio, en_hilo)
+            ))
+        resultados[nombre] = (segundos, monitor.p99(), monitor.maximo)
+    logging.getLogger().setLevel(logging.INFO)
+
+    logging.info("Escritura de resultados: %d RUTs, %d workers, %d documentos por RUT", n_ruts, workers, n_docs)
+    for nombre, (segundos, p99, maximo) in resultados.items():
+        logging.info("  %-20s %6.2fs, atraso del loop p99 %6.1f ms, máximo %6.1f ms",
+                     nombre, segundos, 1000 * p99, 1000 * maximo)
+
+
+# =========================================================
+# --- PLANIFICACIÓN: LOTES CON BARRERA VS VENTANA DESLIZANTE ---
+# =========================================================
+
+async def _lotes_con_barrera(duraciones: List[float], workers: int, batch_size: int) -> None:
+    import asyncio
+
+    semaforo = asyncio.Semaphore(workers)
+
+    async def procesar(duracion: float) -> None:
+        async with semaforo:
+            await asyncio.sleep(duracion)
+
+    for i in range(0, len(duraciones), batch_size):
+        await asyncio.gather(*(procesar(d) for d in duraciones[i:i + batch_size]))
+
+
+def benchmark_ventana(n_ruts: int, workers: int, batch_size: int, lento_cada: int) -> None:
+    """Compara lotes con barrera contra la ventana deslizante con una carga sesgada (algunos RUTs muy lentos)."""
+    import asyncio
+    from utils.scheduler import procesar_en_ventana
+
+    # La mayoría de los RUTs tarda 20 ms; uno de cada `lento_cada` tarda 50 veces más
+    duraciones = [1.0 if i % lento_cada == 0 else 0.02 for i in range(n_ruts)]
+    optimo = sum(duraciones) / workers
+
+    _, t_barrera = medir(lambda: asyncio.run(_lotes_con_barrera(duraciones, workers, batch_size)))
+    _, t_ventana = medir(lambda: asyncio.run(
+        procesar_en_ventana(duraciones, asyncio.sleep, workers, desc="ventana")
+    ))
+
+    logging.info("Planificación: %d RUTs, %d workers, lotes de %d, 1 de cada %d RUTs lento",
+                 n_ruts, workers, batch_size, lento_cada)
+    logging.info("  cota inferior (trabajo / workers): %6.2fs", optimo)
+    logging.info("  lotes con barrera:                 %6.2fs (%6.1f RUTs/s)", t_barrera, n_ruts / t_barrera)
+    logging.info("  ventana deslizante:                %6.2fs (%6.1f RUTs/s)", t_ventana, n_ruts / t_ventana)
+
+
+# =========================================================
+# --- CONCURRENCIA ADAPTATIVA CONTRA UN BACKEND SIMULADO ---
+# =========================================================
+
+async def _llamadas_simuladas(n_llamadas: int, limitador, capacidad: int, latencia: float) -> Tuple[int, int]:
+    """Backend con `capacidad` slots: más allá encola (sube la latencia) y sobre 2x rechaza (429)."""
+    import asyncio
+
+    en_curso = 0
+    errores = 0
+    exitos = 0
+
+    async def llamar() -> None:
+        nonlocal en_curso, errores, exitos
+        while True:
+            try:
+                async with limitador:
+                    if en_curso >= 2 * capacidad:
+                        await asyncio.sleep(latencia / 10)
+                        raise RuntimeError("429 Too Many Requests")
+                    en_curso += 1
+                    try:
+                        await asyncio.sleep(latencia * max(1.0, en_curso / capacidad))
+                    finally:
+                        en_curso -= 1
+                exitos += 1
+                return
+            except RuntimeError:
+                errores += 1
+
+    await asyncio.gather(*(llamar() for _ in range(n_llamadas)))
+    return exitos, errores
+
+
+def benchmark_concurrencia(n_llamadas: int, capacidad: int, inicial: int, latencia: float) -> None:
+    """Compara un semáforo fijo (muy bajo o muy alto) contra el límite adaptativo."""
+    import asyncio
+    from utils.concurrency import LimitadorAdaptativo
+
+    logging.info("Concurrencia: %d llamadas, backend con capacidad %d y latencia base %.2fs",
+                 n_llamadas, capacidad, latencia)
+    casos = [
+        (f"semáforo fijo {inicial}", lambda: asyncio.Semaphore(inicial)),
+        (f"semáforo fijo {4 * capacidad}", lambda: asyncio.Semaphore(4 * capacidad)),
+        (f"adaptativo (parte en {inicial})", lambda: LimitadorAdaptativo("benchmark", inicial=inicial, intervalo_log=1e9)),
+    ]
+    for nombre, crear in casos:
+        limitadores = []
+
+        def correr():
+            limitadores.append(crear())
+            return asyncio.run(_llamadas_simuladas(n_llamadas, limitadores[-1], capacidad, latencia))
+
+        (exitos, errores), segundos = medir(correr)
+        extra = ""
+        if isinstance(limitadores[-1], LimitadorAdaptativo):
+            extra = f", límite final {int(limitadores[-1].limite)}"
+        logging.info("  %-26s %6.2fs (%6.1f llamadas/s), %d reintentos por 429%s",
+                     nombre, segundos, exitos / segundos, errores, extra)
+
+
+# =========================================================
+# --- POOL DE SERVIDORES OLLAMA (SERVIDORES SIMULADOS LOCALES) ---
+# =========================================================
+
+async def _servidor_ollama_simulado(capacidad: int, latencia: float, falla: bool = False):
+    """Servidor local que imita /api/chat de Ollama: `capacidad` llamadas a la vez (una GPU)."""
+    import asyncio
+    from aiohttp import web
+
+    gpu = asyncio.Semaphore(capacidad)
+
+    async def chat(request):
+        await request.json()
+        if falla:
+            raise web.HTTPServiceUnavailable()
+        async with gpu:
+            await asyncio.sleep(latencia)
+        return web.json_response({"message": {"content": "ok"}})
+
+    async def tags(request):
+        return web.json_response({"models": []})
+
+    app = web.Application()
+    app.add_routes([web.post("/api/chat", chat), web.get("/api/tags", tags)])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    sitio = web.TCPSite(runner, "127.0.0.1", 0)
+    await sitio.start()
+    puerto = sitio._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{puerto}"
+
+
+async def _llamadas_al_pool(n_llamadas: int, n_servidores: int, capacidad: int, latencia: float, con_caido: bool):
+    import asyncio
+    import aiohttp
+    from llm.endpoints import PoolOllama
+
+    servidores = [await _servidor_ollama_simulado(capacidad, latencia) for _ in range(n_servidores)]
+    if con_caido:
+        servidores.append(await _servidor_ollama_simulado(capacidad, latencia, falla=True))
+    pool = PoolOllama([url for _, url in servidores], max_por_endpoint=capacidad)
+    errores = 0
+
+    async def llamar(session) -> None:
+        nonlocal errores
+        for _ in range(5):  # el ruteo evita al caído, pero sus primeros fallos se reintentan
+            try:
+                async with pool.endpoint() as url_base:
+                    async with session.post(f"{url_base}/api/chat", json={"model": "x"}) as response:
+                        response.raise_for_status()
+                        await response.json()
+                return
+            except aiohttp.ClientError:
+                errores += 1
+
+    inicio = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(llamar(session) for _ in range(n_llamadas)))
+    segundos = time.perf_counter() - inicio
+    await pool.cerrar()
+    for runner, _ in servidores:
+        await runner.cleanup()
+    return segundos, errores
+
+
+def benchmark_endpoints(n_llamadas: int, capacidad: int, latencia: float) -> None:
+    """Throughput del pool de Ollama con 1, 2 y 4 servidores simulados (y con un servidor caído)."""
+    import asyncio
+
+    logging.info("Pool Ollama: %d llamadas, servidores con capacidad %d y latencia %.2fs",
+                 n_llamadas, capacidad, latencia)
+    base = None
+    for n_servidores, con_caido in ((1, False), (2, False), (4, False), (4, True)):
+        segundos, errores = asyncio.run(_llamadas_al_pool(n_llamadas, n_servidores, capacidad, latencia, con_caido))
+        tasa = n_llamadas / segundos
+        base = base or tasa
+        nombre = f"{n_servidores} servidores" + (" + 1 caído" if con_caido else "")
+        logging.info("  %-22s %6.2fs (%6.1f llamadas/s, %.2fx), %d errores", nombre, segundos, tasa, tasa / base, errores)
+
+
+# =========================================================
+# --- POLÍTICA DE LLAMADAS: REINTENTOS Y HEDGING ---
+# =========================================================
+
+async def _llamadas_con_politica(n_llamadas: int, politica, prob_error: float, prob_lenta: float, latencia: float):
+    """Llamadas simuladas: una fracción falla con 503 y otra tarda 20 veces más (cola de latencia)."""
+    import asyncio
+    import random
+    import aiohttp
+
+    rng = random.Random(0)
+
+    async def intento() -> str:
+        if rng.random() < prob_error:
+            await asyncio.sleep(latencia / 4)
+            raise aiohttp.ClientResponseError(None, (), status=503)
+        await asyncio.sleep(latencia * (20 if rng.random() < prob_lenta else rng.uniform(0.8, 1.2)))
+        return "ok"
+
+    latencias = []
+    fallidas = 0
+    semaforo = asyncio.Semaphore(32)
+
+    async def llamar() -> None:
+        nonlocal fallidas
+        async with semaforo:
+            inicio = time.perf_counter()
+            try:
+                await politica.ejecutar(intento)
+                latencias.append(time.perf_counter() - inicio)
+            except aiohttp.ClientResponseError:
+                fallidas += 1
+
+    await asyncio.gather(*(llamar() for _ in range(n_llamadas)))
+    latencias.sort()
+    return fallidas, latencias[len(latencias) // 2], latencias[int(len(latencias) * 0.99)]
+
+
+def benchmark_politica(n_llamadas: int, prob_error: float, prob_lenta: float, latencia: float) -> None:
+    """Documentos perdidos y latencia p99 sin reintentos, con reintentos y con reintentos + hedging."""
+    import asyncio
+    from llm.policy import PoliticaLlamadas
+
+    logging.info("Política de llamadas: %d llamadas, %.0f%% con error 503, %.0f%% lentas (20x)",
+                 n_llamadas, 100 * prob_error, 100 * prob_lenta)
+    casos = [
+        ("sin reintentos", dict(max_intentos=1)),
+        ("reintentos", dict(max_intentos=4, backoff_base=latencia)),
+        ("reintentos + hedging", dict(max_intentos=4, backoff_base=latencia, hedging=True)),
+    ]
+    for nombre, opciones in casos:
+        politica = PoliticaLlamadas(nombre, **opciones)
+        fallidas, p50, p99 = asyncio.run(_llamadas_con_politica(n_llamadas, politica, prob_error, prob_lenta, latencia))
+        logging.info("  %-22s %4d perdidas, p50 %6.3fs, p99 %6.3fs, %d reintentos, %d hedges (%d ganados)",
+                     nombre, fallidas, p50, p99, politica.reintentos, politica.hedges, politica.hedges_ganados)
+
+
+# =========================================================
+# --- MUESTREO DE DOCUMENTOS POR RUT ---
+# =========================================================
+
+def _documentos_sinteticos(n_docs: int, n_productos: int, rng) -> List[str]:
+    """Documentos de un RUT: pocos productos concentran casi todas las ventas (distribución de Zipf)."""
+    tipos = ["cemento", "pintura", "tornillo", "fierro", "ceramica", "madera", "cable", "tubo", "llave", "adhesivo"]
+    marcas = ["polpaico", "sipa", "tricolor", "cintac", "cordillera", "arauco", "madeco", "vinilit", "stretto", "topex"]
+    formatos = ["saco 25kg", "galon", "caja 100 un", "barra 6m", "m2", "pulgada 2x4", "rollo 100m", "pvc 110mm", "paso 1/2", "pote 1kg"]
+    productos_nombre = [f"{rng.choice(tipos)} {rng.choice(marcas)} {rng.choice(formatos)}" for _ in range(n_productos)]
+    clientes = [f"{rng.choice(['constructora', 'inmobiliaria', 'comercial', 'ferreteria'])} {rng.choice(marcas)}{k} limitada"
+                for k in range(300)]
+    pesos = [1 / (k + 1) ** 1.5 for k in range(n_productos)]
+    productos = rng.choices(range(n_productos), weights=pesos, k=n_docs)
+    return [
+        f"TipoDTE:33 FchEmis:2024-{1 + i % 12:02d}-{1 + i % 28:02d} RznSocEmisor:Comercial SpA "
+        f"RznSocRecep:{rng.choice(clientes)} GiroRecep:construccion MntNeto:{i} "
+        f"NroLinDet:1 NmbItem:{productos_nombre[p]} QtyItem:1 PrcItem:10"
+        for i, p in enumerate(productos)
+    ]
+
+
+def benchmark_muestreo(n_docs: int, n_productos: int, n_muestras: int, repeticiones: int) -> None:
+    """Productos distintos cubiertos por la muestra de cada método, y tiempo de muestreo de un RUT."""
+    import random
+    import re
+    from utils.helpers import samplear_documentos_por_rut
+
+    rng = random.Random(0)
+    rut_dict = {"1-9": {"emisor": _documentos_sinteticos(n_docs, n_productos, rng), "receptor": []}}
+    logging.info("Muestreo: 1 RUT con %d documentos de %d productos, %d muestras", n_docs, n_productos, n_muestras)
+    for metodo in ("aleatorio", "estratificado", "diverso"):
+        distintos = 0
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            muestra = samplear_documentos_por_rut(rut_dict, ["1-9"], metodo, n_muestras)["1-9"]["emisor"]
+            distintos += len({re.search(r"NmbItem:(.*?) QtyItem", doc).group(1) for doc in muestra})
+        segundos = (time.perf_counter() - inicio) / repeticiones
+        logging.info("  %-14s %.2f productos distintos por muestra, %.3fs por RUT", metodo, distintos / repeticiones, segundos)
+
+
+# =========================================================
+# --- PUNTO DE ENTRADA PRINCIPAL ---
+# =========================================================
+
+def main() -> None:
+    """Ejecuta los micro-benchmarks seleccionados con datos sintéticos."""
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de las etapas de carga y preprocesamiento.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    p_xml = subparsers.add_parser("xml", help="Extracción de campos desde XML de DTE.")
+    p_xml.add_argument("--docs", type=int, default=2000)
+    p_xml.add_argument("--lineas-detalle", type=int, default=200)
+
+    p_s3 = subparsers.add_parser("s3", help="Descarga de XML desde un S3 simulado (secuencial vs pool de hilos).")
+    p_s3.add_argument("--ruts", type=int, default=50)
+    p_s3.add_argument("--docs", type=int, default=20)
+    p_s3.add_argument("--workers", type=int, default=32)
+    p_s3.add_argument("--latencia", type=float, default=0.005)
+    p_s3.add_argument("--falla-cada", type=int, default=97)
+
+    p_rubros = subparsers.add_parser("rubros", help="Mapeo de códigos de actividad a rubros.")
+    p_rubros.add_argument("--labels", type=int, default=2_000_000)
+    p_rubros.add_argument("--codigos", type=int, default=700)
+
+    p_extraccion = subparsers.add_parser("extraccion", help="Extracción de RUTs y giro desde los textos.")
+    p_extraccion.add_argument("--textos", type=int, default=1_000_000)
+    p_extraccion.add_argument("--procesos", type=int, default=4)
+
+    p_escritura = subparsers.add_parser("escritura", help="Atraso del event loop al guardar resultados.")
+    p_escritura.add_argument("--ruts", type=int, default=2000)
+    p_escritura.add_argument("--workers", type=int, default=64)
+    p_escritura.add_argument("--docs", type=int, default=50)
+
+    p_ventana = subparsers.add_parser("ventana", help="Lotes con barrera vs ventana deslizante con carga sesgada.")
+    p_ventana.add_argument("--ruts", type=int, default=1000)
+    p_ventana.add_argument("--workers", type=int, default=8)
+    p_ventana.add_argument("--batch-size", type=int, default=40)
+    p_ventana.add_argument("--lento-cada", type=int, default=40)
+
+    p_concurrencia = subparsers.add_parser("concurrencia", help="Semáforo fijo vs límite adaptativo (AIMD).")
+    p_concurrencia.add_argument("--llamadas", type=int, default=1000)
+    p_concurrencia.add_argument("--capacidad", type=int, default=16)
+    p_concurrencia.add_argument("--inicial", type=int, default=4)
+    p_concurrencia.add_argument("--latencia", type=float, default=0.05)
+
+    p_endpoints = subparsers.add_parser("endpoints", help="Escalamiento del pool de servidores Ollama.")
+    p_endpoints.add_argument("--llamadas", type=int, default=800)
+    p_endpoints.add_argument("--capacidad", type=int, default=4)
+    p_endpoints.add_argument("--latencia", type=float, default=0.05)
+
+    p_politica = subparsers.add_parser("politica", help="Reintentos con backoff y hedging de llamadas al LLM.")
+    p_politica.add_argument("--llamadas", type=int, default=1000)
+    p_politica.add_argument("--prob-error", type=float, default=0.1)
+    p_politica.add_argument("--prob-lenta", type=float, default=0.03)
+    p_politica.add_argument("--latencia", type=float, default=0.02)
+
+    p_muestreo = subparsers.add_parser("muestreo", help="Cobertura de productos del muestreo aleatorio, estratificado y diverso.")
+    p_muestreo.add_argument("--docs", type=int, default=100_000)
+    p_muestreo.add_argument("--productos", type=int, default=50)
+    p_muestreo.add_argument("--muestras", type=int, default=5)
+    p_muestreo.add_argument("--repeticiones", type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.benchmark == "xml":
+        benchmark_xml(args.docs, args.lineas_detalle)
+    elif args.benchmark == "s3":
+        benchmark_s3(args.ruts, args.docs, args.workers, args.latencia, args.falla_cada)
+    elif args.benchmark == "rubros":
+        benchmark_rubros(args.labels, args.codigos)
+    elif args.benchmark == "extraccion":
+        benchmark_extraccion(args.textos, args.procesos)
+    elif args.benchmark == "escritura":
+        benchmark_escritura(args.ruts, args.workers, args.docs)
+    elif args.benchmark == "ventana":
+        benchmark_ventana(args.ruts, args.workers, args.batch_size, args.lento_cada)
+    elif args.benchmark == "concurrencia":
+        benchmark_concurrencia(args.llamadas, args.capacidad, args.inicial, args.latencia)
+    elif args.benchmark == "endpoints":
+        benchmark_endpoints(args.llamadas, args.capacidad, args.latencia)
+    elif args.benchmark == "politica":
+        benchmark_politica(args.llamadas, args.prob_error, args.prob_lenta, args.latencia)
+    elif args.benchmark == "muestreo":
+        benchmark_muestreo(args.docs, args.productos, args.muestras, args.repeticiones)
+
+
+if __name__ == "__main__":
+    main()
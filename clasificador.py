@@ -9,13 +9,28 @@ from tqdm.asyncio import tqdm as async_tqdm
 from typing import List, Dict, Any, Optional
 
 # --- Importaciones del proyecto ---
-from llm.prompts import (generar_prompt_clasificacion, generar_prompt2)
+from llm.prompts import (generar_prompt_clasificacion_presupuestado, generar_prompt2, anotar_repeticiones)
+from llm.tokens import (
+    estimar_tokens, elegir_num_ctx, presupuesto_prompt, get_estadisticas_prompts, log_stats_prompts
+)
+from llm.cache import llave_llm, respuesta_con_cache, get_llm_cache, disable_llm_cache
+from llm.policy import get_politica, configurar_politicas, log_stats_politicas
+from llm.endpoints import configurar_pool_ollama, get_pool_ollama
+from utils.result_store import crear_escritor, BACKENDS_RESULTADOS
+from utils.loop_monitor import MonitorLatenciaLoop
+from utils.scheduler import procesar_en_ventana
+from utils.concurrency import LimitadorAdaptativo
+from utils.http_client import crear_sesion_http, EstadisticasConexiones
+from utils.manifest import (
+    RunManifest, manifiesto_de, ETAPA_CLASIFICACION, ESTADO_OK, ESTADO_ERROR
+)
 from utils.helpers import (
     extraer_contenido_entre_llaves, guardar_pickle, load_ruts_from_file, cargar_datos,OnlyAnswer
 )
 from config import (
-    OLLAMA_BASE_URL, RESULTS_DIR, CLASSIFICATION_RESULTS_DIR, LLM_MODEL_NAME, LLM_TEMPERATURE,
-    OUTER_WORKERS, RESUMEN_RUBROS_ADICIONALES
+    RESULTS_DIR, CLASSIFICATION_RESULTS_DIR, LLM_MODEL_NAME, LLM_TEMPERATURE,
+    OUTER_WORKERS, RESUMEN_RUBROS_ADICIONALES,
+    LLM_NUM_CTX_CLASIFICACION, LLM_TOKENS_RESPUESTA_CLASIFICACION
 )
 
 # --- Configuración de logging ---
@@ -33,36 +48,98 @@ async def _async_call_aiohttp(
     prompt: str,
     model: str,
     temp: float,
-    semaphore: asyncio.Semaphore
+    limitador: LimitadorAdaptativo
 ) -> Dict[str, Any]:
     """
-    Llamada genérica a la API de Ollama usando aiohttp.
+    Llamada genérica a la API de Ollama usando aiohttp, en el servidor del pool con menos
+    llamadas en curso. Los errores transitorios se reintentan según la política de la etapa.
+    num_ctx es el menor contexto permitido (LLM_NUM_CTX_CLASIFICACION) en que caben el prompt y la respuesta.
+    Solo se guardan en la cache del LLM las respuestas que contienen un JSON válido.
     """
-    url = f"{OLLAMA_BASE_URL}/api/chat"
+    num_ctx = elegir_num_ctx(prompt, LLM_TOKENS_RESPUESTA_CLASIFICACION, LLM_NUM_CTX_CLASIFICACION)
+    get_estadisticas_prompts("clasificación").registrar(estimar_tokens(prompt), num_ctx)
+    options = {"temperature": temp, "num_ctx": num_ctx}
     payload = {
         "model": model,
         "messages": [{"role": "user", "content": prompt}],
         "stream": False,
         "format": "json",
-        "options": {"temperature": temp, "num_ctx": 5000}
+        "options": options
     }
-    #timeout = aiohttp.ClientTimeout(total=300)
-    timeout = aiohttp.ClientTimeout(total=None, connect=10, sock_connect=10, sock_read=None)
-    
-    async with semaphore:
-        try:
-            async with session.post(url, json=payload, timeout=timeout) as response:
+    politica = get_politica("clasificación")
+    timeout = politica.timeout_http()
+
+    async def _llamar() -> str:
+        async with limitador, get_pool_ollama().endpoint() as url_base:
+            async with session.post(f"{url_base}/api/chat", json=payload, timeout=timeout) as response:
                 response.raise_for_status()
                 data = await response.json()
-              #  print('DATA',data)
-                content = data.get("message", {}).get("content", "").strip()
-                return extraer_contenido_entre_llaves(content) or {
-                    "error": "Contenido JSON no encontrado",
-                    "justification": "Error de parseo."
-                }
-        except Exception as e:
-            async_tqdm.write(f"Error en la llamada aiohttp: {e}")
-            return {"error": str(e), "justification": f"Error en la llamada a la API: {e}"}
+                return data.get("message", {}).get("content", "").strip()
+
+    try:
+        content = await respuesta_con_cache(
+            llave_llm("ollama", model, temp, {"format": "json", **options}, prompt),
+            lambda: politica.ejecutar(_llamar),
+            es_valida=lambda c: bool(extraer_contenido_entre_llaves(c))
+        )
+        return extraer_contenido_entre_llaves(content) or {
+            "error": "Contenido JSON no encontrado",
+            "justification": "Error de parseo."
+        }
+    except Exception as e:
+        async_tqdm.write(f"Error en la llamada aiohttp: {e}")
+        return {"error": str(e), "justification": f"Error en la llamada a la API: {e}"}
+
+
+async def clasificar_rut(
+    session: aiohttp.ClientSession,
+    rut_data: Dict[str, Any],
+    model: str,
+    temperature: float,
+    limitador: LimitadorAdaptativo
+) -> bool:
+    """
+    Genera el prompt de clasificación de un RUT, llama al LLM y agrega a `rut_data` los campos
+    'clasificacion_economica' y 'justification'. No guarda el resultado.
+    Cada completación indica cuántos documentos idénticos representa ('repeticiones_completaciones_emisor').
+    El prompt incluye solo las completaciones que caben en el mayor contexto permitido; las
+    descartadas quedan en el log.
+
+    Returns:
+        True si el LLM entregó una clasificación (sin error de llamada ni de parseo).
+    """
+    completaciones_emisor = anotar_repeticiones(
+        rut_data.get('completaciones_emisor_limpias', []),
+        rut_data.get('repeticiones_completaciones_emisor')
+    )
+    completaciones_receptor = rut_data.get('completaciones_receptor_limpias', [])
+    prompt, descartadas = generar_prompt_clasificacion_presupuestado(
+        completaciones_emisor,
+        completaciones_receptor,
+        RESUMEN_RUBROS_ADICIONALES,
+        rut_data.get('giros_declarados_rut', []),
+        generar_prompt2,
+        presupuesto_prompt(LLM_NUM_CTX_CLASIFICACION, LLM_TOKENS_RESPUESTA_CLASIFICACION)
+    )
+    if descartadas:
+        total = len(completaciones_emisor) + len(completaciones_receptor)
+        get_estadisticas_prompts("clasificación").registrar_recorte(descartadas)
+        async_tqdm.write(
+            f"--- RUT {rut_data.get('rut', 'RUT_DESCONOCIDO')}: {descartadas}/{total} completaciones "
+            f"no caben en el contexto de clasificación y se omiten del prompt."
+        )
+
+    response_json: Dict[str, Any] = await _async_call_aiohttp(
+        session, prompt, model, temperature, limitador
+    )
+
+    if response_json:
+        rut_data['clasificacion_economica'] = response_json.get("main_rubros", ["UNKNOWN_RUBRO"])
+        rut_data['justification'] = response_json.get("justification", "Respuesta no procesada")
+    else:
+        rut_data['clasificacion_economica'] = ["API_ERROR"]
+        rut_data['justification'] = "Error en llamada a la API"
+    return bool(response_json) and "error" not in response_json
 
 
 async def run_classification_batch(
@@ -70,47 +147,55 @@ async def run_classification_batch(
     model: str,
     temperature: float,
     output_dir: str,
-    workers: int
+    workers: int,
+    manifest: Optional[RunManifest] = None,
+    almacen=None,
+    checkpoint_cada: Optional[int] = None
 ) -> None:
     """
-    Clasifica un batch de RUTs en paralelo (1 prompt por RUT).
+    Clasifica un batch de RUTs en paralelo (1 prompt por RUT), con una ventana deslizante de
+    RUTs en curso: apenas uno termina se admite el siguiente. Las llamadas simultáneas al LLM
+    las regula un límite adaptativo (AIMD) que parte en `workers`.
+    Los resultados van a `almacen`, un EscritorResultados (por defecto un pickle por RUT en
+    output_dir) que escribe fuera del event loop; cada `checkpoint_cada` RUTs y al terminar se
+    espera a que todo esté en disco. Si se entrega `manifest`, se registra el estado de cada
+    RUT (para --resume).
     """
     os.makedirs(output_dir, exist_ok=True)
-    outer_semaphore = asyncio.Semaphore(workers)
+    limitador = LimitadorAdaptativo("clasificación", inicial=workers)
+    escritor_propio = almacen is None
+    if escritor_propio:
+        almacen = crear_escritor("pickle", output_dir, "clasificacion")
 
-    async with aiohttp.ClientSession() as session:
+    estadisticas_http = EstadisticasConexiones()
+    async with crear_sesion_http(limit=limitador.maximo, estadisticas=estadisticas_http) as session:
 
         async def classify_rut(rut_data: Dict[str, Any]) -> None:
             """
-            Genera prompt de clasificación y guarda resultado en un pickle.
+            Clasifica un RUT y guarda el resultado en el almacén.
             """
             rut: str = rut_data.get('rut', 'RUT_DESCONOCIDO')
-            prompt: str = generar_prompt_clasificacion(
-                rut_data.get('completaciones_emisor_limpias', []),
-                rut_data.get('completaciones_receptor_limpias', []),
-                RESUMEN_RUBROS_ADICIONALES,
-                rut_data.get('giros_declarados_rut', []),
-                generar_prompt2
+            ok = await clasificar_rut(session, rut_data, model, temperature, limitador)
+            await almacen.guardar(
+                rut, rut_data,
+                manifest.al_guardar(rut, ETAPA_CLASIFICACION, ESTADO_OK if ok else ESTADO_ERROR) if manifest else None
             )
-            
-            response_json: Dict[str, Any] = await _async_call_aiohttp(
-                session, prompt, model, temperature, outer_semaphore
-            )
-
-            if response_json:
-                rut_data['clasificacion_economica'] = response_json.get("main_rubros", ["UNKNOWN_RUBRO"])
-                rut_data['justification'] = response_json.get("justification", "Respuesta no procesada")
-            else:
-                rut_data['clasificacion_economica'] = ["API_ERROR"]
-                rut_data['justification'] = "Error en llamada a la API"
-
-            guardar_pickle(rut_data, f"clasificacion_{rut}.pkl", output_dir)
 
-        tasks = [classify_rut(data) for data in rut_data_list]
-        for future in async_tqdm.as_completed(tasks, total=len(tasks), desc="Clasificando RUTs"):
-            await future
+        # La ventana admite hasta el máximo del límite adaptativo; el límite decide cuántos llaman a la vez
+        await procesar_en_ventana(
+            rut_data_list, classify_rut, max(workers, limitador.maximo),
+            checkpoint_cada=checkpoint_cada,
+            al_checkpoint=lambda _: almacen.drenar(),
+            desc="Clasificando RUTs"
+        )
 
-    logging.info(f"Lote completado. {len(rut_data_list)} archivos guardados/actualizados en '{output_dir}'.")
+    estadisticas_http.log_stats("Conexiones HTTP")
+    limitador.log_stats()
+    if escritor_propio:
+        almacen.cerrar()
+    else:
+        await almacen.drenar()
+    logging.info(f"Clasificación completada. {len(rut_data_list)} resultados guardados/actualizados en '{output_dir}'.")
 
 
 # =========================================================
@@ -130,9 +215,21 @@ async def main() -> None:
     parser.add_argument("--llm-model", type=str, default=LLM_MODEL_NAME)
     parser.add_argument("--temperature", type=float, default=LLM_TEMPERATURE)
     parser.add_argument("--workers", type=int, default=OUTER_WORKERS)
-    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=500, help="Cada cuántos RUTs se drenan los resultados a disco y se registra el avance.")
+    parser.add_argument("--no-llm-cache", action="store_true", help="No consultar ni guardar respuestas en la cache del LLM.")
+    parser.add_argument("--resume", action="store_true", help="Omite los RUTs ya clasificados según el manifiesto de --output-dir.")
+    parser.add_argument("--results-backend", choices=BACKENDS_RESULTADOS, default="pickle", help="Un pickle por RUT o shards JSONL rotativos.")
+    parser.add_argument("--max-intentos", type=int, default=None, help="Intentos por llamada al LLM ante 429/5xx/timeouts (por defecto LLM_MAX_INTENTOS).")
+    parser.add_argument("--deadline", type=float, default=None, help="Segundos máximos de espera de la respuesta por intento (por defecto LLM_DEADLINE_INTENTO).")
+    parser.add_argument("--hedge", action="store_true", help="Lanza un duplicado de las llamadas que superan la latencia p95 (gana la primera respuesta).")
+    parser.add_argument("--ollama-urls", nargs='+', default=None, help="Servidores Ollama del pool (por defecto OLLAMA_URLS u OLLAMA_URL).")
+    parser.add_argument("--max-per-endpoint", type=int, default=None, help="Llamadas simultáneas por servidor Ollama (0 = sin tope).")
     
     args = parser.parse_args()
+    if args.no_llm_cache:
+        disable_llm_cache()
+    configurar_politicas(args.max_intentos, args.deadline, args.hedge or None)
+    pool_ollama = configurar_pool_ollama(args.ollama_urls, args.max_per_endpoint)
     
     ruts: List[str] = []
     if args.rut_list:
@@ -140,6 +237,10 @@ async def main() -> None:
             ruts.extend(load_ruts_from_file(path))
         ruts = sorted(list(set(ruts)))
     logging.info(f"Total RUTs únicos a procesar: {len(ruts)}")
+
+    manifest = manifiesto_de(args.output_dir)
+    if args.resume:
+        ruts = manifest.pendientes(ruts, ETAPA_CLASIFICACION)
     
     
     #datos_a_procesar: List[Dict[str, Any]] = cargar_datos_desde_zip(args.input_zip, ruts)
@@ -149,19 +250,31 @@ async def main() -> None:
         logging.warning("No se encontraron datos para procesar. Finalizando.")
         return
 
-    total_batches: int = -(-len(datos_a_procesar) // args.batch_size)
-    for i in range(0, len(datos_a_procesar), args.batch_size):
-        batch_data: List[Dict[str, Any]] = datos_a_procesar[i:i + args.batch_size]
-        logging.info(f"Procesando Lote {i//args.batch_size + 1}/{total_batches} ({len(batch_data)} RUTs)")
-        
+    almacen = crear_escritor(args.results_backend, args.output_dir, "clasificacion")
+    monitor = MonitorLatenciaLoop().iniciar()
+    try:
         await run_classification_batch(
-            rut_data_list=batch_data,
+            rut_data_list=datos_a_procesar,
             model=args.llm_model,
             temperature=args.temperature,
             output_dir=args.output_dir,
-            workers=args.workers
+            workers=args.workers,
+            manifest=manifest,
+            almacen=almacen,
+            checkpoint_cada=args.batch_size
         )
+    finally:
+        await monitor.detener()
+        almacen.cerrar()  # también ante Ctrl-C: lo ya clasificado queda en disco
+        almacen.log_stats("Resultados (clasificación)")
+        monitor.log_stats()
+        await pool_ollama.cerrar()
+        pool_ollama.log_stats()
+        log_stats_politicas()
+        log_stats_prompts()
 
+    if get_llm_cache() is not None:
+        get_llm_cache().log_stats()
     logging.info("Proceso completado para todos los lotes.")
 
 
@@ -19,8 +19,11 @@ os.makedirs(RESULTS_DIR, exist_ok=True)
 
 # --- Nombres de Archivos ---
 TEXT_DATA_FILENAME = "textos_etiquetas_NEW_code.txt" #contiene todos los textos sampleados desde el bucket. 
+CORPUS_STORE_FILENAME = "textos_etiquetas_NEW_code.parquet" #version compilada (columnar) del anterior. Se genera con: python -m data.corpus_store
+CORPUS_INDEX_DIRNAME = "textos_etiquetas_NEW_code.idx" #indice RUT -> offsets de lineas del TSV. Se genera con: python -m data.corpus_index
 ACTIVITY_CODES_FILENAME = "actividades_rubro_subrubro_limpio.xlsx" #este y el siguiente son archivos para obtener rubros economicos asoc. a ruts.
 SII_DATA_FILENAME = "v_sii_2.gzip"
+MANIFEST_FILENAME = "manifest.jsonl" #bitacora de estado por rut y etapa, dentro de cada carpeta de resultados (para --resume)
 
 # --- Configuración del LLM ---
 LLM_MODEL_NAME = 'deepseek-r1:32b' #nombre del modelo en ollama
@@ -37,12 +40,61 @@ URL_GPT = "https://api.openai.com/v1"
 #--- Numero de Workers para procesamiento paralelo----
 INNER_WORKERS=4 
 OUTER_WORKERS=2
-
-
-
+LLM_CONCURRENCIA_MAX = int(os.getenv("LLM_CONCURRENCIA_MAX", "64")) # tope del límite adaptativo de llamadas simultáneas al LLM (los workers son el valor inicial)
+S3_MAX_WORKERS = int(os.getenv("S3_MAX_WORKERS", "32")) # descargas simultáneas desde S3 (--new-bucket-data)
+
+#--- Muestreo 'diverso' de documentos (MinHash + LSH) ---
+MINHASH_PERMUTACIONES = 32 # largo de la firma MinHash de cada documento
+MINHASH_BANDAS = 16 # bandas LSH: con 32 permutaciones (2 filas por banda) casi todo par con Jaccard >= 0.5 queda como candidato
+MINHASH_UMBRAL = 0.5 # similitud de Jaccard estimada mínima con el centro del cluster
+
+#--- Almacén de resultados por shards (--results-backend shards) ---
+SHARD_MAX_BYTES = 256 * 1024**2 # tamaño a partir del cual se abre un shard nuevo
+SHARD_FLUSH_REGISTROS = 100 # registros acumulados en memoria antes de escribir al shard
+ESCRITOR_MAX_PENDIENTES = 1000 # resultados en espera del hilo escritor antes de frenar a los productores
+
+#--- Cache local de documentos S3 (los DTE no cambian una vez emitidos) ---
+CACHE_DIR = os.path.join(BASE_DIR, 'cache') # Caches locales regenerables
+S3_CACHE_DIR = os.path.join(CACHE_DIR, 's3')
+S3_CACHE_MAX_BYTES = int(os.getenv("S3_CACHE_MAX_BYTES", str(5 * 1024**3))) # 5 GB por defecto
+S3_CACHE_ENABLED = os.getenv("S3_CACHE_ENABLED", "1") != "0"
+
+#--- Cache binaria (pickle junto al archivo de origen) de tablas derivadas: xlsx de actividades y rubros del SII ---
+BINARY_CACHE_ENABLED = os.getenv("BINARY_CACHE_ENABLED", "1") != "0"
+SII_CACHE_MIN_RUTS = int(os.getenv("SII_CACHE_MIN_RUTS", "2000")) # desde esta cantidad de RUTs se usa el mapeo completo cacheado en vez del filtro por RUT
+
+#--- Cache persistente de respuestas del LLM (compartida por run_completion, clasificador y api_model) ---
+LLM_CACHE_PATH = os.path.join(CACHE_DIR, 'llm', 'respuestas.sqlite')
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(1024**3))) # 1 GB por defecto
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+
+
+
+#--- Política de llamadas al LLM: reintentos con backoff, deadline por intento y hedging ---
+LLM_MAX_INTENTOS = int(os.getenv("LLM_MAX_INTENTOS", "4")) # intentos por llamada ante 429/5xx/timeouts
+LLM_DEADLINE_INTENTO = float(os.getenv("LLM_DEADLINE_INTENTO", "300")) # segundos máximos de espera de la respuesta por intento
+LLM_BACKOFF_BASE = 1.0 # segundos; la espera máxima se duplica en cada reintento (con jitter)
+LLM_BACKOFF_MAX = 30.0
+LLM_HEDGE_PERCENTIL = 0.95 # con --hedge, se lanza un duplicado si un intento supera esta latencia
+
+#--- Presupuesto de tokens de los prompts ---
+LLM_CARACTERES_POR_TOKEN = float(os.getenv("LLM_CARACTERES_POR_TOKEN", "3.2")) # estimación conservadora para texto en español
+# Tamaños de contexto (num_ctx) permitidos en Ollama, separados por comas: se usa el menor que alcance.
+# Ollama recarga el modelo cada vez que cambia num_ctx, por eso por defecto hay un solo tamaño por etapa.
+LLM_NUM_CTX_COMPLETACION = sorted(int(n) for n in os.getenv("LLM_NUM_CTX_COMPLETACION", "4200").split(","))
+LLM_NUM_CTX_CLASIFICACION = sorted(int(n) for n in os.getenv("LLM_NUM_CTX_CLASIFICACION", "5000").split(","))
+LLM_TOKENS_RESPUESTA_COMPLETACION = 800 # tokens reservados en el contexto para la respuesta (incluye el razonamiento del modelo)
+LLM_TOKENS_RESPUESTA_CLASIFICACION = 1000
+API_MAX_TOKENS_PROMPT = int(os.getenv("API_MAX_TOKENS_PROMPT", "32000")) # tope del prompt de clasificación en api_model.py
 
 #-- URL de modelos---
 OLLAMA_BASE_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+# Pool de servidores Ollama: lista separada por comas (por defecto solo OLLAMA_BASE_URL)
+OLLAMA_URLS = [url.strip() for url in os.getenv("OLLAMA_URLS", OLLAMA_BASE_URL).split(",") if url.strip()]
+OLLAMA_MAX_POR_ENDPOINT = int(os.getenv("OLLAMA_MAX_POR_ENDPOINT", "0")) # llamadas simultáneas por servidor (0 = sin tope)
+OLLAMA_FALLOS_EXPULSION = 3 # errores seguidos para sacar un servidor del pool
+OLLAMA_FACTOR_LENTO = 3.0 # se saca un servidor si su latencia promedio supera este factor de la del más rápido
+OLLAMA_HEALTH_INTERVALO = 10.0 # segundos entre health checks de los servidores expulsados
 
 #OLLAMA_PORT = os.getenv("OLLAMA_PORT", "11434")
 #OLLAMA_BASE_URL = f"http://localhost:{OLLAMA_PORT}"
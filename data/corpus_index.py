@@ -0,0 +1,213 @@
+# data/corpus_index.py
+
+import os
+import json
+import mmap
+import time
+import array
+import shutil
+import hashlib
+import argparse
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import DATA_DIR, TEXT_DATA_FILENAME, CORPUS_INDEX_DIRNAME
+from data.corpus_store import _firma_archivo
+from data.preprocessor import _PATRON_RUT_EMISOR, _PATRON_RUT_RECEPTOR
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+# Archivos del índice (arrays .npy que se abren con mmap, más la metadata de vigencia)
+#   ruts.npy                       RUTs ordenados (vocabulario común a ambos roles)
+#   {rol}_indptr.npy               inicio de cada RUT en {rol}_offsets.npy (formato CSR)
+#   {rol}_offsets.npy              offset en bytes de cada línea del TSV, ordenados por RUT
+ROLES = ("emisor", "receptor")
+_METADATA = "metadata.json"
+
+
+# ==========================
+# Construcción del índice
+# ==========================
+
+def _separar_linea(linea: str) -> Optional[Tuple[Optional[str], str, str]]:
+    """
+    Aplica a una línea del TSV el mismo parseo que LoadTexts y load_data_and_preprocess.
+
+    Returns:
+        (código, texto, texto completo usado para deduplicar) o None si la línea se descarta.
+    """
+    linea = linea.strip()
+    if not linea or '\t' not in linea:
+        return None
+    _, completo = linea.split('\t', 1)
+    codigo, texto = completo.split('\t', 1) if '\t' in completo else (None, completo)
+    return codigo, texto, completo
+
+
+def _csr(ids: np.ndarray, offsets: np.ndarray, n_ruts: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Agrupa los offsets por id de RUT (los ids negativos son documentos sin ese RUT)."""
+    con_rut = ids >= 0
+    ids, offsets = ids[con_rut], offsets[con_rut]
+    orden = np.argsort(ids, kind="stable")  # conserva el orden del corpus dentro de cada RUT
+    indptr = np.zeros(n_ruts + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ids, minlength=n_ruts), out=indptr[1:])
+    return indptr, offsets[orden]
+
+
+def construir_indice(
+    path_to_text: str = TEXT_DATA_FILENAME,
+    path_index: str = CORPUS_INDEX_DIRNAME
+) -> Optional[str]:
+    """
+    Recorre el TSV de textos una vez y guarda, por RUT emisor y receptor, los offsets en bytes
+    de sus líneas. Solo se indexa la primera aparición de cada texto (misma deduplicación que
+    GetUniqueTexts), por lo que leer esas líneas reproduce exactamente la carga completa.
+
+    Returns:
+        Ruta del directorio del índice, o None si no se encontró el TSV.
+    """
+    origen = os.path.join(DATA_DIR, path_to_text)
+    destino = os.path.join(DATA_DIR, path_index)
+    if not os.path.exists(origen):
+        logging.error("Archivo no encontrado: %s", origen)
+        return None
+    inicio = time.perf_counter()
+
+    vocabulario: Dict[str, int] = {}
+    offsets = array.array("q")
+    ids = {rol: array.array("q") for rol in ROLES}
+    hashes = bytearray()
+
+    def id_rut(match) -> int:
+        if not match:
+            return -1
+        return vocabulario.setdefault(match.group(1), len(vocabulario))
+
+    with open(origen, "rb") as f:
+        offset = 0
+        for linea in f:
+            partes = _separar_linea(linea.decode("utf-8"))
+            if partes is not None:
+                _, texto, completo = partes
+                offsets.append(offset)
+                ids["emisor"].append(id_rut(_PATRON_RUT_EMISOR.search(texto)))
+                ids["receptor"].append(id_rut(_PATRON_RUT_RECEPTOR.search(texto)))
+                hashes += hashlib.blake2b(completo.encode("utf-8"), digest_size=16).digest()
+            offset += len(linea)
+
+    # Primera aparición de cada texto
+    primeros = np.unique(np.frombuffer(bytes(hashes), dtype="V16"), return_index=True)[1]
+    primeros.sort()
+    offsets_np = np.frombuffer(offsets, dtype=np.int64)[primeros]
+
+    # Vocabulario ordenado para buscar con searchsorted; los ids se renumeran a ese orden
+    ruts = sorted(vocabulario)
+    rango = np.empty(len(ruts) + 1, dtype=np.int64)
+    rango[[vocabulario[r] for r in ruts]] = np.arange(len(ruts))
+    rango[-1] = -1  # id -1 (sin RUT) se mantiene negativo
+
+    tmp = f"{destino}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, "ruts.npy"), np.array(ruts, dtype=str))
+    for rol in ROLES:
+        indptr, por_rut = _csr(rango[np.frombuffer(ids[rol], dtype=np.int64)[primeros]], offsets_np, len(ruts))
+        np.save(os.path.join(tmp, f"{rol}_indptr.npy"), indptr)
+        np.save(os.path.join(tmp, f"{rol}_offsets.npy"), por_rut)
+    # La metadata se escribe al final: un índice a medio escribir nunca se considera vigente
+    with open(os.path.join(tmp, _METADATA), "w", encoding="utf-8") as f:
+        json.dump({**_firma_archivo(origen), "lineas": len(offsets), "textos": len(offsets_np), "ruts": len(ruts)}, f)
+    shutil.rmtree(destino, ignore_errors=True)
+    os.replace(tmp, destino)
+
+    logging.info("Índice de RUTs construido en %s: %d textos únicos de %d líneas, %d RUTs (%.1fs)",
+                 destino, len(offsets_np), len(offsets), len(ruts), time.perf_counter() - inicio)
+    return destino
+
+
+# ==========================
+# Lectura
+# ==========================
+
+def corpus_index_vigente(
+    path_to_text: str = TEXT_DATA_FILENAME,
+    path_index: str = CORPUS_INDEX_DIRNAME
+) -> bool:
+    """Indica si existe un índice construido desde la versión actual del TSV (tamaño y mtime)."""
+    origen = os.path.join(DATA_DIR, path_to_text)
+    ruta_metadata = os.path.join(DATA_DIR, path_index, _METADATA)
+    if not os.path.exists(origen) or not os.path.exists(ruta_metadata):
+        return False
+    with open(ruta_metadata, encoding="utf-8") as f:
+        metadata = json.load(f)
+    if any(metadata.get(k) != v for k, v in _firma_archivo(origen).items()):
+        logging.warning("El índice %s está desactualizado respecto de %s; se ignora.", ruta_metadata, origen)
+        return False
+    return True
+
+
+def offsets_de_ruts(ruts: Iterable[str], path_index: str = CORPUS_INDEX_DIRNAME) -> np.ndarray:
+    """Offsets (ordenados, sin repetir) de las líneas donde algún RUT aparece como emisor o receptor."""
+    directorio = os.path.join(DATA_DIR, path_index)
+    vocabulario = np.load(os.path.join(directorio, "ruts.npy"), mmap_mode="r")
+    objetivo = np.array(sorted(set(ruts)), dtype=str)
+    if len(vocabulario) == 0 or len(objetivo) == 0:
+        return np.array([], dtype=np.int64)
+
+    posiciones = np.minimum(np.searchsorted(vocabulario, objetivo), len(vocabulario) - 1)
+    posiciones = posiciones[vocabulario[posiciones] == objetivo]  # descarta RUTs que no están en el corpus
+
+    partes: List[np.ndarray] = []
+    for rol in ROLES:
+        indptr = np.load(os.path.join(directorio, f"{rol}_indptr.npy"), mmap_mode="r")
+        offsets = np.load(os.path.join(directorio, f"{rol}_offsets.npy"), mmap_mode="r")
+        partes.extend(np.asarray(offsets[indptr[p]:indptr[p + 1]]) for p in posiciones)
+    if not partes:
+        return np.array([], dtype=np.int64)
+    return np.unique(np.concatenate(partes))
+
+
+def cargar_textos_por_ruts(
+    ruts: Iterable[str],
+    path_to_text: str = TEXT_DATA_FILENAME,
+    path_index: str = CORPUS_INDEX_DIRNAME
+) -> Tuple[List[Optional[str]], List[str]]:
+    """
+    Lee del TSV (vía mmap) solo las líneas de los RUTs pedidos, en el orden del corpus.
+
+    Returns:
+        (códigos, textos) con el mismo formato que la separación de load_data_and_preprocess.
+    """
+    inicio = time.perf_counter()
+    offsets = offsets_de_ruts(ruts, path_index)
+    codigos: List[Optional[str]] = []
+    textos: List[str] = []
+    if len(offsets):
+        with open(os.path.join(DATA_DIR, path_to_text), "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset in offsets.tolist():
+                fin = mm.find(b"\n", offset)
+                codigo, texto, _ = _separar_linea(mm[offset:fin if fin != -1 else len(mm)].decode("utf-8"))
+                codigos.append(codigo)
+                textos.append(texto)
+    logging.info("Índice de RUTs: %d textos leídos desde %s (%.2fs)",
+                 len(textos), path_to_text, time.perf_counter() - inicio)
+    return codigos, textos
+
+
+def main() -> None:
+    """Construye el índice RUT -> offsets del TSV de textos."""
+    parser = argparse.ArgumentParser(description="Construye el índice de RUTs sobre textos_etiquetas.")
+    parser.add_argument("--input", type=str, default=TEXT_DATA_FILENAME, help="TSV dentro de data_files.")
+    parser.add_argument("--output", type=str, default=CORPUS_INDEX_DIRNAME, help="Directorio del índice dentro de data_files.")
+    args = parser.parse_args()
+    construir_indice(args.input, args.output)
+
+
+if __name__ == "__main__":
+    main()
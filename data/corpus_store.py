@@ -0,0 +1,142 @@
+# data/corpus_store.py
+
+import os
+import re
+import time
+import argparse
+import logging
+from typing import Dict, Iterable, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from config import DATA_DIR, TEXT_DATA_FILENAME, CORPUS_STORE_FILENAME
+from data.preprocessor import extract_ruts_and_giros_from_texts_codes
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+# Columnas del corpus compilado (una fila por texto único)
+COLUMNAS_CORPUS = ["texto", "label", "rut_emisor", "rut_receptor", "giro_receptor", "fecha"]
+
+_PATRON_FECHA = re.compile(r"FchEmis:(\d{4}-\d{2}-\d{2})")
+
+
+def _firma_archivo(path: str) -> Dict[str, str]:
+    """Tamaño y mtime del TSV de origen, guardados en la metadata del parquet."""
+    stat = os.stat(path)
+    return {"origen_size": str(stat.st_size), "origen_mtime_ns": str(stat.st_mtime_ns)}
+
+
+def compilar_corpus(
+    path_to_text: str = TEXT_DATA_FILENAME,
+    path_store: str = CORPUS_STORE_FILENAME,
+    row_group_size: int = 200_000
+) -> Optional[str]:
+    """
+    Compila el TSV de textos a un parquet columnar con textos únicos y campos precalculados.
+
+    Aplica exactamente la misma carga, deduplicación y extracción que load_data_and_preprocess
+    (LoadTexts + separación código/texto + extract_ruts_and_giros_from_texts_codes), de modo
+    que las ejecuciones siguientes solo leen las columnas que necesitan.
+
+    Returns:
+        Ruta del parquet generado, o None si no se encontró el TSV.
+    """
+    from data.loader import LoadTexts  # import diferido: data.loader importa este módulo
+
+    origen = os.path.join(DATA_DIR, path_to_text)
+    destino = os.path.join(DATA_DIR, path_store)
+    inicio = time.perf_counter()
+
+    all_texts, _ = LoadTexts(path_to_text)
+    if not all_texts:
+        logging.error("No hay textos para compilar desde %s", origen)
+        return None
+
+    labels, texts = zip(*[i.split('\t', 1) if '\t' in i else (None, i) for i in all_texts])
+    labels_clean = [code.split()[0].lstrip('0') if code else None for code in labels]
+    ruts_em, ruts_re, giros = extract_ruts_and_giros_from_texts_codes(texts)
+    fechas = [m.group(1) if m else None for m in map(_PATRON_FECHA.search, texts)]
+
+    tabla = pa.table({
+        "texto": pa.array(texts, type=pa.string()),
+        "label": pa.array(labels_clean, type=pa.string()),
+        "rut_emisor": pa.array(ruts_em.tolist(), type=pa.string()),
+        "rut_receptor": pa.array(ruts_re.tolist(), type=pa.string()),
+        "giro_receptor": pa.array(giros.tolist(), type=pa.string()),
+        "fecha": pa.array(fechas, type=pa.string()),
+    })
+    tabla = tabla.replace_schema_metadata(_firma_archivo(origen))
+
+    tmp = f"{destino}.tmp"
+    pq.write_table(tabla, tmp, row_group_size=row_group_size, compression="zstd")
+    os.replace(tmp, destino)
+    logging.info("Corpus compilado en %s: %d textos únicos (%.1fs)",
+                 destino, tabla.num_rows, time.perf_counter() - inicio)
+    return destino
+
+
+def corpus_store_vigente(
+    path_to_text: str = TEXT_DATA_FILENAME,
+    path_store: str = CORPUS_STORE_FILENAME
+) -> bool:
+    """
+    Indica si existe un corpus compilado utilizable. Si el TSV de origen sigue presente,
+    el parquet solo es válido si fue compilado desde esa misma versión (tamaño y mtime).
+    """
+    destino = os.path.join(DATA_DIR, path_store)
+    if not os.path.exists(destino):
+        return False
+    origen = os.path.join(DATA_DIR, path_to_text)
+    if not os.path.exists(origen):
+        return True
+    metadata = pq.read_schema(destino).metadata or {}
+    firma = {k.decode(): v.decode() for k, v in metadata.items()}
+    if any(firma.get(k) != v for k, v in _firma_archivo(origen).items()):
+        logging.warning("El corpus compilado %s está desactualizado respecto de %s; se ignora.", destino, origen)
+        return False
+    return True
+
+
+def cargar_corpus(
+    columnas: Optional[List[str]] = None,
+    ruts: Optional[Iterable[str]] = None,
+    path_store: str = CORPUS_STORE_FILENAME
+) -> Dict[str, list]:
+    """
+    Lee el corpus compilado proyectando solo las columnas pedidas.
+    Si se entregan `ruts`, solo se leen los textos donde alguno es emisor o receptor
+    (filtro empujado al scan de pyarrow).
+
+    Returns:
+        Dict {columna: lista de valores} (None para valores nulos).
+    """
+    destino = os.path.join(DATA_DIR, path_store)
+    columnas = columnas or COLUMNAS_CORPUS
+    filtro = None
+    if ruts is not None:
+        valores = pa.array(sorted(set(ruts)), type=pa.string())
+        filtro = pc.field("rut_emisor").isin(valores) | pc.field("rut_receptor").isin(valores)
+    inicio = time.perf_counter()
+    tabla = pq.read_table(destino, columns=columnas, filters=filtro)
+    corpus = {c: tabla.column(c).to_pylist() for c in columnas}
+    logging.info("Corpus compilado cargado desde %s: %d textos, columnas %s (%.1fs)",
+                 destino, tabla.num_rows, columnas, time.perf_counter() - inicio)
+    return corpus
+
+
+def main() -> None:
+    """Compila el TSV de textos al formato columnar."""
+    parser = argparse.ArgumentParser(description="Compila textos_etiquetas a un parquet columnar.")
+    parser.add_argument("--input", type=str, default=TEXT_DATA_FILENAME, help="TSV dentro de data_files.")
+    parser.add_argument("--output", type=str, default=CORPUS_STORE_FILENAME, help="Parquet de salida dentro de data_files.")
+    args = parser.parse_args()
+    compilar_corpus(args.input, args.output)
+
+
+if __name__ == "__main__":
+    main()
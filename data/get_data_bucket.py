@@ -1,16 +1,23 @@
 import os
 import json
+import time
+import threading
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import argparse
 import logging
 from typing import List, Dict, Tuple, Optional, Any, Union
 
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import BotoCoreError, ClientError
 import requests
 from requests_aws4auth import AWS4Auth
 
+from config import S3_MAX_WORKERS, S3_CACHE_DIR, S3_CACHE_MAX_BYTES, S3_CACHE_ENABLED
+from utils.disk_cache import DiskCache
+
 # ==========================
 # Configuración Logging y dotenv
 # ==========================
@@ -23,6 +30,10 @@ logging.basicConfig(
 BUCKET_NAME: str = os.getenv("BUCKET_NAME", "")
 REGION: str = os.getenv("AWS_DEFAULT_REGION", "us-east-1")
 LAMBDA_URL: str = os.getenv("LAMBDA_URL", "")
+S3_ENDPOINT_URL: Optional[str] = os.getenv("S3_ENDPOINT_URL") or None  # p.ej. MinIO/moto local para pruebas
+
+_S3_CACHE: Optional[DiskCache] = None
+_S3_CACHE_LOCK = threading.Lock()
 
 
 # ==========================
@@ -62,48 +73,109 @@ def get_aws_auth(lambda_url: str, service: str = "lambda") -> Dict[str, Any]:
     return response.json()
 
 
-def create_s3_client(creds: Dict[str, str]) -> boto3.client:
-    """Crea un cliente boto3 S3 autenticado con credenciales temporales."""
+def create_s3_client(creds: Dict[str, str], max_pool_connections: int = S3_MAX_WORKERS) -> boto3.client:
+    """
+    Crea un cliente boto3 S3 autenticado con credenciales temporales.
+
+    El pool de conexiones se dimensiona según el número de hilos de descarga,
+    y si S3_ENDPOINT_URL está definido se apunta a ese endpoint (S3 local).
+    """
     return boto3.client(
         "s3",
         aws_access_key_id=creds["AccessKeyId"],
         aws_secret_access_key=creds["SecretAccessKey"],
         aws_session_token=creds["SessionToken"],
-        region_name=REGION
+        region_name=REGION,
+        endpoint_url=S3_ENDPOINT_URL,
+        config=BotoConfig(max_pool_connections=max(10, max_pool_connections))
     )
 
 
-def list_s3_files(s3_client: boto3.client, bucket: str, folder: str) -> List[str]:
-    """Lista archivos dentro de un folder/prefix en S3."""
+def get_s3_cache() -> Optional[DiskCache]:
+    """Devuelve la cache en disco compartida de objetos S3 (None si está deshabilitada)."""
+    global _S3_CACHE
+    if _S3_CACHE is None and S3_CACHE_ENABLED:
+        with _S3_CACHE_LOCK:
+            if _S3_CACHE is None:
+                _S3_CACHE = DiskCache(S3_CACHE_DIR, S3_CACHE_MAX_BYTES)
+    return _S3_CACHE
+
+
+def list_s3_objects(s3_client: boto3.client, bucket: str, folder: str) -> List[Dict[str, str]]:
+    """Lista los objetos de un folder/prefix en S3 como dicts con 'Key' y 'ETag'."""
     if not folder.endswith("/"):
         folder += "/"
     try:
         paginator = s3_client.get_paginator("list_objects_v2")
-        archivos: List[str] = []
+        objetos: List[Dict[str, str]] = []
         for page in paginator.paginate(Bucket=bucket, Prefix=folder):
             if "Contents" in page:
-                archivos.extend(obj["Key"] for obj in page["Contents"])
-        return archivos
-    except ClientError as e:
+                objetos.extend({"Key": obj["Key"], "ETag": obj.get("ETag", "")} for obj in page["Contents"])
+        return objetos
+    except (ClientError, BotoCoreError) as e:
+        # BotoCoreError: sin conexión, timeouts, etc.; no debe botar el lote completo de RUTs
         logging.error("Error AWS al listar folder '%s': %s", folder, e)
         return []
 
 
-def read_s3_file(s3_client: boto3.client, bucket: str, file_key: str) -> Optional[str]:
-    """Lee un archivo desde S3 y devuelve su contenido como string."""
+def list_s3_files(s3_client: boto3.client, bucket: str, folder: str) -> List[str]:
+    """Lista archivos dentro de un folder/prefix en S3."""
+    return [obj["Key"] for obj in list_s3_objects(s3_client, bucket, folder)]
+
+
+def read_s3_bytes(
+    s3_client: boto3.client,
+    bucket: str,
+    file_key: str,
+    etag: Optional[str] = None,
+    cache: Optional[DiskCache] = None
+) -> Optional[bytes]:
+    """
+    Lee el contenido crudo de un archivo S3, consultando primero la cache en disco.
+
+    La cache se indexa por (bucket, key, ETag): solo puede haber acierto si se conoce el ETag
+    (p.ej. desde list_s3_objects). Lo descargado se guarda siempre con el ETag de la respuesta.
+    """
+    cache = cache if cache is not None else get_s3_cache()
+    if cache is not None and etag:
+        data = cache.get((bucket, file_key, etag))
+        if data is not None:
+            return data
     try:
         response = s3_client.get_object(Bucket=bucket, Key=file_key)
         body = response["Body"].read()
-        for encoding in ["utf-8", "latin1"]:
-            try:
-                return body.decode(encoding)
-            except UnicodeDecodeError:
-                continue
-        logging.warning("No se pudo decodificar el archivo: %s", file_key)
-        return None
-    except ClientError as e:
+    except (ClientError, BotoCoreError) as e:
         logging.error("Error AWS al leer '%s': %s", file_key, e)
         return None
+    etag_respuesta = response.get("ETag") or etag
+    if cache is not None and etag_respuesta:
+        cache.put((bucket, file_key, etag_respuesta), body)
+    return body
+
+
+def decode_s3_body(body: bytes, file_key: str = "") -> Optional[str]:
+    """Decodifica el contenido de un archivo probando utf-8 y luego latin1."""
+    for encoding in ["utf-8", "latin1"]:
+        try:
+            return body.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    logging.warning("No se pudo decodificar el archivo: %s", file_key)
+    return None
+
+
+def read_s3_file(
+    s3_client: boto3.client,
+    bucket: str,
+    file_key: str,
+    etag: Optional[str] = None,
+    cache: Optional[DiskCache] = None
+) -> Optional[str]:
+    """Lee un archivo desde S3 (o desde la cache local) y devuelve su contenido como string."""
+    body = read_s3_bytes(s3_client, bucket, file_key, etag=etag, cache=cache)
+    if body is None:
+        return None
+    return decode_s3_body(body, file_key)
 
 
 # ==========================
@@ -156,6 +228,15 @@ def extract_fields(xml_dict: Dict[str, Any]) -> Tuple[str, str, str]:
     """
     try:
         doc = xml_dict["SetDTE"]["DTE"]["Documento"]
+    except KeyError as e:
+        logging.error("Campo faltante en XML: %s", e)
+        return "", "", ""
+    return _campos_desde_documento(doc)
+
+
+def _campos_desde_documento(doc: Dict[str, Any]) -> Tuple[str, str, str]:
+    """Arma (texto, giro_emisor, acteco) desde el dict del nodo SetDTE/DTE/Documento."""
+    try:
         encabezado = doc["Encabezado"]
         iddoc = encabezado["IdDoc"]
         emisor = encabezado["Emisor"]
@@ -218,6 +299,128 @@ def extract_fields(xml_dict: Dict[str, Any]) -> Tuple[str, str, str]:
         return "", "", ""
 
 
+def _valor_nodo(elem: ET.Element) -> Any:
+    """Equivalente a xml_to_dict(elem)[elem.tag], sin envolver cada nivel en un dict."""
+    if len(elem):
+        dd: Dict[str, Any] = {}
+        for hijo in elem:
+            if len(hijo) or hijo.attrib:
+                valor = _valor_nodo(hijo)
+            else:  # hoja simple (caso más común), sin recursión
+                text = hijo.text
+                valor = text.strip() if text else None
+            tag = hijo.tag
+            if tag in dd:
+                if not isinstance(dd[tag], list):
+                    dd[tag] = [dd[tag]]
+                dd[tag].append(valor)
+            else:
+                dd[tag] = valor
+        if elem.text:
+            text = elem.text.strip()
+            if text:
+                dd["text"] = text
+        return dd
+    if elem.attrib:
+        d: Dict[str, Any] = {}
+        if elem.text:
+            text = elem.text.strip()
+            if text:
+                d["text"] = text
+        return d
+    return elem.text.strip() if elem.text else None
+
+
+_RUTA_DOCUMENTO = ("SetDTE", "DTE", "Documento")
+_RAMAS_DOCUMENTO = ("Encabezado", "Detalle")
+_BLOQUE_XML = 16 * 1024  # caracteres (o bytes) entregados al parser por vez
+
+
+def _documento_dte(fuente: Union[bytes, str]) -> Optional[Dict[str, Any]]:
+    """
+    Recorre el XML en streaming (eventos start/end de XMLPullParser, el motor de iterparse) y
+    construye solo las ramas Encabezado y Detalle del primer SetDTE/DTE/Documento. Cada hijo del
+    Documento se convierte (o se descarta, como TED) apenas se cierra y se libera con clear(), y
+    la lectura se detiene al cerrarse el Documento: nunca está el árbol completo en memoria.
+
+    No se usa ET.iterparse porque crea una clase por llamada, y ese ciclo de referencias retiene
+    el parser y el árbol parcial de cada documento hasta que corre el recolector de ciclos.
+
+    Returns:
+        Dict del Documento, o None si el XML no tiene SetDTE/DTE/Documento.
+
+    Raises:
+        ET.ParseError: si el XML está mal formado antes del cierre del Documento.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    profundidad_doc = len(_RUTA_DOCUMENTO)
+    ruta: List[str] = []
+    doc: Optional[Dict[str, Any]] = None
+    for inicio in range(0, len(fuente), _BLOQUE_XML):
+        parser.feed(fuente[inicio:inicio + _BLOQUE_XML])
+        for evento, elem in parser.read_events():
+            if evento == "start":
+                ruta.append(elem.tag)
+                if len(ruta) == profundidad_doc and doc is None and tuple(ruta) == _RUTA_DOCUMENTO:
+                    doc = {}
+                continue
+
+            ruta.pop()
+            profundidad = len(ruta)
+            if profundidad > profundidad_doc:
+                continue  # nodo interno de una rama: se procesa al cerrarse la rama
+            if profundidad == profundidad_doc:
+                if doc is None or tuple(ruta) != _RUTA_DOCUMENTO:
+                    elem.clear()
+                    continue
+                tag = elem.tag
+                if tag in _RAMAS_DOCUMENTO:
+                    valor = _valor_nodo(elem)
+                    if tag in doc:
+                        if not isinstance(doc[tag], list):
+                            doc[tag] = [doc[tag]]
+                        doc[tag].append(valor)
+                    else:
+                        doc[tag] = valor
+                elem.clear()  # TED, Referencia, etc. no se usan
+            elif doc is not None and elem.tag == _RUTA_DOCUMENTO[-1] and tuple(ruta) == _RUTA_DOCUMENTO[:-1]:
+                return doc  # se cerró el Documento: el resto (firma del DTE y del set) no se lee
+            else:
+                elem.clear()  # Caratula, firmas y otros nodos fuera del Documento
+    parser.close()  # XML truncado o sin Documento: ParseError si está mal formado
+    return doc
+
+
+def extract_fields_from_bytes(body: bytes, file_key: str = "") -> Optional[Tuple[str, str, str]]:
+    """
+    Extrae (texto, giro_emisor, acteco) directamente desde el contenido crudo de un DTE.
+
+    Produce el mismo resultado que read_s3_file + parse_xml_string + extract_fields, pero
+    parseando en streaming hasta el cierre del Documento (solo Encabezado y Detalle se
+    convierten a dict) y sin decodificar los documentos ASCII, que el parser lee como bytes.
+    Si el set trae varios DTE se usa el primero, y lo que viene después del Documento (firmas)
+    no se valida: un error de sintaxis ahí ya no descarta el documento.
+
+    Returns:
+        La tupla de extract_fields, o None si el contenido no se puede decodificar o parsear.
+    """
+    if not body:
+        return None
+    fuente: Union[bytes, str, None] = body if body.isascii() else decode_s3_body(body, file_key)
+    if not fuente:
+        return None
+    try:
+        doc = _documento_dte(fuente)
+    except ET.ParseError as e:
+        logging.error("Error al parsear XML: %s", e)
+        return None
+
+    if doc is None:
+        logging.error("Campo faltante en XML: %s", "/".join(_RUTA_DOCUMENTO))
+        return "", "", ""
+    return _campos_desde_documento(doc)
+
+
 # ==========================
 # Procesamiento en lote
 # ==========================
@@ -227,22 +430,76 @@ def procesar_rut(s3_client: boto3.client, rut: str) -> List[Dict[str, Any]]:
     Procesa todos los XML de un RUT, devolviendo lista de dicts con textos y etiquetas.
     """
     folder = f"portal-sii-xml/{rut}/"
-    archivos = list_s3_files(s3_client, BUCKET_NAME, folder)
+    objetos = list_s3_objects(s3_client, BUCKET_NAME, folder)
 
     resultados: List[Dict[str, Any]] = []
-    for key in archivos:
-        xml_str = read_s3_file(s3_client, BUCKET_NAME, key)
-        if not xml_str:
+    for obj in objetos:
+        key = obj["Key"]
+        body = read_s3_bytes(s3_client, BUCKET_NAME, key, etag=obj["ETag"])
+        campos = extract_fields_from_bytes(body, key) if body is not None else None
+        if campos is None:
             continue
-        xml_dict = parse_xml_string(xml_str)
-        if not xml_dict:
-            continue
-        texto, giro_emisor, acteco = extract_fields(xml_dict)
+        texto, giro_emisor, acteco = campos
         resultados.append({"file": key, "texto": texto, "giro_emisor": giro_emisor, "acteco": acteco})
     logging.info("Procesados %d archivos de RUT %s", len(resultados), rut)
     return resultados
 
 
+def _extraer_texto_s3(s3_client: boto3.client, bucket: str, key: str, etag: Optional[str] = None) -> Optional[str]:
+    """Descarga un XML (o lo lee de la cache) y devuelve su texto extraído, o None si no es procesable."""
+    body = read_s3_bytes(s3_client, bucket, key, etag=etag)
+    campos = extract_fields_from_bytes(body, key) if body is not None else None
+    return campos[0] if campos is not None else None
+
+
+def descargar_textos_ruts(
+    s3_client: boto3.client,
+    bucket: str,
+    ruts: List[Union[int, str]],
+    max_workers: int = S3_MAX_WORKERS
+) -> Dict[Union[int, str], List[str]]:
+    """
+    Lista y descarga en paralelo los XML de varios RUTs, devolviendo sus textos.
+
+    Usa un pool de hilos acotado: primero lista los folders de todos los RUTs y luego
+    descarga todos los objetos como un único conjunto de tareas, de modo que un RUT con
+    muchos documentos no bloquea al resto. Los textos de cada RUT se devuelven en el mismo
+    orden en que S3 lista sus llaves (igual que el recorrido secuencial).
+
+    Args:
+        s3_client: Cliente boto3 (thread-safe) o un sustituto local compatible.
+        bucket: Nombre del bucket.
+        ruts: RUTs sin guion ni DV (nombre del folder en 'portal-sii-xml/').
+        max_workers: Número máximo de solicitudes S3 simultáneas.
+
+    Returns:
+        Dict {rut: [texto, ...]} con una entrada por cada RUT solicitado.
+    """
+    max_workers = max(1, max_workers)
+    inicio = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="s3") as executor:
+        listados = list(executor.map(
+            lambda rut: list_s3_objects(s3_client, bucket, f"portal-sii-xml/{rut}/"), ruts
+        ))
+        tareas = [(i, obj) for i, objetos in enumerate(listados) for obj in objetos]
+        textos = executor.map(
+            lambda tarea: _extraer_texto_s3(s3_client, bucket, tarea[1]["Key"], tarea[1]["ETag"]), tareas
+        )
+
+        resultados: List[List[str]] = [[] for _ in ruts]
+        for (i, _), texto in zip(tareas, textos):  # executor.map preserva el orden de las tareas
+            if texto is not None:
+                resultados[i].append(texto)
+
+    duracion = time.perf_counter() - inicio
+    logging.info(
+        "Descargados %d objetos de %d RUTs en %.2fs (%.1f objetos/s, %d workers)",
+        len(tareas), len(ruts), duracion, len(tareas) / duracion if duracion > 0 else 0.0, max_workers
+    )
+    return dict(zip(ruts, resultados))
+
+
 # ==========================
 # Main
 # ==========================
@@ -265,6 +522,9 @@ def main() -> None:
     for r in resultados[:2]:  # solo muestro 2 para debug
         logging.info(json.dumps(r, indent=2, ensure_ascii=False))
 
+    if get_s3_cache() is not None:
+        get_s3_cache().log_stats("Cache S3")
+
 
 if __name__ == "__main__":
     main()
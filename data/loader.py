@@ -2,8 +2,11 @@
 
 import os
 import logging
-from typing import List, Tuple, Dict, Optional, Any
+from typing import List, Tuple, Dict, Optional, Any, Iterable
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from tqdm import tqdm
 from data.preprocessor import *
 from data.get_data_bucket import *
@@ -13,7 +16,11 @@ import sys
 
 # Agregar carpeta padre al path de búsqueda de módulos
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from config import DATA_DIR, TEXT_DATA_FILENAME, ACTIVITY_CODES_FILENAME, SII_DATA_FILENAME
+from config import DATA_DIR, TEXT_DATA_FILENAME, ACTIVITY_CODES_FILENAME, SII_DATA_FILENAME, S3_MAX_WORKERS, SII_CACHE_MIN_RUTS
+from data.rubros import rubros_sii_por_rut
+from utils.binary_cache import cargar_con_cache
+from data.corpus_store import corpus_store_vigente, cargar_corpus
+from data.corpus_index import corpus_index_vigente, cargar_textos_por_ruts
 
 # ==========================
 # Logging y constantes
@@ -24,6 +31,10 @@ logging.basicConfig(
 )
 
 
+# Columnas del SII que usa el pipeline (las únicas que se leen al filtrar por RUT)
+SII_COLUMNAS = ['RUT', 'DV', 'Rubro económico', 'Año comercial']
+
+
 # ==========================
 # Funciones de carga de datos
 # ==========================
@@ -64,27 +75,55 @@ def load_activity_codes_data(filename: str = ACTIVITY_CODES_FILENAME) -> pd.Data
     """
     Carga el archivo Excel que contiene los mapeos de códigos de actividad a rubros.
     """
+    return load_activity_codes_with_lookup(filename)[0]
+
+
+def load_activity_codes_with_lookup(filename: str = ACTIVITY_CODES_FILENAME) -> Tuple[pd.DataFrame, dict]:
+    """
+    Carga la tabla de códigos de actividad junto con su lookup {codigo: rubro}.
+    El resultado se guarda en una cache binaria junto al Excel, por lo que read_excel
+    solo se ejecuta cuando el archivo cambia.
+    """
     filepath = os.path.join(DATA_DIR, filename)
     if os.path.exists(filepath):
-        logging.info("Cargando tabla de códigos de actividad desde: %s", filepath)
-        df = pd.read_excel(filepath)
+        def construir() -> Tuple[pd.DataFrame, dict]:
+            logging.info("Cargando tabla de códigos de actividad desde: %s", filepath)
+            df = pd.read_excel(filepath)
+            return df, construir_lookup_codigo_rubro(df)
+
+        df, lookup = cargar_con_cache(filepath, "codigos", construir)
         logging.info("Columnas en '%s': %s", filename, df.columns.tolist())
-        return df
+        return df, lookup
     else:
         logging.error("Archivo de códigos de actividad no encontrado: %s", filepath)
-        return pd.DataFrame()
+        return pd.DataFrame(), {}
 
 
-def load_sii_data_complete(filename: str = SII_DATA_FILENAME) -> pd.DataFrame:
+def load_sii_data_complete(filename: str = SII_DATA_FILENAME, rutnums: Optional[Iterable[int]] = None) -> pd.DataFrame:
     """
     Carga los datos del SII (v_sii_2.gzip) y realiza el filtrado inicial.
+
+    Si se entregan `rutnums`, el filtro por RUT (y el de 'Valor por Defecto') se empuja al
+    scan de pyarrow y solo se leen las columnas necesarias, por lo que solo se decodifican
+    los row groups que pueden contener esos RUTs.
     """
     filepath = os.path.join(DATA_DIR, filename)
     if os.path.exists(filepath):
-        logging.info("Cargando datos del SII desde: %s", filepath)
-        df = pd.read_parquet(filepath, engine='pyarrow')
-        logging.info("Shape original del SII: %s", df.shape)
-        df = df[df['Rubro económico'] != 'Valor por Defecto']
+        if rutnums is None:
+            logging.info("Cargando datos del SII desde: %s", filepath)
+            df = pd.read_parquet(filepath, engine='pyarrow')
+            logging.info("Shape original del SII: %s", df.shape)
+            df = df[df['Rubro económico'] != 'Valor por Defecto']
+        else:
+            rutnums = sorted(set(rutnums))
+            logging.info("Cargando datos del SII desde: %s (filtrado a %d RUTs)", filepath, len(rutnums))
+            tipo_rut = pq.read_schema(filepath).field('RUT').type
+            rubro = pc.field('Rubro económico')
+            filtro = (
+                pc.field('RUT').isin(pa.array(rutnums, type=pa.int64()).cast(tipo_rut))
+                & ((rubro != 'Valor por Defecto') | rubro.is_null())  # igual que el filtro en pandas, conserva nulos
+            )
+            df = pd.read_parquet(filepath, engine='pyarrow', columns=SII_COLUMNAS, filters=filtro)
         logging.info("Shape del SII después de filtrar 'Valor por Defecto': %s", df.shape)
         df.rename(columns={'RUT': 'rutnum'}, inplace=True)
         df['RUT'] = df['rutnum'].astype(str) + '-' + df['DV'].astype(str)
@@ -94,6 +133,41 @@ def load_sii_data_complete(filename: str = SII_DATA_FILENAME) -> pd.DataFrame:
         return pd.DataFrame()
 
 
+def _rutnums(ruts: List[str]) -> List[int]:
+    """Parte numérica (sin puntos ni DV) de una lista de RUTs, omitiendo los que no son válidos."""
+    rutnums: List[int] = []
+    for rut in ruts:
+        try:
+            rutnums.append(int(rut.replace('.', '').split('-')[0]))
+        except ValueError:
+            logging.warning("RUT con formato inválido, se omite del filtro del SII: %s", rut)
+    return rutnums
+
+
+def load_sii_rubros_por_rut(filename: str = SII_DATA_FILENAME, solo_un_rubro: bool = True) -> pd.DataFrame:
+    """
+    Pares (RUT, rubro) de la tabla completa del SII (ver rubros_sii_por_rut), guardados en
+    una cache binaria junto al parquet del SII.
+    """
+    filepath = os.path.join(DATA_DIR, filename)
+    if not os.path.exists(filepath):
+        logging.error("Archivo de datos del SII no encontrado: %s", filepath)
+        return rubros_sii_por_rut(pd.DataFrame(), solo_un_rubro)
+    nombre = "rubros_uno" if solo_un_rubro else "rubros_todos"
+    return cargar_con_cache(filepath, nombre, lambda: rubros_sii_por_rut(load_sii_data_complete(filename), solo_un_rubro))
+
+
+def _pares_sii(ruts: List[str], solo_un_rubro: bool) -> pd.DataFrame:
+    """
+    Pares (RUT, rubro) del SII para los RUTs pedidos. Con pocos RUTs conviene el filtro
+    empujado al parquet; con muchos (SII_CACHE_MIN_RUTS o más) se usa el mapeo completo cacheado.
+    """
+    if len(ruts) >= SII_CACHE_MIN_RUTS:
+        pares = load_sii_rubros_por_rut(SII_DATA_FILENAME, solo_un_rubro)
+        return pares[pares["rut"].isin(set(ruts))]
+    return rubros_sii_por_rut(load_sii_data_complete(SII_DATA_FILENAME, rutnums=_rutnums(ruts)), solo_un_rubro)
+
+
 def load_data_and_preprocess(args: Any, ruts_to_process_ids: List[str]) -> Optional[Dict[str, Any]]:
     """
     Carga y preprocesa todos los datos necesarios, ya sea desde S3 o archivos locales.
@@ -117,45 +191,44 @@ def load_data_and_preprocess(args: Any, ruts_to_process_ids: List[str]) -> Optio
 
         try:
             creds = get_aws_auth(LAMBDA_URL, service="lambda")
-            s3_client = create_s3_client(creds)
+            s3_client = create_s3_client(creds, max_pool_connections=getattr(args, "s3_workers", None) or S3_MAX_WORKERS)
         except Exception as e:
             logging.error("Error al obtener las credenciales de AWS: %s", e)
             return None
 
         rut_dict_from_s3: Dict[str, Any] = {}
         processed_texts_s3: List[str] = []
-        codes = load_activity_codes_data(ACTIVITY_CODES_FILENAME)
-        sii = load_sii_data_complete(SII_DATA_FILENAME)
+        codes, lookup_codigos = load_activity_codes_with_lookup(ACTIVITY_CODES_FILENAME)
+        pares_sii = _pares_sii(ruts_to_process_ids, args.solo_un_rubro)
 
         ruts_to_process_ids_to_num = {
             int(i.replace('.', '').split('-')[0]): i
             for i in ruts_to_process_ids
         }
 
-        for rut_sin_guion, rut_original in tqdm(ruts_to_process_ids_to_num.items(), desc="Procesando RUTs desde S3"):
-            folder = f"portal-sii-xml/{rut_sin_guion}/"
-            archivos = list_s3_files(s3_client, BUCKET_NAME, folder)
-
-            textos_s3: List[str] = []
-            for key in archivos:
-                xml_str = read_s3_file(s3_client, BUCKET_NAME, key)
-                if xml_str:
-                    xml_dict = parse_xml_string(xml_str)
-                    if xml_dict:
-                        texto, _, _ = extract_fields(xml_dict)
-                        textos_s3.append(texto)
+        s3_workers = getattr(args, "s3_workers", None) or S3_MAX_WORKERS
+        textos_por_rut = descargar_textos_ruts(
+            s3_client, BUCKET_NAME, list(ruts_to_process_ids_to_num.keys()), max_workers=s3_workers
+        )
+        if get_s3_cache() is not None:
+            get_s3_cache().log_stats("Cache S3")
 
+        for rut_sin_guion, rut_original in ruts_to_process_ids_to_num.items():
+            textos_s3 = textos_por_rut.get(rut_sin_guion, [])
             rut_dict_from_s3[rut_original] = {"emisor": textos_s3, "receptor": []}
             processed_texts_s3.extend(textos_s3)
 
         labels_from_texts = [txt.split(' ')[0].split(':')[1] if 'TipoDTE' in txt else None for txt in processed_texts_s3]
         labels_clean = [code.lstrip('0') if code else None for code in labels_from_texts]
-        labels_map = map_codes_to_rubros(codes, labels_clean)
+        labels_map = map_codes_to_rubros(codes, labels_clean, lookup=lookup_codigos)
         ruts_em_s3, ruts_re_s3, giros_s3 = extract_ruts_and_giros_from_texts_codes(processed_texts_s3)
-        rubros_por_rut_s3 = obtener_rubros_por_rut(sii, ruts_em_s3, ruts_re_s3, labels_map, giros_s3, args.solo_un_rubro)
+        rubros_por_rut_s3 = obtener_rubros_por_rut(
+            None, ruts_em_s3, ruts_re_s3, labels_map, giros_s3, args.solo_un_rubro, pares_sii=pares_sii
+        )
 
-        rut_dict_from_s3 = {str(rut): datos for rut, datos in rut_dict_from_s3.items() if rut in ruts_to_process_ids}
-        rubros_por_rut_s3 = {str(rut): datos for rut, datos in rubros_por_rut_s3.items() if rut in ruts_to_process_ids}
+        ruts_objetivo = set(ruts_to_process_ids)
+        rut_dict_from_s3 = {str(rut): datos for rut, datos in rut_dict_from_s3.items() if rut in ruts_objetivo}
+        rubros_por_rut_s3 = {str(rut): datos for rut, datos in rubros_por_rut_s3.items() if rut in ruts_objetivo}
 
         return {
             'rubros_por_rut': rubros_por_rut_s3,
@@ -164,20 +237,39 @@ def load_data_and_preprocess(args: Any, ruts_to_process_ids: List[str]) -> Optio
 
     else:
         logging.info("Cargando y preprocesando datos desde archivos locales...")
-        all_texts, _ = LoadTexts(TEXT_DATA_FILENAME)
-        codes = load_activity_codes_data(ACTIVITY_CODES_FILENAME)
-        sii = load_sii_data_complete(SII_DATA_FILENAME)
-
-        labels, texts = zip(*[i.split('\t', 1) if '\t' in i else (None, i) for i in all_texts])
-        labels_clean = [code.split()[0].lstrip('0') if code else None for code in labels]
-        labels_map = map_codes_to_rubros(codes, labels_clean)
-
-        ruts_em, ruts_re, giros = extract_ruts_and_giros_from_texts_codes(texts)
+        codes, lookup_codigos = load_activity_codes_with_lookup(ACTIVITY_CODES_FILENAME)
+        pares_sii = _pares_sii(ruts_to_process_ids, args.solo_un_rubro)
+
+        # Solo interesan los textos donde algún RUT solicitado es emisor o receptor
+        ruts_objetivo = set(ruts_to_process_ids)
+
+        if corpus_index_vigente(TEXT_DATA_FILENAME):
+            # Índice RUT -> offsets: solo se leen (vía mmap) las líneas de los RUTs solicitados
+            labels, texts = cargar_textos_por_ruts(ruts_objetivo)
+            labels_clean = [code.split()[0].lstrip('0') if code else None for code in labels]
+            ruts_em, ruts_re, giros = extract_ruts_and_giros_from_texts_codes(texts)
+        elif corpus_store_vigente(TEXT_DATA_FILENAME):
+            # Corpus ya compilado: textos únicos con etiqueta, RUTs y giro precalculados
+            corpus = cargar_corpus(["texto", "label", "rut_emisor", "rut_receptor", "giro_receptor"], ruts=ruts_objetivo)
+            texts, labels_clean = corpus["texto"], corpus["label"]
+            ruts_em, ruts_re, giros = corpus["rut_emisor"], corpus["rut_receptor"], corpus["giro_receptor"]
+        else:
+            all_texts, _ = LoadTexts(TEXT_DATA_FILENAME)
+            labels, texts = zip(*[i.split('\t', 1) if '\t' in i else (None, i) for i in all_texts])
+            indices = indices_textos_de_ruts(texts, ruts_objetivo)
+            logging.info("Textos asociados a los RUTs solicitados: %d de %d", len(indices), len(texts))
+            texts = [texts[i] for i in indices]
+            labels_clean = [labels[i].split()[0].lstrip('0') if labels[i] else None for i in indices]
+            ruts_em, ruts_re, giros = extract_ruts_and_giros_from_texts_codes(texts)
+
+        labels_map = map_codes_to_rubros(codes, labels_clean, lookup=lookup_codigos)
         rut_dict = build_rut_text_dictionary(ruts_em, ruts_re, texts)
-        rubros_por_rut = obtener_rubros_por_rut(sii, ruts_em, ruts_re, labels_map, giros, args.solo_un_rubro)
+        rubros_por_rut = obtener_rubros_por_rut(
+            None, ruts_em, ruts_re, labels_map, giros, args.solo_un_rubro, pares_sii=pares_sii
+        )
 
-        rut_dict = {str(rut): datos for rut, datos in rut_dict.items() if rut in ruts_to_process_ids}
-        rubros_por_rut = {str(rut): datos for rut, datos in rubros_por_rut.items() if rut in ruts_to_process_ids}
+        rut_dict = {str(rut): datos for rut, datos in rut_dict.items() if rut in ruts_objetivo}
+        rubros_por_rut = {str(rut): datos for rut, datos in rubros_por_rut.items() if rut in ruts_objetivo}
 
         return {
             'rubros_por_rut': rubros_por_rut,
@@ -1,6 +1,7 @@
 #data/preprocessor.py
 
 import re
+import multiprocessing
 import unicodedata
 import numpy as np
 import pandas as pd
@@ -17,6 +18,7 @@ from config import (
     TEXT_DATA_FILENAME, ACTIVITY_CODES_FILENAME, SII_DATA_FILENAME,
     REEMPLAZOS_LEGIBLES
 )
+from data.rubros import obtener_rubros_por_rut  # implementación única (vectorizada), re-exportada aquí
 #from data.loader import LoadTexts, load_activity_codes_data, load_sii_data_complete
 
 
@@ -131,49 +133,110 @@ def extraer_info_concatenada(texto: str) -> str:
     return resultado
 
 
-def map_codes_to_rubros(tabla_codigo_to_rubro: pd.DataFrame, label_codes: list) -> list:
+def construir_lookup_codigo_rubro(tabla_codigo_to_rubro: pd.DataFrame) -> dict:
+    """
+    Construye el diccionario {codigo (int): rubro} usado por map_codes_to_rubros.
+    Si un código aparece varias veces se conserva el primer rubro de la tabla. Solo los
+    códigos numéricos enteros pueden coincidir con un int (igual que el filtro por igualdad).
+    """
+    lookup = {}
+    if tabla_codigo_to_rubro.empty:
+        return lookup
+    for codigo, rubro in zip(tabla_codigo_to_rubro['Codigo'].tolist(), tabla_codigo_to_rubro['Rubro'].tolist()):
+        if isinstance(codigo, (int, float)) and not isinstance(codigo, bool) \
+                and np.isfinite(codigo) and codigo == int(codigo):
+            lookup.setdefault(int(codigo), rubro)
+    return lookup
+
+
+def _rubro_de_codigo(code, lookup: dict):
+    """Rubro de un código individual; 'SIN RUBRO' si falta, no es numérico o no está en la tabla."""
+    try:
+        return lookup.get(int(code), 'SIN RUBRO')
+    except (TypeError, ValueError, OverflowError):
+        return 'SIN RUBRO'
+
+
+def map_codes_to_rubros(tabla_codigo_to_rubro: pd.DataFrame, label_codes: list, lookup: dict = None) -> list:
     """
     Mapea códigos de actividad numéricos a su 'Rubro' correspondiente desde un DataFrame.
-    Maneja mapeos faltantes retornando 'SIN RUBRO'.
-    """
-    rubros = []
-    for code in label_codes:
-        # Asumiendo que `code` es una cadena que podría contener múltiples códigos o ser el cleaned_code[0]
-        # del procesamiento anterior. Asegurémonos de que se trate como un solo entero para la búsqueda.
-        try:
-            int_code = int(code) # Convertir a int para la búsqueda en DataFrame
-            # Filtrar DataFrame para el código específico
-            
-            filtered_df = tabla_codigo_to_rubro[tabla_codigo_to_rubro['Codigo'] == int_code]
-            if not filtered_df.empty:
-                # Obtener rubros únicos y tomar el primero
-                rubros.append(filtered_df['Rubro'].unique()[0])
-            else:
-                rubros.append('SIN RUBRO')
-        except ValueError: # Manejar casos donde el código podría no ser un entero
-            rubros.append('SIN RUBRO')
-    return rubros
+    Maneja mapeos faltantes (o códigos nulos/no numéricos) retornando 'SIN RUBRO'.
+
+    Las etiquetas se factorizan para convertir cada código distinto una sola vez y el
+    resultado se arma con un `take` sobre el arreglo de rubros únicos.
+    `lookup` permite reutilizar un diccionario ya construido con construir_lookup_codigo_rubro.
+    """
+    if lookup is None:
+        lookup = construir_lookup_codigo_rubro(tabla_codigo_to_rubro)
+    if len(label_codes) == 0:
+        return []
+
+    indices, unicos = pd.factorize(pd.Series(label_codes, dtype=object))
+    rubros_unicos = np.empty(len(unicos) + 1, dtype=object)
+    rubros_unicos[:-1] = [_rubro_de_codigo(code, lookup) for code in unicos]
+    rubros_unicos[-1] = 'SIN RUBRO'  # índice -1: códigos nulos (None/NaN)
+    return rubros_unicos[indices].tolist()
+
+# Patrones precompilados. Cada uno se busca una sola vez por texto y se detiene en la primera
+# aparición; una única alternancia con los tres campos resultó más lenta porque impide el
+# escaneo rápido por prefijo literal que hace `search`.
+_PATRON_RUT_EMISOR = re.compile(r'RUTEmisor:([0-9\-Kk]+)')
+_PATRON_RUT_RECEPTOR = re.compile(r'RUTRecep:([0-9\-Kk]+)')
+_PATRON_GIRO_RECEPTOR = re.compile(r'GiroRecep:(.*?)(?=\s\w+:|$)')
+
+
+def _extraer_ruts_y_giro(texto: str):
+    """Primera aparición de RUTEmisor, RUTRecep y GiroRecep en el texto."""
+    emisor = _PATRON_RUT_EMISOR.search(texto)
+    receptor = _PATRON_RUT_RECEPTOR.search(texto)
+    giro = _PATRON_GIRO_RECEPTOR.search(texto)
+    return (
+        emisor.group(1) if emisor else None,
+        receptor.group(1) if receptor else None,
+        giro.group(1).strip() if giro else None,
+    )
+
+
+def _extraer_ruts_y_giro_lote(textos: list) -> list:
+    return [_extraer_ruts_y_giro(texto) for texto in textos]
+
+
+def indices_textos_de_ruts(texts_codes: list, ruts_objetivo: set) -> list:
+    """
+    Índices de los textos cuyo RUT emisor o receptor está en `ruts_objetivo`.
+    Solo busca los dos RUTs (mismos patrones que extract_ruts_and_giros_from_texts_codes),
+    para filtrar el corpus antes de la extracción completa y el mapeo de rubros.
+    """
+    indices = []
+    for i, text in enumerate(texts_codes):
+        emisor = _PATRON_RUT_EMISOR.search(text)
+        if emisor and emisor.group(1) in ruts_objetivo:
+            indices.append(i)
+            continue
+        receptor = _PATRON_RUT_RECEPTOR.search(text)
+        if receptor and receptor.group(1) in ruts_objetivo:
+            indices.append(i)
+    return indices
+
 
-def extract_ruts_and_giros_from_texts_codes(texts_codes: list):
+def extract_ruts_and_giros_from_texts_codes(texts_codes: list, n_procesos: int = 1):
     """
     Extrae RUTs (emisor, receptor) y el giro del receptor de una lista de textos procesados.
+    Cada campo se busca una vez por texto; con n_procesos > 1 reparte el corpus entre procesos.
     """
-    ruts_emisor = np.array([
-        re.search(r'RUTEmisor:([0-9\-Kk]+)', text).group(1)
-        if re.search(r'RUTEmisor:([0-9\-Kk]+)', text) else None
-        for text in texts_codes
-    ])
-    ruts_receptor = np.array([
-        re.search(r'RUTRecep:([0-9\-Kk]+)', text).group(1)
-        if re.search(r'RUTRecep:([0-9\-Kk]+)', text) else None
-        for text in texts_codes
-    ])
-    rubro_receptor = np.array([
-        re.search(r'GiroRecep:(.*?)(?=\s\w+:|$)', text).group(1).strip()
-        if re.search(r'GiroRecep:(.*?)(?=\s\w+:|$)', text) else None
-        for text in texts_codes
-    ])
-    return ruts_emisor, ruts_receptor, rubro_receptor
+    texts_codes = list(texts_codes)
+    if n_procesos > 1 and len(texts_codes) >= 10000 * n_procesos:
+        tamano = -(-len(texts_codes) // (n_procesos * 4))
+        lotes = [texts_codes[i:i + tamano] for i in range(0, len(texts_codes), tamano)]
+        with multiprocessing.Pool(n_procesos) as pool:
+            campos = [c for lote in pool.map(_extraer_ruts_y_giro_lote, lotes) for c in lote]
+    else:
+        campos = _extraer_ruts_y_giro_lote(texts_codes)
+
+    if not campos:
+        return np.array([]), np.array([]), np.array([])
+    ruts_emisor, ruts_receptor, rubro_receptor = zip(*campos)
+    return np.array(ruts_emisor), np.array(ruts_receptor), np.array(rubro_receptor)
 
 def build_rut_text_dictionary(ruts_emisor: list, ruts_receptor: list, textos: list) -> dict:
     """
@@ -186,51 +249,3 @@ def build_rut_text_dictionary(ruts_emisor: list, ruts_receptor: list, textos: li
         if receptor:
             rut_dict[receptor]["receptor"].append(texto)
     return dict(rut_dict) # Convertir a dict regular para inmutabilidad si se prefiere
-
-
-def obtener_rubros_por_rut(df_rubros: pd.DataFrame, ruts_emisor: list, ruts_receptor: list,
-                          labels_code_to_rubro: list, rubro_receptor: list,
-                          solo_un_rubro: bool = True) -> dict:
-    """
-    Construye un diccionario de rubros únicos asociados a cada RUT.
-    Combina rubros de datos históricos y análisis de texto.
-    """
-    rut_dict_rubros = defaultdict(set)
-
-    # Parte 1: Desde el DataFrame (datos históricos del SII)
-    if solo_un_rubro:
-        # Obtener el rubro más reciente para cada RUT
-        df_sorted = df_rubros.sort_values(by="Año comercial", ascending=False)
-        df_grouped = df_sorted.groupby("RUT").first().reset_index()
-        for _, row in df_grouped.iterrows():
-            if pd.notna(row["RUT"]) and pd.notna(row["Rubro económico"]):
-                rut_dict_rubros[row["RUT"]].add(str(row["Rubro económico"]))
-    else:
-        # Obtener todos los rubros para cada RUT
-        for _, row in df_rubros.iterrows():
-            if pd.notna(row["RUT"]) and pd.notna(row["Rubro económico"]):
-                rut_dict_rubros[row["RUT"]].add(str(row["Rubro económico"]))
-
-    # Parte 2: Desde los textos parseados
-    for emisor, receptor, rubros_emisor_list, rubro_recep_text in zip(
-        ruts_emisor, ruts_receptor, labels_code_to_rubro, rubro_receptor
-    ):
-        if emisor and rubros_emisor_list:
-            if isinstance(rubros_emisor_list, (list, np.ndarray)):
-                for r in rubros_emisor_list:
-                    if r: rut_dict_rubros[emisor].add(str(r))
-            else: # Asumiendo que es una sola cadena
-                if rubros_emisor_list: rut_dict_rubros[emisor].add(rubros_emisor_list)
-
-        if receptor and rubro_recep_text:
-            if isinstance(rubro_recep_text, (list, np.ndarray)):
-                for r in rubro_recep_text:
-                    if r: rut_dict_rubros[receptor].add(str(r))
-            else: # Asumiendo que es una sola cadena
-                if rubro_recep_text: rut_dict_rubros[receptor].add(str(rubro_recep_text))
-
-    # Convertir sets a listas para mejor serialización/consistencia
-    final_rut_rubros = {str(rut): list(rubros) for rut, rubros in rut_dict_rubros.items()}
-    return final_rut_rubros
-
-
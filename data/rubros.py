@@ -1,8 +1,7 @@
 #data/rubros.py
 
-from typing import List, Dict, Union
+from typing import List, Dict, Optional, Union
 import pandas as pd
-from collections import defaultdict
 import logging
 
 logging.basicConfig(
@@ -11,16 +10,63 @@ logging.basicConfig(
 )
 
 
+def rubros_sii_por_rut(df_rubros: pd.DataFrame, solo_un_rubro: bool = True) -> pd.DataFrame:
+    """
+    Obtiene los pares (RUT, rubro) únicos declarados en la tabla del SII.
+
+    Args:
+        df_rubros (pd.DataFrame): DataFrame con columnas ['RUT', 'Rubro económico', 'Año comercial'].
+        solo_un_rubro (bool): Si True, se mantiene solo un rubro por RUT (el más reciente no nulo).
+
+    Returns:
+        pd.DataFrame: Columnas ['rut', 'rubro'] (rubro como str), sin RUTs ni rubros nulos.
+    """
+    if df_rubros.empty:
+        return pd.DataFrame({"rut": pd.Series(dtype=object), "rubro": pd.Series(dtype=object)})
+
+    if solo_un_rubro:
+        logging.info("Agrupando df_rubros por RUT, manteniendo solo un rubro por RUT (el más reciente).")
+        df_sorted = df_rubros[["RUT", "Rubro económico", "Año comercial"]].sort_values(
+            by="Año comercial", ascending=False
+        )
+        pares = df_sorted.groupby("RUT")["Rubro económico"].first().dropna().reset_index()
+    else:
+        logging.info("Manteniendo todos los rubros del DataFrame sin filtrar.")
+        pares = df_rubros[["RUT", "Rubro económico"]].dropna()
+
+    return pd.DataFrame({
+        "rut": pares["RUT"].to_numpy(dtype=object),
+        "rubro": pares["Rubro económico"].astype(str).to_numpy(dtype=object),
+    }).drop_duplicates()
+
+
+def _rubros_desde_textos(ruts: List[str], rubros: List[Union[str, List[str]]], n: int) -> pd.DataFrame:
+    """
+    Pares (RUT, rubro) de los textos parseados. Los rubros pueden ser strings o listas;
+    se descartan RUTs y rubros vacíos o nulos.
+    """
+    df = pd.DataFrame({
+        "rut": pd.Series(list(ruts[:n]), dtype=object),
+        "rubro": pd.Series(list(rubros[:n]), dtype=object),
+    })
+    df = df[df["rut"].notna() & (df["rut"] != "")]
+    df = df[df["rubro"].notna()].explode("rubro")
+    return df[df["rubro"].notna() & (df["rubro"] != "")]
+
+
 def obtener_rubros_por_rut(
-    df_rubros: pd.DataFrame,
+    df_rubros: Optional[pd.DataFrame],
     ruts_emisor: List[str],
     ruts_receptor: List[str],
     labels_code_to_rubro: List[Union[str, List[str]]],
     rubro_receptor: List[Union[str, List[str]]],
-    solo_un_rubro: bool = True
+    solo_un_rubro: bool = True,
+    pares_sii: Optional[pd.DataFrame] = None
 ) -> Dict[str, List[str]]:
     """
     Construye un diccionario de RUTs a rubros económicos.
+    Combina rubros de datos históricos del SII y del análisis de texto (emisor: rubro de su
+    código de actividad; receptor: giro declarado en el documento), sin iterar fila a fila.
 
     Args:
         df_rubros (pd.DataFrame): DataFrame con columnas ['RUT', 'Rubro económico', 'Año comercial'].
@@ -28,39 +74,33 @@ def obtener_rubros_por_rut(
         ruts_receptor (List[str]): Lista de RUTs receptores.
         labels_code_to_rubro (List[Union[str, List[str]]]): Rubros de los emisores.
         rubro_receptor (List[Union[str, List[str]]]): Rubros de los receptores.
-        solo_un_rubro (bool): Si True, se mantiene solo un rubro por RUT (el más reciente).
+        solo_un_rubro (bool): Si True, se mantiene solo un rubro del SII por RUT (el más reciente).
+        pares_sii (pd.DataFrame, opcional): Pares ya calculados con rubros_sii_por_rut; si se
+            entregan, df_rubros no se usa.
 
     Returns:
-        Dict[str, List[str]]: Diccionario {RUT: [rubros]}.
+        Dict[str, List[str]]: Diccionario {RUT: [rubros únicos]}.
     """
-    rut_dict_rubros: Dict[str, set] = defaultdict(set)
+    n = min(len(ruts_emisor), len(ruts_receptor), len(labels_code_to_rubro), len(rubro_receptor))
+    pares = pd.concat([
+        pares_sii if pares_sii is not None else rubros_sii_por_rut(df_rubros, solo_un_rubro),
+        _rubros_desde_textos(ruts_emisor, labels_code_to_rubro, n),
+        _rubros_desde_textos(ruts_receptor, rubro_receptor, n),
+    ], ignore_index=True)
 
-    # --- Procesar rubros desde el DataFrame del SII ---
-    if solo_un_rubro:
-        logging.info("Agrupando df_rubros por RUT, manteniendo solo un rubro por RUT (el más reciente).")
-        df_rubros = df_rubros.sort_values("Año comercial", ascending=False)
-        df_grouped = df_rubros.groupby("RUT").first()
-        for rut, row in df_grouped.iterrows():
-            rut_dict_rubros[rut].add(row["Rubro económico"])
-    else:
-        logging.info("Manteniendo todos los rubros del DataFrame sin filtrar.")
-        for _, row in df_rubros.iterrows():
-            rut_dict_rubros[row["RUT"]].add(row["Rubro económico"])
-
-    # --- Añadir rubros desde etiquetas extraídas de textos ---
-    for emisor, receptor, rubros_em, rubros_rec in zip(ruts_emisor, ruts_receptor, labels_code_to_rubro, rubro_receptor):
-        # Rubros del emisor
-        if isinstance(rubros_em, list):
-            for r in rubros_em:
-                rut_dict_rubros[emisor].add(r)
-        else:
-            rut_dict_rubros[emisor].add(rubros_em)
-        # Rubros del receptor
-        if isinstance(rubros_rec, list):
-            for r in rubros_rec:
-                rut_dict_rubros[receptor].add(r)
-        else:
-            rut_dict_rubros[receptor].add(rubros_rec)
+    if pares.empty:
+        logging.info("Total RUTs con rubros asignados: 0")
+        return {}
+
+    pares = pd.DataFrame({
+        "rut": pares["rut"].astype(str).to_numpy(dtype=object),
+        "rubro": pares["rubro"].astype(str).to_numpy(dtype=object),
+    }).drop_duplicates()
+
+    # Los pares ya son únicos: solo queda agruparlos en listas por RUT
+    rut_dict_rubros: Dict[str, List[str]] = {}
+    for rut, rubro in zip(pares["rut"].tolist(), pares["rubro"].tolist()):
+        rut_dict_rubros.setdefault(rut, []).append(rubro)
 
     logging.info(f"Total RUTs con rubros asignados: {len(rut_dict_rubros)}")
-    return {k: list(v) for k, v in rut_dict_rubros.items()}
+    return rut_dict_rubros
@@ -0,0 +1,217 @@
+# llm/cache.py
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES, LLM_CACHE_ENABLED
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+
+def llave_llm(backend: str, model: str, temperature: float, options: Dict[str, Any], prompt: str) -> str:
+    """Llave de cache de una llamada: hash de (backend, modelo, temperatura, opciones, hash del prompt)."""
+    contenido = json.dumps({
+        "backend": backend,
+        "model": model,
+        "temperature": temperature,
+        "options": options,
+        "prompt": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+    }, sort_keys=True)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+def _tarea_cancelada() -> bool:
+    """True si se pidió cancelar la tarea actual (Task.cancelling existe desde Python 3.11)."""
+    tarea = asyncio.current_task()
+    cancelling = getattr(tarea, "cancelling", None)
+    return bool(cancelling()) if cancelling is not None else False
+
+
+class LLMCache:
+    """
+    Cache persistente de respuestas del LLM en SQLite, direccionada por contenido (ver llave_llm).
+
+    Se comparte entre run_completion.py, clasificador.py y api_model.py. Cuando el tamaño total
+    de las respuestas supera max_bytes se expulsan las menos usadas recientemente. Las consultas
+    a SQLite corren en un hilo (asyncio.to_thread) detrás de un lock, y las llamadas concurrentes
+    con la misma llave dentro de un proceso se resuelven con una sola petición al modelo.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._en_vuelo: Dict[str, asyncio.Future] = {}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # varios procesos pueden leer mientras otro escribe
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS respuestas ("
+            "llave TEXT PRIMARY KEY, respuesta TEXT NOT NULL, bytes INTEGER NOT NULL, "
+            "creado REAL NOT NULL, ultimo_uso REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ultimo_uso ON respuestas (ultimo_uso)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM respuestas").fetchone()[0]
+        entradas = self._conn.execute("SELECT COUNT(*) FROM respuestas").fetchone()[0]
+        logging.info("Cache LLM '%s': %d respuestas (%.1f MB)", path, entradas, self._total_bytes / 1e6)
+
+    # --- Operaciones sincrónicas (se ejecutan en un hilo) ---
+
+    def _get(self, llave: str) -> Optional[str]:
+        with self._lock:
+            fila = self._conn.execute("SELECT respuesta FROM respuestas WHERE llave = ?", (llave,)).fetchone()
+            if fila is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE respuestas SET ultimo_uso = ? WHERE llave = ?", (time.time(), llave))
+            self._conn.commit()
+            self.hits += 1
+            return fila[0]
+
+    def _put(self, llave: str, respuesta: str) -> None:
+        size = len(respuesta.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        ahora = time.time()
+        with self._lock:
+            anterior = self._conn.execute("SELECT bytes FROM respuestas WHERE llave = ?", (llave,)).fetchone()
+            if anterior is not None:
+                self._total_bytes -= anterior[0]  # INSERT OR REPLACE reemplaza la fila anterior
+            self._conn.execute(
+                "INSERT OR REPLACE INTO respuestas (llave, respuesta, bytes, creado, ultimo_uso) VALUES (?, ?, ?, ?, ?)",
+                (llave, respuesta, size, ahora, ahora)
+            )
+            self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                # Otros procesos pueden haber escrito: se recalcula antes de expulsar
+                self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM respuestas").fetchone()[0]
+                while self._total_bytes > self.max_bytes:
+                    filas = self._conn.execute(
+                        "SELECT llave, bytes FROM respuestas ORDER BY ultimo_uso LIMIT 100"
+                    ).fetchall()
+                    if not filas:
+                        break
+                    for vieja, bytes_viejos in filas:
+                        if self._total_bytes <= self.max_bytes:
+                            break
+                        self._conn.execute("DELETE FROM respuestas WHERE llave = ?", (vieja,))
+                        self._total_bytes -= bytes_viejos
+                        self.evictions += 1
+            self._conn.commit()
+
+    # --- API asíncrona ---
+
+    async def get(self, llave: str) -> Optional[str]:
+        """Respuesta guardada para la llave, o None."""
+        return await asyncio.to_thread(self._get, llave)
+
+    async def put(self, llave: str, respuesta: str) -> None:
+        """Guarda la respuesta y expulsa las menos usadas si se supera max_bytes."""
+        await asyncio.to_thread(self._put, llave, respuesta)
+
+    async def obtener_o_llamar(
+        self,
+        llave: str,
+        llamar: Callable[[], Awaitable[str]],
+        es_valida: Callable[[str], bool] = lambda respuesta: True
+    ) -> str:
+        """
+        Devuelve la respuesta cacheada o ejecuta `llamar()` y guarda su resultado si `es_valida`.
+        Las excepciones de `llamar` se propagan y no se guardan. Si se cancela la tarea que hacía
+        la llamada, las que esperaban la misma llave la reintentan (una de ellas pasa a hacerla).
+        """
+        while True:
+            en_vuelo = self._en_vuelo.get(llave)
+            if en_vuelo is None:
+                break
+            try:
+                respuesta = await asyncio.shield(en_vuelo)
+            except asyncio.CancelledError:
+                if en_vuelo.cancelled() and not _tarea_cancelada():
+                    continue  # se canceló la tarea dueña de la llamada, no esta
+                raise
+            with self._lock:
+                self.hits += 1
+            return respuesta
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_vuelo[llave] = futuro
+        try:
+            respuesta = await self.get(llave)
+            if respuesta is None:
+                respuesta = await llamar()
+                if es_valida(respuesta):
+                    await self.put(llave, respuesta)
+            futuro.set_result(respuesta)
+            return respuesta
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except Exception as e:
+            futuro.set_exception(e)
+            futuro.exception()  # evita el aviso de excepción no recuperada si nadie más esperaba
+            raise
+        finally:
+            del self._en_vuelo[llave]
+
+    def stats(self) -> Dict[str, int]:
+        """Contadores de uso de la cache en esta ejecución."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "bytes": self._total_bytes}
+
+    def log_stats(self, nombre: str = "Cache LLM") -> None:
+        """Registra en el log la tasa de aciertos de la ejecución."""
+        s = self.stats()
+        total = s["hits"] + s["misses"]
+        logging.info(
+            "%s: %d hits, %d misses (%.1f%% hit rate), %d expulsiones, %.1f MB",
+            nombre, s["hits"], s["misses"], 100.0 * s["hits"] / total if total else 0.0,
+            s["evictions"], s["bytes"] / 1e6
+        )
+
+
+_LLM_CACHE: Optional[LLMCache] = None
+_LLM_CACHE_LOCK = threading.Lock()
+_LLM_CACHE_ENABLED = LLM_CACHE_ENABLED
+
+
+def disable_llm_cache() -> None:
+    """Deshabilita la cache para el resto de la ejecución (flag --no-llm-cache)."""
+    global _LLM_CACHE_ENABLED
+    _LLM_CACHE_ENABLED = False
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """Devuelve la cache de respuestas compartida (None si está deshabilitada)."""
+    global _LLM_CACHE
+    if _LLM_CACHE is None and _LLM_CACHE_ENABLED:
+        with _LLM_CACHE_LOCK:
+            if _LLM_CACHE is None:
+                _LLM_CACHE = LLMCache(LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES)
+    return _LLM_CACHE if _LLM_CACHE_ENABLED else None
+
+
+async def respuesta_con_cache(
+    llave: str,
+    llamar: Callable[[], Awaitable[str]],
+    es_valida: Callable[[str], bool] = lambda respuesta: True
+) -> str:
+    """Atajo: usa la cache compartida si está habilitada, si no llama directamente."""
+    cache = get_llm_cache()
+    if cache is None:
+        return await llamar()
+    return await cache.obtener_o_llamar(llave, llamar, es_valida)
@@ -0,0 +1,202 @@
+# llm/endpoints.py
+
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+import aiohttp
+
+from llm.policy import es_reintentable
+from config import (
+    OLLAMA_URLS, OLLAMA_MAX_POR_ENDPOINT, OLLAMA_FALLOS_EXPULSION,
+    OLLAMA_HEALTH_INTERVALO, OLLAMA_FACTOR_LENTO
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+
+class EndpointOllama:
+    """Estado de un servidor Ollama del pool."""
+
+    def __init__(self, url: str, max_concurrencia: int):
+        self.url = url.rstrip("/")
+        self.max_concurrencia = max_concurrencia  # 0 = sin tope
+        self.en_curso = 0
+        self.latencia_promedio: Optional[float] = None
+        self.fallos_consecutivos = 0
+        self.expulsado = False
+        self.en_prueba = False  # readmitido: una llamada a la vez hasta medir su latencia
+        self.motivo_expulsion = ""
+        self.requests = 0
+        self.errores = 0
+        self.expulsiones = 0
+
+    def tiene_cupo(self) -> bool:
+        if self.en_prueba:
+            return self.en_curso < 1
+        return not self.max_concurrencia or self.en_curso < self.max_concurrencia
+
+
+class PoolOllama:
+    """
+    Pool de servidores Ollama con ruteo al de menos requests en curso (least outstanding requests).
+
+    - Cada endpoint puede tener un tope de concurrencia (`max_por_endpoint`, 0 = sin tope); si
+      todos están llenos, la llamada espera a que se libere un cupo.
+    - Un endpoint se expulsa tras `fallos_expulsion` errores seguidos (429, 5xx, timeouts o de
+      conexión; una respuesta mal formada no es culpa del servidor), o si su latencia promedio
+      supera `factor_lento` veces la del más rápido. Un health check (GET /api/tags) cada
+      `intervalo_health` segundos readmite a los expulsados que responden, a prueba: reciben una
+      llamada a la vez hasta que una termina bien (si sigue lento, se vuelve a expulsar).
+    - Si todos están expulsados se sigue usando el menos cargado, para no detener la ejecución.
+
+    Uso: `async with pool.endpoint() as url_base: ...` (una excepción dentro cuenta como fallo).
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        max_por_endpoint: int = OLLAMA_MAX_POR_ENDPOINT,
+        fallos_expulsion: int = OLLAMA_FALLOS_EXPULSION,
+        intervalo_health: float = OLLAMA_HEALTH_INTERVALO,
+        factor_lento: float = OLLAMA_FACTOR_LENTO
+    ):
+        if not urls:
+            raise ValueError("El pool de Ollama necesita al menos una URL.")
+        self.endpoints = [EndpointOllama(url, max_por_endpoint) for url in urls]
+        self.fallos_expulsion = fallos_expulsion
+        self.intervalo_health = intervalo_health
+        self.factor_lento = factor_lento
+        self._condicion: Optional[asyncio.Condition] = None
+        self._tarea_health: Optional[asyncio.Task] = None
+
+    def _elegir(self) -> Optional[EndpointOllama]:
+        disponibles = [ep for ep in self.endpoints if ep.tiene_cupo()]
+        sanos = [ep for ep in disponibles if not ep.expulsado]
+        candidatos = sanos or ([] if any(not ep.expulsado for ep in self.endpoints) else disponibles)
+        if not candidatos:
+            return None
+        return min(candidatos, key=lambda ep: (ep.en_curso, ep.latencia_promedio or 0.0))
+
+    def _expulsar(self, ep: EndpointOllama, motivo: str) -> None:
+        if ep.expulsado:
+            return
+        ep.expulsado = True
+        ep.motivo_expulsion = motivo
+        ep.expulsiones += 1
+        logging.warning(f"Endpoint Ollama {ep.url} expulsado del pool: {motivo}")
+
+    def _readmitir(self, ep: EndpointOllama) -> None:
+        ep.expulsado = False
+        ep.en_prueba = True  # /api/tags no dice nada de la latencia de inferencia
+        ep.fallos_consecutivos = 0
+        ep.latencia_promedio = None  # se vuelve a medir desde cero
+        logging.info(f"Endpoint Ollama {ep.url} readmitido en el pool ({ep.motivo_expulsion}).")
+
+    def _registrar(self, ep: EndpointOllama, latencia: Optional[float]) -> None:
+        ep.requests += 1
+        if latencia is None:
+            ep.errores += 1
+            ep.fallos_consecutivos += 1
+            if ep.fallos_consecutivos >= self.fallos_expulsion:
+                self._expulsar(ep, f"{ep.fallos_consecutivos} errores seguidos")
+            return
+        ep.fallos_consecutivos = 0
+        ep.en_prueba = False
+        ep.latencia_promedio = latencia if ep.latencia_promedio is None else 0.8 * ep.latencia_promedio + 0.2 * latencia
+        sanos = [e.latencia_promedio for e in self.endpoints if not e.expulsado and e.latencia_promedio]
+        # Con latencias de milisegundos (p. ej. respuestas cortas) las diferencias son ruido: se exige 1s de margen
+        if len(sanos) > 1 and ep.latencia_promedio > max(self.factor_lento * min(sanos), min(sanos) + 1.0):
+            self._expulsar(ep, f"lento ({ep.latencia_promedio:.2f}s vs {min(sanos):.2f}s)")
+
+    def _iniciar(self) -> None:
+        if self._condicion is None:
+            self._condicion = asyncio.Condition()
+        if self._tarea_health is None and len(self.endpoints) > 1:
+            self._tarea_health = asyncio.create_task(self._health_checks())
+
+    async def _health_checks(self) -> None:
+        timeout = aiohttp.ClientTimeout(total=5)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            while True:
+                await asyncio.sleep(self.intervalo_health)
+                for ep in [ep for ep in self.endpoints if ep.expulsado]:
+                    try:
+                        async with session.get(f"{ep.url}/api/tags") as response:
+                            response.raise_for_status()
+                    except (aiohttp.ClientError, asyncio.TimeoutError):
+                        continue
+                    self._readmitir(ep)
+                async with self._condicion:
+                    self._condicion.notify_all()
+
+    @asynccontextmanager
+    async def endpoint(self) -> AsyncIterator[str]:
+        """Reserva un cupo en el endpoint elegido y entrega su URL base."""
+        self._iniciar()
+        async with self._condicion:
+            await self._condicion.wait_for(lambda: self._elegir() is not None)
+            ep = self._elegir()
+            ep.en_curso += 1
+        inicio = time.monotonic()
+        exito = None
+        try:
+            yield ep.url
+            exito = True
+        except asyncio.CancelledError:
+            raise  # una cancelación no es culpa del endpoint
+        except Exception as e:
+            if es_reintentable(e):
+                exito = False  # 4xx o una respuesta mal formada no cuentan contra el endpoint
+            raise
+        finally:
+            if exito is not None:
+                self._registrar(ep, time.monotonic() - inicio if exito else None)
+            async with self._condicion:
+                ep.en_curso -= 1
+                self._condicion.notify_all()
+
+    async def cerrar(self) -> None:
+        """Detiene el health check (si está corriendo)."""
+        if self._tarea_health is not None:
+            self._tarea_health.cancel()
+            try:
+                await self._tarea_health
+            except asyncio.CancelledError:
+                pass
+            self._tarea_health = None
+
+    def log_stats(self) -> None:
+        for ep in self.endpoints:
+            logging.info(
+                "Endpoint Ollama %s: %d requests, %d errores, latencia promedio %.2fs, %d expulsiones%s",
+                ep.url, ep.requests, ep.errores, ep.latencia_promedio or 0.0, ep.expulsiones,
+                " (expulsado)" if ep.expulsado else ""
+            )
+
+
+_POOL_OLLAMA: Optional[PoolOllama] = None
+
+
+def configurar_pool_ollama(urls: Optional[List[str]] = None, max_por_endpoint: Optional[int] = None) -> PoolOllama:
+    """Crea el pool compartido (por defecto OLLAMA_URLS / OLLAMA_MAX_POR_ENDPOINT de config)."""
+    global _POOL_OLLAMA
+    urls = [url.strip() for entrada in (urls or OLLAMA_URLS) for url in entrada.split(",") if url.strip()]
+    _POOL_OLLAMA = PoolOllama(
+        urls,
+        OLLAMA_MAX_POR_ENDPOINT if max_por_endpoint is None else max_por_endpoint
+    )
+    logging.info(f"Pool de Ollama: {', '.join(ep.url for ep in _POOL_OLLAMA.endpoints)}")
+    return _POOL_OLLAMA
+
+
+def get_pool_ollama() -> PoolOllama:
+    """Pool compartido; se crea con la configuración por defecto si nadie lo configuró."""
+    if _POOL_OLLAMA is None:
+        return configurar_pool_ollama()
+    return _POOL_OLLAMA
@@ -0,0 +1,175 @@
+# llm/policy.py
+
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+import aiohttp
+
+from config import (
+    LLM_MAX_INTENTOS, LLM_DEADLINE_INTENTO, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, LLM_HEDGE_PERCENTIL
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+# Margen sobre el deadline de sock_read antes de abandonar el intento desde afuera
+_MARGEN_DEADLINE = 5.0
+# Latencias exitosas necesarias antes de estimar el percentil para el hedging
+_MIN_MUESTRAS_HEDGE = 20
+
+
+def es_reintentable(error: BaseException) -> bool:
+    """429, 5xx, timeouts y errores de conexión se reintentan; el resto (4xx, parseo) no."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError))
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    if isinstance(error, aiohttp.ClientResponseError) and error.headers:
+        try:
+            return float(error.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+class PoliticaLlamadas:
+    """
+    Política de llamadas al LLM: deadline por intento, reintentos con backoff exponencial y
+    jitter completo ante errores reintentables, y hedging opcional (si un intento supera la
+    latencia del percentil `percentil_hedge`, se lanza un duplicado y gana el primero que responda).
+
+    Cada intento (y cada duplicado) vuelve a pasar por el límite de concurrencia y el pool de
+    servidores, por lo que un reintento puede ir a otro servidor.
+    """
+
+    def __init__(
+        self,
+        nombre: str,
+        max_intentos: int = LLM_MAX_INTENTOS,
+        deadline: float = LLM_DEADLINE_INTENTO,
+        backoff_base: float = LLM_BACKOFF_BASE,
+        backoff_max: float = LLM_BACKOFF_MAX,
+        hedging: bool = False,
+        percentil_hedge: float = LLM_HEDGE_PERCENTIL
+    ):
+        self.nombre = nombre
+        self.max_intentos = max(1, max_intentos)
+        self.deadline = deadline
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedging = hedging
+        self.percentil_hedge = percentil_hedge
+
+        self.llamadas = 0
+        self.reintentos = 0
+        self.timeouts = 0
+        self.fallos_definitivos = 0
+        self.hedges = 0
+        self.hedges_ganados = 0
+        self._latencias: deque = deque(maxlen=500)
+
+    def timeout_http(self) -> aiohttp.ClientTimeout:
+        """Timeout de aiohttp para un intento: la lectura de la respuesta no puede superar el deadline."""
+        return aiohttp.ClientTimeout(total=None, connect=10, sock_connect=10, sock_read=self.deadline)
+
+    def _umbral_hedge(self) -> Optional[float]:
+        if not self.hedging or len(self._latencias) < _MIN_MUESTRAS_HEDGE:
+            return None
+        latencias = sorted(self._latencias)
+        return latencias[min(len(latencias) - 1, int(len(latencias) * self.percentil_hedge))]
+
+    async def _intento_medido(self, intento: Callable[[], Awaitable[str]]) -> str:
+        inicio = asyncio.get_running_loop().time()
+        respuesta = await asyncio.wait_for(intento(), self.deadline + _MARGEN_DEADLINE)
+        self._latencias.append(asyncio.get_running_loop().time() - inicio)
+        return respuesta
+
+    async def _intento_con_hedge(self, intento: Callable[[], Awaitable[str]]) -> str:
+        umbral = self._umbral_hedge()
+        if umbral is None:
+            return await self._intento_medido(intento)
+
+        primero = asyncio.ensure_future(self._intento_medido(intento))
+        tareas = {primero}
+        try:
+            listos, _ = await asyncio.wait(tareas, timeout=umbral)
+            if not listos:
+                self.hedges += 1
+                tareas.add(asyncio.ensure_future(self._intento_medido(intento)))
+            error: Optional[BaseException] = None
+            pendientes = set(tareas)
+            while pendientes:
+                listos, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+                for tarea in listos:
+                    if tarea.exception() is None:
+                        if tarea is not primero:
+                            self.hedges_ganados += 1
+                        return tarea.result()
+                    error = error or tarea.exception()
+            raise error
+        finally:
+            for tarea in tareas:
+                tarea.cancel()
+
+    async def ejecutar(self, intento: Callable[[], Awaitable[str]]) -> str:
+        """Ejecuta `intento()` según la política. Si se agotan los intentos, propaga el último error."""
+        self.llamadas += 1
+        for n_intento in range(1, self.max_intentos + 1):
+            try:
+                return await self._intento_con_hedge(intento)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeouts += 1
+                if not es_reintentable(e) or n_intento == self.max_intentos:
+                    self.fallos_definitivos += 1
+                    raise
+                espera = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (n_intento - 1)))
+                espera = max(espera, _retry_after(e) or 0.0)
+                self.reintentos += 1
+                logging.debug(f"Llamada {self.nombre}: intento {n_intento} falló ({e!r}), reintento en {espera:.1f}s")
+                await asyncio.sleep(espera)
+
+    def log_stats(self) -> None:
+        logging.info(
+            "Llamadas %s: %d llamadas, %d reintentos, %d timeouts, %d fallos definitivos, "
+            "%d hedges (%d ganados por el duplicado)",
+            self.nombre, self.llamadas, self.reintentos, self.timeouts, self.fallos_definitivos,
+            self.hedges, self.hedges_ganados
+        )
+
+
+_POLITICAS: Dict[str, PoliticaLlamadas] = {}
+_CONFIGURACION: Dict[str, object] = {}
+
+
+def configurar_politicas(
+    max_intentos: Optional[int] = None,
+    deadline: Optional[float] = None,
+    hedging: Optional[bool] = None
+) -> None:
+    """Ajusta (desde los argumentos de línea de comandos) las políticas que se creen de aquí en adelante."""
+    for clave, valor in (("max_intentos", max_intentos), ("deadline", deadline), ("hedging", hedging)):
+        if valor is not None:
+            _CONFIGURACION[clave] = valor
+
+
+def get_politica(nombre: str, **por_defecto) -> PoliticaLlamadas:
+    """
+    Política compartida por etapa ('completación', 'clasificación'); una instancia por nombre.
+    `por_defecto` (p. ej. el deadline propio de una etapa) cede ante lo configurado por línea de comandos.
+    """
+    if nombre not in _POLITICAS:
+        _POLITICAS[nombre] = PoliticaLlamadas(nombre, **{**por_defecto, **_CONFIGURACION})
+    return _POLITICAS[nombre]
+
+
+def log_stats_politicas() -> None:
+    for politica in _POLITICAS.values():
+        politica.log_stats()
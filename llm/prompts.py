@@ -1,6 +1,9 @@
 # llm/prompts.py
 
+from typing import List, Tuple
+
 from config import RESUMEN_RUBROS_ADICIONALES # Para acceder a los resúmenes de rubros
+from llm.tokens import estimar_tokens, recortar_a_tokens
 
 def generar_prompt_completar_texto(texto_incompleto: str) -> str:
     """
@@ -25,6 +28,19 @@ Texto corregido:
     return prompt
 
 
+def generar_prompt_completar_texto_presupuestado(texto_incompleto: str, max_tokens: int) -> Tuple[str, bool]:
+    """
+    Igual que generar_prompt_completar_texto, pero recorta el texto del documento para que el
+    prompt completo no supere `max_tokens` (estimados).
+
+    Returns:
+        (prompt, True si hubo que recortar el texto)
+    """
+    disponible = max_tokens - estimar_tokens(generar_prompt_completar_texto(""))
+    texto = recortar_a_tokens(texto_incompleto, disponible)
+    return generar_prompt_completar_texto(texto), len(texto) < len(texto_incompleto)
+
+
 
 def generar_prompt_clasificacion(texts_emisor: list, texts_receptor: list,
                                  resumen_rubros: dict, rubros_rut: list,
@@ -66,6 +82,66 @@ Basado en esta información, ¿cuáles son los rubros principales a los que este
 """
     return prompt
 
+
+def anotar_repeticiones(textos: list, repeticiones: list = None) -> list:
+    """
+    Agrega a cada completación cuántos documentos idénticos representa (cuando es más de uno),
+    para que el prompt de clasificación conserve el peso de los documentos repetidos.
+    """
+    if not repeticiones:
+        return textos
+    return [
+        f"{texto}\n(Este documento se repite {n} veces)" if n > 1 else texto
+        for texto, n in zip(textos, repeticiones)
+    ]
+
+
+def _intercalar(texts_emisor: list, texts_receptor: list) -> List[Tuple[str, int]]:
+    """(lado, índice) alternando emisor y receptor, para que ambos lados entren al presupuesto."""
+    orden = []
+    for i in range(max(len(texts_emisor), len(texts_receptor))):
+        if i < len(texts_emisor):
+            orden.append(("emisor", i))
+        if i < len(texts_receptor):
+            orden.append(("receptor", i))
+    return orden
+
+
+def generar_prompt_clasificacion_presupuestado(texts_emisor: list, texts_receptor: list,
+                                               resumen_rubros: dict, rubros_rut: list,
+                                               generar_prompt2_func, max_tokens: int) -> Tuple[str, int]:
+    """
+    Igual que generar_prompt_clasificacion, pero incluye solo las completaciones que caben en
+    `max_tokens` (estimados). Las instrucciones y el resumen de rubros se incluyen siempre; las
+    completaciones se agregan en orden, alternando emisor y receptor, y se omiten las que no
+    caben. Si no cabe ninguna, la primera se recorta al espacio disponible.
+
+    Returns:
+        (prompt, número de completaciones descartadas)
+    """
+    disponible = max_tokens - estimar_tokens(
+        generar_prompt_clasificacion([], [], resumen_rubros, rubros_rut, generar_prompt2_func)
+    )
+    textos = {"emisor": texts_emisor, "receptor": texts_receptor}
+    incluidos = {"emisor": {}, "receptor": {}}
+    orden = _intercalar(texts_emisor, texts_receptor)
+    for lado, i in orden:
+        costo = estimar_tokens(textos[lado][i]) + 1  # + salto de línea
+        if costo <= disponible:
+            incluidos[lado][i] = textos[lado][i]
+            disponible -= costo
+    if orden and not incluidos["emisor"] and not incluidos["receptor"] and disponible > 0:
+        lado, i = orden[0]
+        incluidos[lado][i] = recortar_a_tokens(textos[lado][i], disponible - 1)
+
+    prompt = generar_prompt_clasificacion(
+        [incluidos["emisor"][i] for i in sorted(incluidos["emisor"])],
+        [incluidos["receptor"][i] for i in sorted(incluidos["receptor"])],
+        resumen_rubros, rubros_rut, generar_prompt2_func
+    )
+    descartados = len(texts_emisor) + len(texts_receptor) - len(incluidos["emisor"]) - len(incluidos["receptor"])
+    return prompt, descartados
+
 def generar_prompt2(arg1, arg2):
     """
     Genera el segmento de prompt de contexto adicional para la clasificación
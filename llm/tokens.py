@@ -0,0 +1,95 @@
+# llm/tokens.py
+
+import math
+import logging
+from collections import Counter
+from typing import Dict, List
+
+from config import LLM_CARACTERES_POR_TOKEN
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+
+def estimar_tokens(texto: str) -> int:
+    """
+    Estimación rápida (sin tokenizador) de los tokens de un texto: caracteres / LLM_CARACTERES_POR_TOKEN.
+    Es conservadora a propósito: sobreestimar solo achica el presupuesto, subestimar desborda el contexto.
+    """
+    return math.ceil(len(texto) / LLM_CARACTERES_POR_TOKEN)
+
+
+def recortar_a_tokens(texto: str, max_tokens: int) -> str:
+    """Recorta `texto` para que su estimación no supere `max_tokens` (sin cortar, si ya cabe)."""
+    max_caracteres = max(0, int(max_tokens * LLM_CARACTERES_POR_TOKEN))
+    return texto if len(texto) <= max_caracteres else texto[:max_caracteres]
+
+
+def presupuesto_prompt(num_ctx_permitidos: List[int], tokens_respuesta: int) -> int:
+    """Tokens disponibles para el prompt en el mayor contexto permitido, reservando la respuesta."""
+    return max(num_ctx_permitidos) - tokens_respuesta
+
+
+def elegir_num_ctx(prompt: str, tokens_respuesta: int, num_ctx_permitidos: List[int]) -> int:
+    """Menor num_ctx permitido en que caben el prompt y la respuesta (o el mayor, si ninguno alcanza)."""
+    necesarios = estimar_tokens(prompt) + tokens_respuesta
+    for num_ctx in sorted(num_ctx_permitidos):
+        if num_ctx >= necesarios:
+            return num_ctx
+    return max(num_ctx_permitidos)
+
+
+class EstadisticasPrompts:
+    """Tamaño de los prompts de una etapa, contextos usados y contenido descartado por presupuesto."""
+
+    def __init__(self, etapa: str):
+        self.etapa = etapa
+        self.prompts = 0
+        self.tokens = 0
+        self.tokens_max = 0
+        self.num_ctx = Counter()
+        self.prompts_recortados = 0
+        self.textos_descartados = 0
+        self.duplicados = 0
+
+    def registrar(self, tokens: int, num_ctx: int = 0) -> None:
+        self.prompts += 1
+        self.tokens += tokens
+        self.tokens_max = max(self.tokens_max, tokens)
+        if num_ctx:
+            self.num_ctx[num_ctx] += 1
+
+    def registrar_recorte(self, textos_descartados: int = 0) -> None:
+        self.prompts_recortados += 1
+        self.textos_descartados += textos_descartados
+
+    def registrar_duplicados(self, duplicados: int) -> None:
+        """Prompts idénticos a otro del mismo RUT, que no se envían al LLM."""
+        self.duplicados += duplicados
+
+    def log_stats(self) -> None:
+        contextos = ", ".join(f"{n} x{veces}" for n, veces in sorted(self.num_ctx.items()))
+        logging.info(
+            "Prompts %s: %d prompts, %d tokens estimados en promedio (máx %d)%s, "
+            "%d recortados por presupuesto (%d textos descartados)%s",
+            self.etapa, self.prompts, self.tokens / self.prompts if self.prompts else 0, self.tokens_max,
+            f", num_ctx {contextos}" if contextos else "", self.prompts_recortados, self.textos_descartados,
+            f", {self.duplicados} llamadas evitadas por documentos repetidos" if self.duplicados else ""
+        )
+
+
+_ESTADISTICAS: Dict[str, EstadisticasPrompts] = {}
+
+
+def get_estadisticas_prompts(etapa: str) -> EstadisticasPrompts:
+    """Estadísticas compartidas por etapa ('completación', 'clasificación')."""
+    if etapa not in _ESTADISTICAS:
+        _ESTADISTICAS[etapa] = EstadisticasPrompts(etapa)
+    return _ESTADISTICAS[etapa]
+
+
+def log_stats_prompts() -> None:
+    for estadisticas in _ESTADISTICAS.values():
+        estadisticas.log_stats()
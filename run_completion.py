@@ -1,11 +1,12 @@
 #run_completion.py
 
+import os
 import argparse
 import asyncio
 import aiohttp
 import logging
 from tqdm.asyncio import tqdm as async_tqdm
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 # --- Configuración de logging global ---
 logging.basicConfig(
@@ -18,7 +19,8 @@ from config import (
     TEXT_DATA_FILENAME, ACTIVITY_CODES_FILENAME, SII_DATA_FILENAME,
     RESULTS_DIR, RESUMEN_RUBROS_ADICIONALES,
     LLM_MODEL_NAME, LLM_TEMPERATURE, INNER_WORKERS, OUTER_WORKERS,
-    OLLAMA_BASE_URL
+    S3_MAX_WORKERS, CLASSIFICATION_RESULTS_DIR,
+    LLM_NUM_CTX_COMPLETACION, LLM_TOKENS_RESPUESTA_COMPLETACION
 )
 from data.loader import LoadTexts, load_activity_codes_data, load_sii_data_complete, load_data_and_preprocess
 from data.preprocessor import (
@@ -27,7 +29,23 @@ from data.preprocessor import (
     build_rut_text_dictionary, obtener_rubros_por_rut 
 )
 
-from llm.prompts import generar_prompt_completar_texto
+from llm.prompts import generar_prompt_completar_texto_presupuestado
+from llm.tokens import (
+    estimar_tokens, elegir_num_ctx, presupuesto_prompt, get_estadisticas_prompts, log_stats_prompts
+)
+from llm.cache import llave_llm, respuesta_con_cache, get_llm_cache, disable_llm_cache
+from llm.policy import get_politica, configurar_politicas, log_stats_politicas
+from llm.endpoints import configurar_pool_ollama, get_pool_ollama
+from clasificador import clasificar_rut
+from utils.result_store import crear_escritor, BACKENDS_RESULTADOS
+from utils.loop_monitor import MonitorLatenciaLoop
+from utils.scheduler import procesar_en_ventana
+from utils.concurrency import LimitadorAdaptativo
+from utils.http_client import crear_sesion_http, EstadisticasConexiones
+from utils.manifest import (
+    RunManifest, manifiesto_de, ETAPA_COMPLETACION, ETAPA_CLASIFICACION,
+    ESTADO_OK, ESTADO_SIN_DATOS, ESTADO_ERROR
+)
 from utils.helpers import *
 
 # --- FUNCIONES AUXILIARES ---
@@ -37,29 +55,41 @@ async def _async_call_aiohttp(
     prompt: str,
     model: str,
     temp: float,
-    semaphore: asyncio.Semaphore
+    limitador: LimitadorAdaptativo
 ) -> str:
     """
-    Realiza una llamada individual a la API de Ollama de forma asíncrona.
+    Realiza una llamada individual a la API de Ollama de forma asíncrona, en el servidor del
+    pool con menos llamadas en curso. Los errores transitorios se reintentan según la política
+    de la etapa; solo si se agotan los intentos se devuelve un "Error:".
+    num_ctx es el menor contexto permitido (LLM_NUM_CTX_COMPLETACION) en que caben el prompt y la respuesta.
+    Las respuestas exitosas se guardan en la cache compartida de respuestas del LLM.
     """
-    url = f"{OLLAMA_BASE_URL}/api/chat"
+    num_ctx = elegir_num_ctx(prompt, LLM_TOKENS_RESPUESTA_COMPLETACION, LLM_NUM_CTX_COMPLETACION)
+    get_estadisticas_prompts("completación").registrar(estimar_tokens(prompt), num_ctx)
+    options = {"temperature": temp, "top_p": 1, "repeat_penalty": 1.1, "num_ctx": num_ctx}
     payload = {
         "model": model,
         "messages": [{"role": "user", "content": prompt}],
         "stream": False,
-        "options": {"temperature": temp, "top_p": 1, "repeat_penalty": 1.1, "num_ctx": 4200}
+        "options": options
     }
-    timeout = aiohttp.ClientTimeout(total=None, connect=10, sock_connect=10, sock_read=None)
-    
-    async with semaphore:
-        try:
-            async with session.post(url, json=payload, timeout=timeout) as response:
+    politica = get_politica("completación")
+    timeout = politica.timeout_http()
+
+    async def _llamar() -> str:
+        async with limitador, get_pool_ollama().endpoint() as url_base:
+            async with session.post(f"{url_base}/api/chat", json=payload, timeout=timeout) as response:
                 response.raise_for_status()
                 data = await response.json()
                 return data["message"]["content"].strip()
-        except (aiohttp.ClientError, asyncio.TimeoutError, Exception) as e:
-            async_tqdm.write(f"-- Error en llamada aiohttp para prompt '{prompt[:30]}...': {e}")
-            return "Error: Fallo en la llamada a la API"
+
+    try:
+        return await respuesta_con_cache(
+            llave_llm("ollama", model, temp, options, prompt), lambda: politica.ejecutar(_llamar)
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError, Exception) as e:
+        async_tqdm.write(f"-- Error en llamada aiohttp para prompt '{prompt[:30]}...': {e}")
+        return "Error: Fallo en la llamada a la API"
 
 
 async def _process_completions(
@@ -67,68 +97,253 @@ async def _process_completions(
     prompts: List[str],
     model: str,
     temp: float,
-    semaphore: asyncio.Semaphore
+    limitador: LimitadorAdaptativo
 ) -> List[str]:
     """
     Procesa en paralelo múltiples prompts contra la API del LLM.
     """
-    tasks = [_async_call_aiohttp(session, p, model, temp, semaphore) for p in prompts]
+    tasks = [_async_call_aiohttp(session, p, model, temp, limitador) for p in prompts]
     return await asyncio.gather(*tasks)
 
 
 # --- PIPELINE PRINCIPAL DE COMPLETACIÓN ---
 
+async def _completar_rut(
+    session: aiohttp.ClientSession,
+    rut: str,
+    common_data: Dict[str, Any],
+    args: argparse.Namespace,
+    limitador: LimitadorAdaptativo
+) -> Dict[str, List[Any]]:
+    """
+    Completa los textos emisores de un solo RUT. RECORDAR QUE POSEE MAS DE UN TEXTO ASOCIADO
+    Los documentos con el mismo resumen se completan una sola vez; 'repeticiones_emisor' indica
+    cuántos documentos representa cada completación.
+    La concurrencia de llamadas la regula `limitador`, compartido por todos los RUTs.
+    """
+    texts_emisor_all = common_data['_rut_dict'].get(rut, {}).get('emisor', [])
+    limit = args.max_docs_per_rut
+    texts_emisor = texts_emisor_all[:limit] if limit is not None else texts_emisor_all
+
+    if not texts_emisor:
+        return {'emisor': [], 'receptor': [], 'repeticiones_emisor': []}
+
+    if limit is not None and len(texts_emisor_all) > limit:
+        async_tqdm.write(f"--- RUT {rut}: Procesando {len(texts_emisor)}/{len(texts_emisor_all)} documentos.")
+
+    # Documentos con el mismo resumen (ej. facturas repetidas al mismo cliente) se completan una sola vez
+    resumenes, repeticiones = agrupar_repetidos(
+        [extraer_info_concatenada(texto_legible_y_anonimo(txt, False)) for txt in texts_emisor]
+    )
+    if len(resumenes) < len(texts_emisor):
+        get_estadisticas_prompts("completación").registrar_duplicados(len(texts_emisor) - len(resumenes))
+        logging.debug(f"RUT {rut}: {len(texts_emisor)} documentos, {len(resumenes)} distintos.")
+
+    max_tokens = presupuesto_prompt(LLM_NUM_CTX_COMPLETACION, LLM_TOKENS_RESPUESTA_COMPLETACION)
+    prompts = []
+    for resumen in resumenes:
+        prompt, recortado = generar_prompt_completar_texto_presupuestado(resumen, max_tokens)
+        if recortado:
+            get_estadisticas_prompts("completación").registrar_recorte()
+            async_tqdm.write(f"--- RUT {rut}: documento recortado para caber en el contexto de completación.")
+        prompts.append(prompt)
+    logging.debug(f"Prompts generados para RUT {rut}: {len(prompts)}")
+
+    if not prompts:
+        return {'emisor': [], 'receptor': [], 'repeticiones_emisor': []}
+
+    responses = await _process_completions(session, prompts, args.llm_model, args.llm_temperature_toContext, limitador)
+    exitosas = [(r, n) for r, n in zip(responses, repeticiones) if not r.startswith("Error:")]
+
+    return {
+        'emisor': OnlyAnswer([r for r, _ in exitosas]),
+        'receptor': [],
+        'repeticiones_emisor': [n for _, n in exitosas]
+    }
+
+
+def _estado_sin_completaciones(rut: str, common_data: Dict[str, Any]) -> str:
+    """Estado de un RUT sin completaciones: sin documentos, o todas las llamadas fallaron."""
+    return ESTADO_ERROR if common_data['_rut_dict'].get(rut, {}).get('emisor') else ESTADO_SIN_DATOS
+
+
+def _armar_salida(rut: str, data: Dict[str, List[Any]], common_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Registro de salida de la completación de un RUT (contenido de salida_rubro_{rut}.pkl)."""
+    return {
+        'rut': rut,
+        'giros_declarados_rut': common_data['rubros_por_rut'].get(rut),
+        'documentos_emisor_original': common_data['_rut_dict'].get(rut, {}).get('emisor'),
+        'documentos_receptor_original': common_data['_rut_dict'].get(rut, {}).get('receptor'),
+        'completaciones_emisor_limpias': data['emisor'],
+        'completaciones_receptor_limpias': data['receptor'],
+        'repeticiones_completaciones_emisor': data['repeticiones_emisor'],
+    }
+
+
+def _limitador_completacion(args: argparse.Namespace) -> LimitadorAdaptativo:
+    """Límite adaptativo de llamadas de completación; parte de outer_workers x inner_workers."""
+    return LimitadorAdaptativo("completación", inicial=args.outer_workers * args.inner_workers)
+
+
+async def _drenar_escritores(*almacenes) -> None:
+    for almacen in almacenes:
+        if almacen is not None:
+            await almacen.drenar()
+
+
 async def run_completion_step(
     ruts: List[str],
     common_data: Dict[str, Any],
-    args: argparse.Namespace
-) -> Dict[str, Dict[str, List[str]]]:
+    args: argparse.Namespace,
+    manifest_completacion: RunManifest,
+    almacen_completacion
+) -> int:
     """
-    Ejecuta la fase de completación de textos para un lote de RUTs.
+    Ejecuta la fase de completación de textos con una ventana deslizante de RUTs en curso: cada
+    RUT se guarda apenas termina y se admite el siguiente, sin esperar al más lento de un lote.
+    Las llamadas simultáneas al LLM las regula un límite adaptativo (AIMD). Cada `batch_size` RUTs se drena el escritor y se registra el avance.
+
+    Returns:
+        Número de RUTs con completaciones guardadas.
     """
     logging.info(f"--- Ejecutando fase de COMPLETACIÓN para {len(ruts)} RUTs...")
-    outer_semaphore = asyncio.Semaphore(args.outer_workers)
-    results: Dict[str, Dict[str, List[str]]] = {rut: {'emisor': [], 'receptor': []} for rut in ruts}
+    guardados = 0
+    limitador = _limitador_completacion(args)
+    estadisticas_http = EstadisticasConexiones()
+
+    # Tantas conexiones como el máximo del límite, para que las llamadas no esperen conexión con el cupo tomado
+    async with crear_sesion_http(limit=limitador.maximo, estadisticas=estadisticas_http) as session:
 
-    async with aiohttp.ClientSession() as session:
-        
         async def process_rut(rut: str) -> None:
             """
-            Procesa de manera aislada un solo RUT. RECORDAR QUE POSEE MAS DE UN TEXTO ASOCIADO
+            Procesa de manera aislada un solo RUT.
             """
+            nonlocal guardados
             try:
-                async with outer_semaphore:
-                    texts_emisor_all = common_data['_rut_dict'].get(rut, {}).get('emisor', [])
-                    limit = args.max_docs_per_rut
-                    texts_emisor = texts_emisor_all[:limit] if limit is not None else texts_emisor_all
-                    
-                    if not texts_emisor:
-                        return
+                data = await _completar_rut(session, rut, common_data, args, limitador)
+            except Exception as e:
+                async_tqdm.write(f"--- ERROR CRÍTICO procesando RUT {rut}: {e}. Continuando con el siguiente.")
+                manifest_completacion.registrar(rut, ETAPA_COMPLETACION, ESTADO_ERROR)
+                return
+            if not data['emisor']:
+                manifest_completacion.registrar(rut, ETAPA_COMPLETACION, _estado_sin_completaciones(rut, common_data))
+                return
+            await almacen_completacion.guardar(
+                rut, _armar_salida(rut, data, common_data),
+                manifest_completacion.al_guardar(rut, ETAPA_COMPLETACION, ESTADO_OK)
+            )
+            guardados += 1
 
-                    if limit is not None and len(texts_emisor_all) > limit:
-                        async_tqdm.write(f"--- RUT {rut}: Procesando {len(texts_emisor)}/{len(texts_emisor_all)} documentos.")
+        await procesar_en_ventana(
+            ruts, process_rut, args.outer_workers,
+            checkpoint_cada=args.batch_size,
+            al_checkpoint=lambda _: _drenar_escritores(almacen_completacion),
+            desc="Procesando Textos (Completación)"
+        )
 
-                    prompts = [
-                        generar_prompt_completar_texto(extraer_info_concatenada(texto_legible_y_anonimo(txt, False)))
-                        for txt in texts_emisor
-                    ]
-                    logging.debug(f"Prompts generados para RUT {rut}: {len(prompts)}")
+    await _drenar_escritores(almacen_completacion)
+    estadisticas_http.log_stats("Conexiones HTTP")
+    limitador.log_stats()
+    return guardados
 
-                    if not prompts:
-                        return
 
-                    inner_semaphore = asyncio.Semaphore(args.inner_workers)
-                    responses = await _process_completions(session, prompts, args.llm_model, args.llm_temperature_toContext, inner_semaphore)
+async def run_pipeline_step(
+    ruts: List[str],
+    common_data: Dict[str, Any],
+    args: argparse.Namespace,
+    manifest_completacion: RunManifest,
+    manifest_clasificacion: RunManifest,
+    almacen_clasificacion,
+    almacen_completacion=None
+) -> int:
+    """
+    Completación y clasificación encadenadas (modo --pipeline).
 
-                    results[rut]['emisor'] = OnlyAnswer([r for r in responses if not r.startswith("Error:")])
-                    results[rut]['receptor'] = []
+    Las completaciones avanzan en una ventana deslizante de RUTs. Cada RUT
+    completado pasa de inmediato a una cola acotada que consumen `class_workers`
+    clasificadores. Si la clasificación se atrasa, la cola se llena y los completadores
+    esperan con su cupo tomado (back-pressure), por lo que ninguna etapa acumula trabajo.
+    Las salidas intermedias solo se guardan si se entrega `almacen_completacion`. Los almacenes
+    son EscritorResultados (escriben en un hilo aparte); se drenan cada `batch_size` RUTs.
 
+    Returns:
+        Número de RUTs clasificados.
+    """
+    logging.info(f"--- Ejecutando COMPLETACIÓN + CLASIFICACIÓN para {len(ruts)} RUTs...")
+    limitador_completacion = _limitador_completacion(args)
+    limitador_clasificacion = LimitadorAdaptativo("clasificación", inicial=args.class_workers)
+    cola: asyncio.Queue = asyncio.Queue(maxsize=args.queue_size)
+    clasificados = 0
+    estadisticas_http = EstadisticasConexiones()
+
+    async with crear_sesion_http(
+        limit=limitador_completacion.maximo + limitador_clasificacion.maximo, estadisticas=estadisticas_http
+    ) as session:
+
+        async def completar(rut: str) -> None:
+            try:
+                data = await _completar_rut(session, rut, common_data, args, limitador_completacion)
+                if not data['emisor']:
+                    estado = _estado_sin_completaciones(rut, common_data)
+                    manifest_completacion.registrar(rut, ETAPA_COMPLETACION, estado)
+                    manifest_clasificacion.registrar(rut, ETAPA_CLASIFICACION, estado)
+                    return
+                output = _armar_salida(rut, data, common_data)
+                if almacen_completacion is not None:
+                    await almacen_completacion.guardar(
+                        rut, output, manifest_completacion.al_guardar(rut, ETAPA_COMPLETACION, ESTADO_OK)
+                    )
+                else:
+                    manifest_completacion.registrar(rut, ETAPA_COMPLETACION, ESTADO_OK)
+                await cola.put(output)
             except Exception as e:
                 async_tqdm.write(f"--- ERROR CRÍTICO procesando RUT {rut}: {e}. Continuando con el siguiente.")
-        
-        await async_tqdm.gather(*[process_rut(rut) for rut in ruts], desc="Procesando Textos (Completación)")
-        
-    return results
+                manifest_completacion.registrar(rut, ETAPA_COMPLETACION, ESTADO_ERROR)
+
+        async def clasificar() -> None:
+            nonlocal clasificados
+            while True:
+                output = await cola.get()
+                if output is None:
+                    return
+                rut = output['rut']
+                try:
+                    ok = await clasificar_rut(session, output, args.class_llm_model, args.class_temperature, limitador_clasificacion)
+                    await almacen_clasificacion.guardar(
+                        rut, output, manifest_clasificacion.al_guardar(rut, ETAPA_CLASIFICACION, ESTADO_OK if ok else ESTADO_ERROR)
+                    )
+                    clasificados += 1
+                except Exception as e:
+                    async_tqdm.write(f"--- ERROR CRÍTICO clasificando RUT {rut}: {e}. Continuando con el siguiente.")
+                    manifest_clasificacion.registrar(rut, ETAPA_CLASIFICACION, ESTADO_ERROR)
+
+        async def checkpoint(completados: int) -> None:
+            await _drenar_escritores(almacen_clasificacion, almacen_completacion)
+            logging.info(f"--- {clasificados} RUTs clasificados en '{args.output_dir}' ---")
+
+        # Tantos clasificadores como el máximo del límite adaptativo; el límite decide cuántos llaman a la vez
+        clasificadores = [
+            asyncio.create_task(clasificar())
+            for _ in range(max(args.class_workers, limitador_clasificacion.maximo))
+        ]
+        try:
+            await procesar_en_ventana(
+                ruts, completar, args.outer_workers,
+                checkpoint_cada=args.batch_size, al_checkpoint=checkpoint,
+                desc="Completación + Clasificación"
+            )
+            for _ in clasificadores:
+                await cola.put(None)
+            await asyncio.gather(*clasificadores)
+        finally:
+            for tarea in clasificadores:
+                tarea.cancel()
+
+    await _drenar_escritores(almacen_clasificacion, almacen_completacion)
+    estadisticas_http.log_stats("Conexiones HTTP")
+    limitador_completacion.log_stats()
+    limitador_clasificacion.log_stats()
+    return clasificados
 
 
 # --- FUNCIÓN PRINCIPAL ---
@@ -142,17 +357,40 @@ async def main() -> None:
     input_group.add_argument("--rut", type=str, help="Un solo RUT para procesar.")
     input_group.add_argument("--rut-list-path", nargs='+', type=str, help="Una o más rutas a archivos con listas de RUTs.")
 
-    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=500, help="Cada cuántos RUTs se drenan los resultados a disco y se registra el avance.")
     parser.add_argument("--llm-model", type=str, default=LLM_MODEL_NAME)
     parser.add_argument("--llm-temperature-toContext", type=float, default=LLM_TEMPERATURE)
     parser.add_argument("--max-docs-per-rut", type=int, default=None)
     parser.add_argument("--solo-un-rubro", action="store_true")
-    parser.add_argument("--inner_workers", type=int, default=INNER_WORKERS)
-    parser.add_argument("--outer_workers", type=int, default=OUTER_WORKERS)
+    parser.add_argument("--inner_workers", type=int, default=INNER_WORKERS, help="Llamadas simultáneas por RUT al partir; outer x inner es el valor inicial del límite adaptativo.")
+    parser.add_argument("--outer_workers", type=int, default=OUTER_WORKERS, help="RUTs en curso a la vez (acota la memoria de textos cargados); sus llamadas las regula el límite adaptativo.")
     parser.add_argument("--new-bucket-data", action="store_true")
+    parser.add_argument("--s3-workers", type=int, default=S3_MAX_WORKERS)
     parser.add_argument("--tipo_muestreo", type=str, default="aleatorio")
+    parser.add_argument("--no-llm-cache", action="store_true", help="No consultar ni guardar respuestas en la cache del LLM.")
+    # --- Modo pipeline: completación y clasificación en una sola ejecución ---
+    parser.add_argument("--pipeline", action="store_true", help="Clasifica cada RUT apenas termina su completación.")
+    parser.add_argument("--class_workers", type=int, default=OUTER_WORKERS, help="Clasificaciones simultáneas en modo pipeline.")
+    parser.add_argument("--class-llm-model", type=str, default=LLM_MODEL_NAME)
+    parser.add_argument("--class-temperature", type=float, default=LLM_TEMPERATURE)
+    parser.add_argument("--queue-size", type=int, default=None, help="RUTs completados en espera de clasificación (por defecto 2 x class_workers).")
+    parser.add_argument("--output-dir", type=str, default=CLASSIFICATION_RESULTS_DIR, help="Directorio de salida de las clasificaciones.")
+    parser.add_argument("--no-intermediate-pickles", action="store_true", help="En modo pipeline no guarda salida_rubro_{rut}.pkl.")
+    parser.add_argument("--resume", action="store_true", help="Omite los RUTs ya terminados según el manifiesto (results/, o --output-dir con --pipeline).")
+    parser.add_argument("--results-backend", choices=BACKENDS_RESULTADOS, default="pickle", help="Un pickle por RUT o shards JSONL rotativos.")
+    parser.add_argument("--max-intentos", type=int, default=None, help="Intentos por llamada al LLM ante 429/5xx/timeouts (por defecto LLM_MAX_INTENTOS).")
+    parser.add_argument("--deadline", type=float, default=None, help="Segundos máximos de espera de la respuesta por intento (por defecto LLM_DEADLINE_INTENTO).")
+    parser.add_argument("--hedge", action="store_true", help="Lanza un duplicado de las llamadas que superan la latencia p95 (gana la primera respuesta).")
+    parser.add_argument("--ollama-urls", nargs='+', default=None, help="Servidores Ollama del pool (por defecto OLLAMA_URLS u OLLAMA_URL).")
+    parser.add_argument("--max-per-endpoint", type=int, default=None, help="Llamadas simultáneas por servidor Ollama (0 = sin tope).")
 
     args = parser.parse_args()
+    if args.no_llm_cache:
+        disable_llm_cache()
+    configurar_politicas(args.max_intentos, args.deadline, args.hedge or None)
+    pool_ollama = configurar_pool_ollama(args.ollama_urls, args.max_per_endpoint)
+    if args.queue_size is None:
+        args.queue_size = 2 * args.class_workers
 
     if args.rut:
         ruts = [args.rut.upper()]
@@ -163,6 +401,14 @@ async def main() -> None:
         ruts = sorted(list(set(ruts)))
         logging.info(f"--- Total RUTs únicos a procesar: {len(ruts)}")
 
+    manifest_completacion = manifiesto_de(RESULTS_DIR)
+    manifest_clasificacion = manifiesto_de(args.output_dir) if args.pipeline else None
+    if args.resume:
+        if args.pipeline:
+            ruts = manifest_clasificacion.pendientes(ruts, ETAPA_CLASIFICACION)
+        else:
+            ruts = manifest_completacion.pendientes(ruts, ETAPA_COMPLETACION)
+
     if not ruts:
         logging.warning("--- No hay RUTs para procesar. Finalizando.")
         return
@@ -172,27 +418,39 @@ async def main() -> None:
         common_data["_rut_dict"], ruts, args.tipo_muestreo, args.max_docs_per_rut
     )
 
-    total_batches = -(-len(ruts) // args.batch_size)
-    for i in range(0, len(ruts), args.batch_size):
-        batch = ruts[i:i + args.batch_size]
-        logging.info(f"--- Procesando Lote {i//args.batch_size + 1}/{total_batches} ({len(batch)} RUTs) ---")
-        
-        completions = await run_completion_step(batch, common_data, args)
-
-        logging.info(f"--- Guardando resultados del Lote {i//args.batch_size + 1} ---")
-        for rut, data in completions.items():
-            if data['emisor']:
-                output = {
-                    'rut': rut,
-                    'giros_declarados_rut': common_data['rubros_por_rut'].get(rut),
-                    'documentos_emisor_original': common_data['_rut_dict'].get(rut, {}).get('emisor'),
-                    'documentos_receptor_original': common_data['_rut_dict'].get(rut, {}).get('receptor'),
-                    'completaciones_emisor_limpias': data['emisor'],
-                    'completaciones_receptor_limpias': data['receptor'],
-                }
-                guardar_pickle(output, f"salida_rubro_{rut}.pkl", RESULTS_DIR)
-
-    logging.info("------- Proceso completado para todos los lotes. -------")
+    almacen_completacion = None
+    if not (args.pipeline and args.no_intermediate_pickles):
+        almacen_completacion = crear_escritor(args.results_backend, RESULTS_DIR, "salida_rubro")
+    almacen_clasificacion = crear_escritor(args.results_backend, args.output_dir, "clasificacion") if args.pipeline else None
+
+    monitor = MonitorLatenciaLoop().iniciar()
+    try:
+        if args.pipeline:
+            clasificados = await run_pipeline_step(
+                ruts, common_data, args, manifest_completacion, manifest_clasificacion,
+                almacen_clasificacion, almacen_completacion
+            )
+            logging.info(f"--- {clasificados} RUTs clasificados en '{args.output_dir}' ---")
+        else:
+            guardados = await run_completion_step(ruts, common_data, args, manifest_completacion, almacen_completacion)
+            logging.info(f"--- {guardados} RUTs con completaciones guardadas en '{RESULTS_DIR}' ---")
+    finally:
+        await monitor.detener()
+        # También ante Ctrl-C: lo ya encolado queda en disco antes de salir
+        for nombre, almacen in (("Resultados (completación)", almacen_completacion),
+                                ("Resultados (clasificación)", almacen_clasificacion)):
+            if almacen is not None:
+                almacen.cerrar()
+                almacen.log_stats(nombre)
+        monitor.log_stats()
+        await pool_ollama.cerrar()
+        pool_ollama.log_stats()
+        log_stats_politicas()
+        log_stats_prompts()
+
+    if get_llm_cache() is not None:
+        get_llm_cache().log_stats()
+    logging.info("------- Proceso completado para todos los RUTs. -------")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,40 @@
+# tests/test_result_store.py
+# Ejecutar desde la raíz del repo: python -m pytest -q tests
+
+import os
+import asyncio
+
+from utils.manifest import RunManifest, ETAPA_COMPLETACION, ESTADO_OK
+from utils.result_store import ResultadosPickle, EscritorResultados
+
+
+def _guardar(almacen: ResultadosPickle, manifest: RunManifest, rut: str) -> None:
+    async def guardar():
+        escritor = EscritorResultados(almacen)
+        await escritor.guardar(rut, {"rut": rut}, manifest.al_guardar(rut, ETAPA_COMPLETACION, ESTADO_OK))
+        await escritor.drenar()
+        escritor.cerrar()
+    asyncio.run(guardar())
+
+
+def test_pickle_fallido_no_marca_el_rut_como_terminado(tmp_path):
+    # El directorio de resultados es un archivo: la escritura del pickle falla
+    directorio = tmp_path / "results"
+    directorio.write_text("")
+    manifest = RunManifest(str(tmp_path / "manifest.jsonl"))
+
+    _guardar(ResultadosPickle(str(directorio), "salida_rubro"), manifest, "123")
+
+    assert manifest.estado("123", ETAPA_COMPLETACION) is None
+    assert manifest.pendientes(["123"], ETAPA_COMPLETACION) == ["123"]
+    assert RunManifest(manifest.path).estado("123", ETAPA_COMPLETACION) is None
+
+
+def test_pickle_guardado_marca_el_rut_como_terminado(tmp_path):
+    directorio = tmp_path / "results"
+    manifest = RunManifest(str(tmp_path / "manifest.jsonl"))
+
+    _guardar(ResultadosPickle(str(directorio), "salida_rubro"), manifest, "123")
+
+    assert os.listdir(directorio) == ["salida_rubro_123.pkl"]
+    assert RunManifest(manifest.path).estado("123", ETAPA_COMPLETACION) == ESTADO_OK
@@ -0,0 +1,83 @@
+# utils/binary_cache.py
+
+import os
+import pickle
+import hashlib
+import logging
+import time
+from typing import Any, Callable, Dict
+
+from config import BINARY_CACHE_ENABLED
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+
+def _sha256_archivo(path: str, bloque: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(bloque), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _firma(path: str) -> Dict[str, int]:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def ruta_cache(origen: str, nombre: str) -> str:
+    """Archivo de cache asociado a `origen` (queda junto a él)."""
+    return f"{origen}.{nombre}.cache.pkl"
+
+
+def cargar_con_cache(origen: str, nombre: str, construir: Callable[[], Any]) -> Any:
+    """
+    Devuelve el resultado de `construir()` derivado del archivo `origen`, guardándolo en un
+    pickle junto a él para las ejecuciones siguientes.
+
+    La cache es válida mientras el tamaño y el mtime del origen no cambien. Si solo cambió el
+    mtime (p. ej. el archivo se copió o se tocó), se compara el sha256 del contenido antes de
+    reconstruir. `nombre` distingue varios derivados de un mismo archivo.
+    """
+    if not BINARY_CACHE_ENABLED:
+        return construir()
+
+    destino = ruta_cache(origen, nombre)
+    firma = _firma(origen)
+    guardado = None
+    if os.path.exists(destino):
+        try:
+            with open(destino, "rb") as f:
+                guardado = pickle.load(f)
+        except Exception as e:
+            logging.warning("Cache binaria ilegible '%s', se reconstruye: %s", destino, e)
+
+    if guardado is not None:
+        if guardado["firma"] == firma:
+            logging.info("Cache binaria vigente: %s", destino)
+            return guardado["valor"]
+        if guardado["firma"]["size"] == firma["size"] and guardado["sha256"] == _sha256_archivo(origen):
+            logging.info("Cache binaria vigente (mismo contenido, mtime distinto): %s", destino)
+            _guardar(destino, firma, guardado["sha256"], guardado["valor"])
+            return guardado["valor"]
+        logging.info("Cache binaria desactualizada respecto de %s, se reconstruye.", origen)
+
+    inicio = time.perf_counter()
+    valor = construir()
+    _guardar(destino, firma, _sha256_archivo(origen), valor)
+    logging.info("Cache binaria '%s' generada (%.1fs)", destino, time.perf_counter() - inicio)
+    return valor
+
+
+def _guardar(destino: str, firma: Dict[str, int], sha256: str, valor: Any) -> None:
+    """Escritura atómica del pickle (un proceso concurrente nunca ve un archivo a medias)."""
+    tmp = f"{destino}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            pickle.dump({"firma": firma, "sha256": sha256, "valor": valor}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, destino)
+    except OSError as e:
+        logging.warning("No se pudo escribir la cache binaria '%s': %s", destino, e)
@@ -0,0 +1,135 @@
+# utils/concurrency.py
+
+import time
+import asyncio
+import logging
+from typing import Optional
+
+from config import LLM_CONCURRENCIA_MAX
+from llm.policy import es_reintentable
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+
+class LimitadorAdaptativo:
+    """
+    Reemplazo adaptativo de asyncio.Semaphore para las llamadas al LLM (AIMD).
+
+    - Aumento aditivo: cada respuesta exitosa suma 1/límite, es decir, el límite sube en ~1 por
+      cada "ronda" completa de llamadas mientras la latencia se mantenga estable.
+    - Disminución multiplicativa: un error de sobrecarga (timeout, 429, 5xx, conexión) multiplica el límite por
+      `factor_error`; si la latencia promedio supera `tolerancia` veces la mejor observada (el
+      servidor está encolando), se multiplica por `factor_latencia`. Se recorta a lo más una vez
+      por latencia promedio, para que una ráfaga de errores de la misma ronda cuente una sola vez.
+
+    Se usa igual que un semáforo: `async with limitador: ...`.
+    """
+
+    def __init__(
+        self,
+        nombre: str,
+        inicial: int,
+        minimo: int = 1,
+        maximo: int = LLM_CONCURRENCIA_MAX,
+        factor_error: float = 0.5,
+        factor_latencia: float = 0.9,
+        tolerancia: float = 2.0,
+        intervalo_log: float = 5.0
+    ):
+        self.nombre = nombre
+        self.minimo = minimo
+        self.maximo = max(minimo, maximo)
+        self.limite = float(min(max(inicial, minimo), self.maximo))
+        self.factor_error = factor_error
+        self.factor_latencia = factor_latencia
+        self.tolerancia = tolerancia
+        self.intervalo_log = intervalo_log
+
+        self.en_curso = 0
+        self.latencia_promedio: Optional[float] = None  # EWMA de las llamadas exitosas
+        self.latencia_base: Optional[float] = None  # mejor EWMA observada
+        self.exitos = 0
+        self.errores = 0
+        self.recortes = 0
+        self.limite_min_observado = self.limite
+        self.limite_max_observado = self.limite
+
+        self._condicion = asyncio.Condition()
+        self._ultimo_recorte = 0.0
+        self._ultimo_log = time.monotonic()
+        self._inicios = {}
+
+    def _capacidad(self) -> int:
+        return max(self.minimo, int(self.limite))
+
+    async def __aenter__(self) -> "LimitadorAdaptativo":
+        async with self._condicion:
+            await self._condicion.wait_for(lambda: self.en_curso < self._capacidad())
+            self.en_curso += 1
+        self._inicios[asyncio.current_task()] = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        inicio = self._inicios.pop(asyncio.current_task(), None)
+        if exc_type is None and inicio is not None:
+            self._registrar_exito(time.monotonic() - inicio)
+        elif exc is not None and isinstance(exc, Exception) and es_reintentable(exc):
+            self._registrar_error()  # otros errores (4xx, respuesta mal formada) no indican sobrecarga
+        async with self._condicion:
+            self.en_curso -= 1
+            self._condicion.notify_all()
+        return False
+
+    def _recortar(self, factor: float) -> None:
+        ahora = time.monotonic()
+        if ahora - self._ultimo_recorte < (self.latencia_promedio or 0.0):
+            return
+        self._ultimo_recorte = ahora
+        self.limite = max(float(self.minimo), self.limite * factor)
+        self.recortes += 1
+
+    def _registrar_exito(self, latencia: float) -> None:
+        self.exitos += 1
+        if self.latencia_promedio is None:
+            self.latencia_promedio = latencia
+        else:
+            self.latencia_promedio = 0.8 * self.latencia_promedio + 0.2 * latencia
+        if self.latencia_base is None or self.latencia_promedio < self.latencia_base:
+            self.latencia_base = self.latencia_promedio
+
+        if self.latencia_promedio > self.tolerancia * self.latencia_base:
+            self._recortar(self.factor_latencia)
+        else:
+            self.limite = min(float(self.maximo), self.limite + 1.0 / self.limite)
+        self._actualizar()
+
+    def _registrar_error(self) -> None:
+        self.errores += 1
+        self._recortar(self.factor_error)
+        self._actualizar()
+
+    def _actualizar(self) -> None:
+        self.limite_min_observado = min(self.limite_min_observado, self.limite)
+        self.limite_max_observado = max(self.limite_max_observado, self.limite)
+        ahora = time.monotonic()
+        if ahora - self._ultimo_log >= self.intervalo_log:
+            self._ultimo_log = ahora
+            self._log_estado()
+
+    def _log_estado(self) -> None:
+        logging.info(
+            "Concurrencia %s: límite %d (%d en curso), latencia promedio %.2fs (mejor %.2fs), %d errores",
+            self.nombre, self._capacidad(), self.en_curso,
+            self.latencia_promedio or 0.0, self.latencia_base or 0.0, self.errores
+        )
+
+    def log_stats(self) -> None:
+        logging.info(
+            "Concurrencia %s: límite final %d (rango %d-%d), latencia promedio %.2fs (mejor %.2fs), "
+            "%d éxitos, %d errores, %d recortes",
+            self.nombre, self._capacidad(), int(self.limite_min_observado), int(self.limite_max_observado),
+            self.latencia_promedio or 0.0, self.latencia_base or 0.0, self.exitos, self.errores, self.recortes
+        )
@@ -0,0 +1,131 @@
+# utils/disk_cache.py
+
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+
+class DiskCache:
+    """
+    Cache de contenido en disco con expulsión LRU acotada por tamaño total.
+
+    Cada entrada se guarda como un archivo cuyo nombre es el hash de su llave, por lo que
+    sobrevive entre ejecuciones. El orden LRU se reconstruye al iniciar a partir del mtime
+    de los archivos, que se actualiza en cada acierto. Es seguro usarlo desde varios hilos.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._cargar_indice()
+
+    def _cargar_indice(self) -> None:
+        """Reconstruye el índice LRU desde los archivos existentes (más antiguos primero)."""
+        archivos = []
+        for raiz, _, nombres in os.walk(self.directory):
+            for nombre in nombres:
+                if not nombre.endswith(".bin"):
+                    continue
+                stat = os.stat(os.path.join(raiz, nombre))
+                archivos.append((stat.st_mtime, nombre[:-4], stat.st_size))
+        for _, digest, size in sorted(archivos):
+            self._entradas[digest] = size
+            self._total_bytes += size
+        logging.info("Cache en disco '%s': %d entradas (%.1f MB)",
+                     self.directory, len(self._entradas), self._total_bytes / 1e6)
+
+    @staticmethod
+    def _digest(key: Tuple[str, ...]) -> str:
+        return hashlib.sha256("\x00".join(key).encode("utf-8")).hexdigest()
+
+    def _ruta(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], f"{digest}.bin")
+
+    def get(self, key: Tuple[str, ...]) -> Optional[bytes]:
+        """Devuelve el contenido asociado a la llave o None si no está en cache."""
+        digest = self._digest(key)
+        with self._lock:
+            if digest not in self._entradas:
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(digest)
+        ruta = self._ruta(digest)
+        try:
+            with open(ruta, "rb") as f:
+                data = f.read()
+            os.utime(ruta)
+        except OSError:
+            with self._lock:
+                self._total_bytes -= self._entradas.pop(digest, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: Tuple[str, ...], data: bytes) -> None:
+        """Guarda el contenido y expulsa las entradas menos usadas si se supera max_bytes."""
+        if len(data) > self.max_bytes:
+            return
+        digest = self._digest(key)
+        ruta = self._ruta(digest)
+        tmp = f"{ruta}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, ruta)
+        except OSError as e:
+            logging.warning("No se pudo escribir en la cache '%s': %s", ruta, e)
+            return
+
+        with self._lock:
+            self._total_bytes += len(data) - self._entradas.pop(digest, 0)
+            self._entradas[digest] = len(data)
+            expulsados = []
+            while self._total_bytes > self.max_bytes and self._entradas:
+                viejo, size = self._entradas.popitem(last=False)
+                self._total_bytes -= size
+                self.evictions += 1
+                expulsados.append(viejo)
+        for viejo in expulsados:
+            try:
+                os.remove(self._ruta(viejo))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        """Contadores de uso de la cache."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entradas": len(self._entradas),
+                "bytes": self._total_bytes,
+            }
+
+    def log_stats(self, nombre: str = "cache") -> None:
+        """Registra en el log los aciertos/fallos acumulados."""
+        s = self.stats()
+        total = s["hits"] + s["misses"]
+        logging.info(
+            "%s: %d hits, %d misses (%.1f%% hit rate), %d expulsiones, %d entradas (%.1f MB)",
+            nombre, s["hits"], s["misses"], 100.0 * s["hits"] / total if total else 0.0,
+            s["evictions"], s["entradas"], s["bytes"] / 1e6
+        )
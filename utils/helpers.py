@@ -8,9 +8,12 @@ import re
 import random
 import logging
 from datetime import datetime
-from typing import Any, List, Dict, Optional
+from typing import Any, List, Dict, Optional, Tuple
 import pandas as pd
 
+from utils.minhash import samplear_diverso
+from utils.result_store import cargar_datos_desde_shards
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s"
@@ -93,23 +96,41 @@ def cargar_datos(args_input: str, ruts: List[str]) -> List[Dict[str, Any]]:
         datos_a_procesar = cargar_datos_desde_zip(args_input, ruts)
 
     elif os.path.isdir(args_input):
-        # Es un folder
-        datos_a_procesar = cargar_datos_desde_folder(args_input, ruts)
+        # Es un folder: pickles por RUT y/o shards (--results-backend shards). Si un RUT está en
+        # ambos, gana el archivo modificado más recientemente (pickle contra shard; en empate, el shard)
+        mtimes_pickle: Dict[str, float] = {}
+        mtimes_shard: Dict[str, float] = {}
+        por_rut = {
+            str(d.get('rut', '')).lstrip('0'): d
+            for d in cargar_datos_desde_folder(args_input, ruts, mtimes=mtimes_pickle)
+        }
+        for d in cargar_datos_desde_shards(args_input, ruts, mtimes=mtimes_shard):
+            rut = str(d.get('rut', '')).lstrip('0')
+            if mtimes_shard[rut] >= mtimes_pickle.get(rut, float('-inf')):
+                por_rut[rut] = d
+        datos_a_procesar = list(por_rut.values())
 
     else:
         raise ValueError(f"La ruta proporcionada no es un ZIP ni un folder válido: {args_input}")
 
     return datos_a_procesar
 
-def cargar_datos_desde_folder(folder_path: str, nombres_a_cargar: List[str]) -> List[Dict[str, Any]]:
+def cargar_datos_desde_folder(
+    folder_path: str,
+    nombres_a_cargar: List[str],
+    mtimes: Optional[Dict[str, float]] = None
+) -> List[Dict[str, Any]]:
     datos: List[Dict[str, Any]] = []
     for archivo in os.listdir(folder_path):
         if archivo.endswith(".pkl"):
             rut = os.path.basename(archivo).removeprefix("salida_rubro_").removesuffix(".pkl").lstrip('0')
             if rut in nombres_a_cargar:
                 try:
-                    with open(os.path.join(folder_path, archivo), "rb") as f:
+                    ruta = os.path.join(folder_path, archivo)
+                    with open(ruta, "rb") as f:
                         datos.append(pickle.load(f))
+                    if mtimes is not None:
+                        mtimes[str(datos[-1].get('rut', '')).lstrip('0')] = os.path.getmtime(ruta)
                 except Exception as e:
                     logging.warning(f"No se pudo cargar el archivo {archivo}. Error: {e}")
     return datos
@@ -219,7 +240,9 @@ def samplear_documentos_por_rut(
     Args:
         rut_dict: Diccionario que contiene los datos, ej: {'RUT1': {'emisor': [...]}}.
         ruts_a_procesar: Lista de RUTs sobre los que se aplicará el muestreo.
-        metodo: Método de muestreo ('aleatorio', 'recientes', 'antiguos', 'estratificado').
+        metodo: Método de muestreo ('aleatorio', 'recientes', 'antiguos', 'estratificado', 'diverso').
+            'diverso' reparte la muestra entre clusters de documentos parecidos (productos y
+            contraparte), ver utils/minhash.py; no requiere fechas.
         n_muestras: Número de documentos a seleccionar.
 
     Returns:
@@ -237,6 +260,11 @@ def samplear_documentos_por_rut(
             resultado_muestreado[rut] = rut_dict[rut].copy()
             continue
 
+        if metodo == 'diverso':
+            resultado_muestreado[rut] = rut_dict[rut].copy()
+            resultado_muestreado[rut]['emisor'] = samplear_diverso(documentos_originales, n_muestras)
+            continue
+
         documentos_con_fecha = [(doc, _extraer_fecha(doc)) for doc in documentos_originales if _extraer_fecha(doc)]
 
         if not documentos_con_fecha:
@@ -265,7 +293,7 @@ def samplear_documentos_por_rut(
             documentos_seleccionados = muestras_estratificadas['documento'].tolist()
 
         else:
-            raise ValueError(f"Método '{metodo}' no reconocido. Use 'aleatorio', 'recientes', 'antiguos' o 'estratificado'.")
+            raise ValueError(f"Método '{metodo}' no reconocido. Use 'aleatorio', 'recientes', 'antiguos', 'estratificado' o 'diverso'.")
 
         resultado_muestreado[rut] = rut_dict[rut].copy()
         resultado_muestreado[rut]['emisor'] = documentos_seleccionados
@@ -291,4 +319,20 @@ def OnlyAnswer(texts_: List[str]) -> List[str]:
         re.sub(r"<think>.*?</think>\s*|Texto corregido:\n", "", i_, flags=re.DOTALL).strip()
         for i_ in texts_
     ]
-    return texts_solo_respuesta
\ No newline at end of file
+    return texts_solo_respuesta
+
+
+def agrupar_repetidos(textos: List[str]) -> Tuple[List[str], List[int]]:
+    """
+    Agrupa los textos idénticos conservando el orden de primera aparición.
+
+    Args:
+        textos (List[str]): Lista de textos, posiblemente repetidos (ej. prompts de un mismo RUT).
+
+    Returns:
+        Tuple[List[str], List[int]]: Textos únicos y cuántas veces aparece cada uno.
+    """
+    repeticiones: Dict[str, int] = {}
+    for texto in textos:
+        repeticiones[texto] = repeticiones.get(texto, 0) + 1
+    return list(repeticiones), list(repeticiones.values())
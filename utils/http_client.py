@@ -0,0 +1,75 @@
+# utils/http_client.py
+
+import logging
+from typing import Dict, Optional
+
+import aiohttp
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+
+class EstadisticasConexiones:
+    """
+    Cuenta conexiones TCP nuevas vs. reutilizadas de una ClientSession (vía TraceConfig),
+    para verificar que el pool de conexiones efectivamente se reutiliza.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.nuevas = 0
+        self.reutilizadas = 0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def _request_start(session, ctx, params) -> None:
+            self.requests += 1
+
+        async def _conexion_nueva(session, ctx, params) -> None:
+            self.nuevas += 1
+
+        async def _conexion_reutilizada(session, ctx, params) -> None:
+            self.reutilizadas += 1
+
+        trace.on_request_start.append(_request_start)
+        trace.on_connection_create_end.append(_conexion_nueva)
+        trace.on_connection_reuseconn.append(_conexion_reutilizada)
+        return trace
+
+    def stats(self) -> Dict[str, int]:
+        return {"requests": self.requests, "nuevas": self.nuevas, "reutilizadas": self.reutilizadas}
+
+    def log_stats(self, nombre: str = "HTTP") -> None:
+        """Registra en el log cuántas requests usaron una conexión ya abierta."""
+        total = self.nuevas + self.reutilizadas
+        logging.info(
+            "%s: %d requests, %d conexiones nuevas, %d reutilizadas (%.1f%% reutilización)",
+            nombre, self.requests, self.nuevas, self.reutilizadas,
+            100.0 * self.reutilizadas / total if total else 0.0
+        )
+
+
+def crear_sesion_http(
+    limit: int = 100,
+    limit_per_host: int = 0,
+    keepalive_timeout: float = 75,
+    ttl_dns_cache: int = 300,
+    estadisticas: Optional[EstadisticasConexiones] = None
+) -> aiohttp.ClientSession:
+    """
+    Crea una ClientSession de larga duración para compartir entre todas las llamadas de una
+    ejecución: conexiones keep-alive, límite de conexiones (total y por host) y cache de DNS.
+    Debe usarse como `async with crear_sesion_http(...) as session:`.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        keepalive_timeout=keepalive_timeout,
+        ttl_dns_cache=ttl_dns_cache,
+        use_dns_cache=True,
+    )
+    trace_configs = [estadisticas.trace_config()] if estadisticas is not None else None
+    return aiohttp.ClientSession(connector=connector, trace_configs=trace_configs)
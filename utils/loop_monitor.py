@@ -0,0 +1,70 @@
+# utils/loop_monitor.py
+
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Optional
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+
+class MonitorLatenciaLoop:
+    """
+    Mide cuánto se atrasa el event loop: una tarea duerme `intervalo` segundos y registra cuánto
+    tardó de más en despertar. Si hay código síncrono (escrituras a disco, parseo pesado) dentro de
+    las corrutinas, el atraso crece y con él la latencia de todas las llamadas HTTP en curso.
+
+    El promedio y el máximo son de toda la corrida; el p99 es de las últimas `ventana` mediciones
+    (por defecto 10 minutos a 50 ms), para que la memoria no crezca con corridas de horas.
+    """
+
+    def __init__(self, intervalo: float = 0.05, ventana: int = 12000):
+        self.intervalo = intervalo
+        self.atrasos: Deque[float] = deque(maxlen=ventana)
+        self.mediciones = 0
+        self.total = 0.0
+        self.maximo = 0.0
+        self._tarea: Optional[asyncio.Task] = None
+
+    async def _medir(self) -> None:
+        while True:
+            inicio = time.perf_counter()
+            await asyncio.sleep(self.intervalo)
+            atraso = max(0.0, time.perf_counter() - inicio - self.intervalo)
+            self.atrasos.append(atraso)
+            self.mediciones += 1
+            self.total += atraso
+            self.maximo = max(self.maximo, atraso)
+
+    def iniciar(self) -> "MonitorLatenciaLoop":
+        self._tarea = asyncio.create_task(self._medir())
+        return self
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    def p99(self) -> float:
+        """Percentil 99 del atraso en las últimas `ventana` mediciones."""
+        if not self.atrasos:
+            return 0.0
+        atrasos = sorted(self.atrasos)
+        return atrasos[min(len(atrasos) - 1, int(len(atrasos) * 0.99))]
+
+    def log_stats(self, nombre: str = "Event loop") -> None:
+        if not self.mediciones:
+            return
+        logging.info(
+            "%s: atraso promedio %.1f ms, p99 %.1f ms (últimas %d), máximo %.1f ms (%d mediciones)",
+            nombre, 1000 * self.total / self.mediciones, 1000 * self.p99(), len(self.atrasos),
+            1000 * self.maximo, self.mediciones
+        )
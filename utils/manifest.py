@@ -0,0 +1,120 @@
+# utils/manifest.py
+
+import os
+import json
+import time
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import MANIFEST_FILENAME
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+# Estados de un RUT en una etapa. Con --resume se omiten los terminados y se reintentan
+# los fallidos o los que no aparecen en el manifiesto.
+ESTADO_OK = "ok"
+ESTADO_SIN_DATOS = "sin_datos"  # el RUT no tiene documentos/completaciones que procesar
+ESTADO_ERROR = "error"
+ESTADOS_TERMINADOS = {ESTADO_OK, ESTADO_SIN_DATOS}
+
+ETAPA_COMPLETACION = "completacion"
+ETAPA_CLASIFICACION = "clasificacion"
+
+
+class RunManifest:
+    """
+    Bitácora append-only (JSONL) de RUT -> etapa -> estado / archivo de salida.
+
+    Cada registro es una sola llamada a os.write sobre un archivo abierto con O_APPEND, por lo
+    que agregar es barato y las líneas no se intercalan aunque escriban varias tareas o procesos.
+    Al cargar, el último registro de cada (RUT, etapa) es el que vale; una línea final truncada
+    (proceso interrumpido a mitad de escritura) se ignora.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._estados: Dict[Tuple[str, str], Dict[str, Optional[str]]] = {}
+        self._cargar()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if self._termina_truncado():
+            os.write(self._fd, b"\n")  # que el próximo registro no quede pegado a la línea truncada
+
+    def _termina_truncado(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+
+    def _cargar(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        inicio = time.perf_counter()
+        with open(self.path, "rb") as f:
+            lineas = [linea for linea in f.read().splitlines() if linea.strip()]
+        invalidas = 0
+        try:
+            # Un solo json.loads para todo el archivo (el caso normal)
+            registros = json.loads(b"[" + b",".join(lineas) + b"]")
+        except ValueError:
+            registros = []
+            for linea in lineas:
+                try:
+                    registros.append(json.loads(linea))
+                except ValueError:
+                    invalidas += 1
+        for registro in registros:
+            try:
+                self._estados[(registro["rut"], registro["etapa"])] = registro
+            except (KeyError, TypeError):
+                invalidas += 1
+        lineas = len(lineas)
+        logging.info("Manifiesto '%s': %d registros, %d (RUT, etapa) distintos, %d líneas inválidas (%.2fs)",
+                     self.path, lineas, len(self._estados), invalidas, time.perf_counter() - inicio)
+
+    def registrar(self, rut: str, etapa: str, estado: str, salida: Optional[str] = None) -> None:
+        """Agrega un registro al manifiesto."""
+        registro = {"rut": rut, "etapa": etapa, "estado": estado, "salida": salida, "ts": time.time()}
+        os.write(self._fd, (json.dumps(registro, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._estados[(rut, etapa)] = registro
+
+    def al_guardar(self, rut: str, etapa: str, estado: str) -> Callable[[str], None]:
+        """Callback para los almacenes de resultados: registra el estado con la ruta donde quedó."""
+        return lambda salida: self.registrar(rut, etapa, estado, salida)
+
+    def estado(self, rut: str, etapa: str) -> Optional[str]:
+        """Último estado registrado para el RUT en la etapa (None si no aparece)."""
+        registro = self._estados.get((rut, etapa))
+        return registro["estado"] if registro else None
+
+    def pendientes(self, ruts: Iterable[str], etapa: str) -> List[str]:
+        """RUTs que aún no terminan la etapa (fallidos o ausentes), en el mismo orden."""
+        ruts = list(ruts)
+        pendientes = [rut for rut in ruts if self.estado(rut, etapa) not in ESTADOS_TERMINADOS]
+        logging.info("Reanudando etapa '%s': %d RUTs ya terminados, %d pendientes.",
+                     etapa, len(ruts) - len(pendientes), len(pendientes))
+        return pendientes
+
+    def cerrar(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+_MANIFIESTOS: Dict[str, RunManifest] = {}
+
+
+def manifiesto_de(directorio: str) -> RunManifest:
+    """
+    Manifiesto del directorio de resultados (MANIFEST_FILENAME dentro de él). Cada registro va
+    en el manifiesto del directorio donde queda su archivo de salida. Una instancia por ruta.
+    """
+    path = os.path.abspath(os.path.join(directorio, MANIFEST_FILENAME))
+    if path not in _MANIFIESTOS:
+        _MANIFIESTOS[path] = RunManifest(path)
+    return _MANIFIESTOS[path]
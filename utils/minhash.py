@@ -0,0 +1,151 @@
+# utils/minhash.py
+
+import re
+import random
+import zlib
+import logging
+from typing import Dict, List
+
+import numpy as np
+
+from config import MINHASH_PERMUTACIONES, MINHASH_BANDAS, MINHASH_UMBRAL
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+# Campos del documento que describen qué se vende y a quién (el resto son montos, fechas, etc.)
+_PATRON_CAMPOS = re.compile(r"(?:RznSocRecep|GiroRecep|NmbItem):(.*?)(?=\s+\w+:|$)")
+_PATRON_PALABRA = re.compile(r"\w+")
+_PRIMO = np.uint64(4294967291)  # mayor primo menor que 2^32
+# Clusters que se forman por cada uno que se entrega: de ellos se entregan los de más documentos
+_CLUSTERS_POR_MUESTRA = 4
+
+
+# ==========================
+# Firmas MinHash
+# ==========================
+
+def _shingles(documento: str) -> List[int]:
+    """
+    Hashes (crc32) de las palabras y pares de palabras de los campos de producto y contraparte
+    del documento. Si el documento no tiene esos campos se usa el texto completo.
+    """
+    campos = _PATRON_CAMPOS.findall(documento)
+    palabras = _PATRON_PALABRA.findall((" ".join(campos) if campos else documento).lower())
+    shingles = palabras + [f"{a} {b}" for a, b in zip(palabras, palabras[1:])]
+    return [zlib.crc32(s.encode("utf-8")) for s in shingles] or [0]
+
+
+def firmas_minhash(textos: List[str], n_permutaciones: int = MINHASH_PERMUTACIONES, semilla: int = 0) -> np.ndarray:
+    """
+    Firmas MinHash (n_textos x n_permutaciones) con permutaciones (a*x + b) mod p, vectorizadas
+    sobre todos los shingles a la vez: una pasada de numpy por permutación, sin loops por texto.
+    """
+    shingles = [_shingles(texto) for texto in textos]
+    largos = np.fromiter((len(s) for s in shingles), dtype=np.int64, count=len(shingles))
+    valores = np.fromiter((h for s in shingles for h in s), dtype=np.uint64, count=int(largos.sum()))
+    inicios = np.concatenate(([0], np.cumsum(largos)[:-1]))
+
+    rng = np.random.default_rng(semilla)
+    a = rng.integers(1, _PRIMO, size=n_permutaciones, dtype=np.uint64)
+    b = rng.integers(0, _PRIMO, size=n_permutaciones, dtype=np.uint64)
+    firmas = np.empty((len(textos), n_permutaciones), dtype=np.uint64)
+    for i in range(n_permutaciones):
+        # a, b y crc32 < 2^32: a*x + b cabe en 64 bits
+        firmas[:, i] = np.minimum.reduceat((a[i] * valores + b[i]) % _PRIMO, inicios)
+    return firmas
+
+
+# ==========================
+# Clusters con LSH
+# ==========================
+
+def llaves_lsh(firmas: np.ndarray, n_bandas: int = MINHASH_BANDAS) -> np.ndarray:
+    """
+    Llave de bucket (n_textos x n_bandas) de cada banda de la firma: dos textos son candidatos a
+    parecidos si coinciden en alguna banda. Cada banda se reduce a 64 bits con una combinación lineal.
+    """
+    multiplicadores = np.random.default_rng(1).integers(1, 1 << 63, size=firmas.shape[1], dtype=np.uint64) | np.uint64(1)
+    return np.stack([
+        (firmas[:, columnas] * multiplicadores[columnas]).sum(axis=1, dtype=np.uint64)
+        for columnas in np.array_split(np.arange(firmas.shape[1]), n_bandas)
+    ], axis=1)
+
+
+def clusters_lsh(
+    firmas: np.ndarray,
+    pesos: np.ndarray,
+    n_clusters: int,
+    n_bandas: int = MINHASH_BANDAS,
+    umbral: float = MINHASH_UMBRAL
+) -> List[np.ndarray]:
+    """
+    Los `n_clusters` clusters de textos parecidos con más documentos (`pesos`). Se arman alrededor
+    de centros: el texto sin asignar con más documentos es el centro, y se le suman los textos sin
+    asignar que comparten algún bucket LSH con él y cuya similitud de Jaccard estimada (fracción
+    de la firma que coincide) es al menos `umbral`. Como todo se compara con el centro, textos
+    distintos no quedan juntos por encadenarse a través de intermedios. Se forman hasta
+    `_CLUSTERS_POR_MUESTRA` veces más clusters de los pedidos y se entregan los más grandes, para
+    que un texto suelto que quedó fuera de su cluster no desplace a uno grande.
+
+    Returns:
+        Índices (en `firmas`) de los textos de cada cluster, del cluster más grande al más chico.
+    """
+    llaves = llaves_lsh(firmas, n_bandas)
+    sin_asignar = np.ones(len(firmas), dtype=bool)
+    clusters: List[np.ndarray] = []
+    while len(clusters) < n_clusters * _CLUSTERS_POR_MUESTRA and sin_asignar.any():
+        libres = np.flatnonzero(sin_asignar)
+        centro = libres[np.argmax(pesos[libres])]
+        candidatos = libres[(llaves[libres] == llaves[centro]).any(axis=1)]
+        similitud = (firmas[candidatos] == firmas[centro]).mean(axis=1)
+        miembros = candidatos[similitud >= umbral]
+        sin_asignar[miembros] = False
+        clusters.append(miembros)
+    clusters.sort(key=lambda miembros: pesos[miembros].sum(), reverse=True)
+    return clusters[:n_clusters]
+
+
+# ==========================
+# Muestreo
+# ==========================
+
+def samplear_diverso(documentos: List[str], n_muestras: int) -> List[str]:
+    """
+    Muestra `n_muestras` documentos repartidos entre clusters de documentos parecidos (MinHash + LSH
+    sobre productos y contraparte): un documento al azar de cada uno de los `n_muestras` clusters
+    con más documentos y, si hay menos clusters, otra vuelta por ellos. Así 5 muestras no son 5 copias
+    de la misma factura.
+
+    Los documentos idénticos en esos campos se firman una sola vez, por lo que un RUT con 100k
+    documentos cuesta lo que sus documentos distintos.
+    """
+    if len(documentos) <= n_muestras:
+        return list(documentos)
+
+    indices_por_texto: Dict[str, List[int]] = {}
+    for i, documento in enumerate(documentos):
+        clave = " ".join(_PATRON_CAMPOS.findall(documento)) or documento
+        indices_por_texto.setdefault(clave, []).append(i)
+    grupos = list(indices_por_texto.values())
+    pesos = np.fromiter((len(g) for g in grupos), dtype=np.int64, count=len(grupos))
+
+    clusters = clusters_lsh(firmas_minhash(list(indices_por_texto)), pesos, n_muestras)
+    colas = []
+    for miembros in clusters:
+        cola = [i for m in miembros.tolist() for i in grupos[m]]
+        random.shuffle(cola)
+        colas.append(cola)
+
+    # Round-robin entre clusters (todos los clusters son del mismo RUT; hay documentos de sobra)
+    seleccion: List[int] = []
+    vuelta = 0
+    while len(seleccion) < n_muestras:
+        for cola in colas:
+            if vuelta < len(cola) and len(seleccion) < n_muestras:
+                seleccion.append(cola[vuelta])
+        vuelta += 1
+    logging.debug(f"Muestreo diverso: {len(documentos)} documentos, {len(grupos)} distintos, {len(clusters)} clusters.")
+    return [documentos[i] for i in seleccion]
@@ -0,0 +1,281 @@
+# utils/result_store.py
+
+import os
+import json
+import time
+import pickle
+import logging
+import queue
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from config import SHARD_MAX_BYTES, SHARD_FLUSH_REGISTROS, ESCRITOR_MAX_PENDIENTES
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+BACKENDS_RESULTADOS = ("pickle", "shards")
+EXTENSION_SHARD = ".jsonl"
+
+
+class _EstadisticasEscritura:
+    """Registros escritos, archivos creados y tiempo dedicado a escribir."""
+
+    def __init__(self):
+        self.registros = 0
+        self.archivos = 0
+        self.segundos = 0.0
+
+    def log_stats(self, nombre: str) -> None:
+        logging.info(
+            "%s: %d registros, %d archivos creados, %.2fs escribiendo (%.0f registros/s)",
+            nombre, self.registros, self.archivos, self.segundos,
+            self.registros / self.segundos if self.segundos else 0.0
+        )
+
+
+class ResultadosPickle:
+    """Backend original: un pickle `{prefijo}_{rut}.pkl` por RUT."""
+
+    def __init__(self, directorio: str, prefijo: str):
+        self.directorio = directorio
+        self.prefijo = prefijo
+        self.estadisticas = _EstadisticasEscritura()
+        self._lock = threading.Lock()
+
+    def guardar(self, rut: str, data: Dict[str, Any], al_guardar: Optional[Callable[[str], None]] = None) -> None:
+        """
+        Guarda el registro; `al_guardar(ruta)` se llama cuando ya está en disco. A diferencia de
+        guardar_pickle, un error de escritura se propaga, para que el RUT no quede como terminado.
+        """
+        ruta = os.path.join(self.directorio, f"{self.prefijo}_{rut}.pkl")
+        inicio = time.perf_counter()
+        os.makedirs(self.directorio, exist_ok=True)
+        # Se escribe a un temporal y se renombra: un pickle a medias nunca reemplaza al anterior
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        try:
+            with open(temporal, "wb") as f:
+                pickle.dump(data, f)
+            os.replace(temporal, ruta)
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        logging.info(f"Datos guardados exitosamente en {ruta}")
+        with self._lock:
+            self.estadisticas.registros += 1
+            self.estadisticas.archivos += 1
+            self.estadisticas.segundos += time.perf_counter() - inicio
+        if al_guardar is not None:
+            al_guardar(ruta)
+
+    def flush(self) -> None:
+        pass
+
+    def cerrar(self) -> None:
+        pass
+
+
+class ResultadosShards:
+    """
+    Backend append-only: los registros se acumulan en memoria y se escriben por bloques
+    (cada `flush_cada` registros) como líneas JSON en shards `{prefijo}-{inicio}-{pid}-{n}.jsonl`.
+    Al superar `max_bytes` se abre un shard nuevo. Cada ejecución escribe sus propios shards,
+    por lo que nunca se reescribe un archivo existente.
+
+    Los callbacks `al_guardar` se ejecutan recién después del flush que deja el registro en
+    disco, de modo que el manifiesto nunca marca como terminado un RUT que se perdería.
+    """
+
+    def __init__(
+        self,
+        directorio: str,
+        prefijo: str,
+        max_bytes: int = SHARD_MAX_BYTES,
+        flush_cada: int = SHARD_FLUSH_REGISTROS
+    ):
+        self.directorio = directorio
+        self.prefijo = prefijo
+        self.max_bytes = max_bytes
+        self.flush_cada = flush_cada
+        self.estadisticas = _EstadisticasEscritura()
+        self._lock = threading.Lock()
+        self._pendientes: List[bytes] = []
+        self._callbacks: List[Callable[[str], None]] = []
+        self._id_ejecucion = f"{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+        self._n_shard = 0
+        self._ruta_actual: Optional[str] = None
+        self._bytes_actual = 0
+        os.makedirs(directorio, exist_ok=True)
+
+    def _rotar(self) -> None:
+        self._n_shard += 1
+        self._ruta_actual = os.path.join(
+            self.directorio, f"{self.prefijo}-{self._id_ejecucion}-{self._n_shard:05d}{EXTENSION_SHARD}"
+        )
+        self._bytes_actual = 0
+        self.estadisticas.archivos += 1
+
+    def guardar(self, rut: str, data: Dict[str, Any], al_guardar: Optional[Callable[[str], None]] = None) -> None:
+        """Agrega el registro al buffer; `al_guardar(ruta_shard)` se llama tras escribirlo."""
+        linea = (json.dumps(data, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        with self._lock:
+            self._pendientes.append(linea)
+            if al_guardar is not None:
+                self._callbacks.append(al_guardar)
+            self.estadisticas.registros += 1
+            if len(self._pendientes) >= self.flush_cada:
+                self._flush()
+
+    def _flush(self) -> None:
+        if not self._pendientes:
+            return
+        inicio = time.perf_counter()
+        bloque = b"".join(self._pendientes)
+        if self._ruta_actual is None or (self._bytes_actual and self._bytes_actual + len(bloque) > self.max_bytes):
+            self._rotar()
+        with open(self._ruta_actual, "ab") as f:
+            f.write(bloque)
+        self._bytes_actual += len(bloque)
+        self._pendientes = []
+        callbacks, self._callbacks = self._callbacks, []
+        self.estadisticas.segundos += time.perf_counter() - inicio
+        for callback in callbacks:
+            callback(self._ruta_actual)
+
+    def flush(self) -> None:
+        """Escribe a disco los registros pendientes."""
+        with self._lock:
+            self._flush()
+
+    def cerrar(self) -> None:
+        self.flush()
+
+
+def crear_almacen(backend: str, directorio: str, prefijo: str):
+    """Almacén de resultados según --results-backend ('pickle' o 'shards')."""
+    if backend == "shards":
+        return ResultadosShards(directorio, prefijo)
+    return ResultadosPickle(directorio, prefijo)
+
+
+
+class EscritorResultados:
+    """
+    Saca las escrituras de resultados del event loop: `guardar` deja el registro en una cola
+    acotada y un hilo dedicado lo escribe en el almacén (pickle o shards), incluidos los
+    callbacks al manifiesto. Si la cola está llena, `guardar` espera fuera del loop
+    (back-pressure) en vez de bloquearlo.
+
+    `drenar()` espera a que todo lo encolado esté en disco (fin de lote) y `cerrar()` hace lo
+    mismo de forma síncrona y detiene el hilo, por lo que sirve en un `finally` ante Ctrl-C.
+    """
+
+    _FIN = object()
+
+    def __init__(self, almacen, max_pendientes: int = ESCRITOR_MAX_PENDIENTES):
+        self.almacen = almacen
+        self.max_pendientes_observados = 0
+        self.segundos_esperando = 0.0
+        self._cola: "queue.Queue" = queue.Queue(maxsize=max_pendientes)
+        self._hilo = threading.Thread(target=self._escribir, name=f"escritor-{almacen.prefijo}", daemon=True)
+        self._hilo.start()
+
+    @property
+    def estadisticas(self) -> _EstadisticasEscritura:
+        return self.almacen.estadisticas
+
+    def _escribir(self) -> None:
+        while True:
+            item = self._cola.get()
+            try:
+                if item is self._FIN:
+                    return
+                self.almacen.guardar(*item)
+            except Exception as e:
+                # El callback no se ejecuta, así que el manifiesto no marca el RUT como terminado
+                logging.error(f"Error guardando el resultado del RUT {item[0]}: {e}")
+            finally:
+                self._cola.task_done()
+
+    async def guardar(self, rut: str, data: Dict[str, Any], al_guardar: Optional[Callable[[str], None]] = None) -> None:
+        """Encola el registro. Se guarda una copia superficial, porque quien llama puede seguir modificándolo."""
+        item = (rut, dict(data), al_guardar)
+        try:
+            self._cola.put_nowait(item)
+        except queue.Full:
+            inicio = time.perf_counter()
+            await asyncio.to_thread(self._cola.put, item)
+            self.segundos_esperando += time.perf_counter() - inicio
+        self.max_pendientes_observados = max(self.max_pendientes_observados, self._cola.qsize())
+
+    def _drenar(self) -> None:
+        self._cola.join()
+        self.almacen.flush()
+
+    async def drenar(self) -> None:
+        """Espera a que los registros encolados queden en disco."""
+        await asyncio.to_thread(self._drenar)
+
+    def cerrar(self) -> None:
+        """Escribe lo pendiente, detiene el hilo y cierra el almacén."""
+        if not self._hilo.is_alive():
+            return
+        pendientes = self._cola.qsize()
+        if pendientes:
+            logging.info(f"Escribiendo {pendientes} resultados pendientes en '{self.almacen.directorio}'...")
+        self._cola.put(self._FIN)
+        self._hilo.join()
+        self.almacen.cerrar()
+
+    def log_stats(self, nombre: str) -> None:
+        self.almacen.estadisticas.log_stats(nombre)
+        logging.info(
+            "%s: máximo %d resultados en cola, %.2fs esperando al escritor",
+            nombre, self.max_pendientes_observados, self.segundos_esperando
+        )
+
+
+def crear_escritor(backend: str, directorio: str, prefijo: str) -> EscritorResultados:
+    """Almacén de resultados envuelto en un EscritorResultados (para usar desde código async)."""
+    return EscritorResultados(crear_almacen(backend, directorio, prefijo))
+
+
+def cargar_datos_desde_shards(
+    directorio: str,
+    nombres_a_cargar: Iterable[str],
+    prefijo: str = "salida_rubro",
+    mtimes: Optional[Dict[str, float]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Lee los registros de los shards `{prefijo}-*.jsonl` del directorio cuyos RUTs (sin ceros a
+    la izquierda, igual que cargar_datos_desde_folder) están en `nombres_a_cargar`. Si un RUT
+    aparece varias veces (p. ej. tras un --resume) se conserva el registro más reciente.
+    Si se pasa `mtimes`, se llena con el mtime del shard del que salió el registro de cada RUT.
+    """
+    nombres = set(nombres_a_cargar)
+    shards = sorted(
+        f for f in os.listdir(directorio)
+        if f.startswith(f"{prefijo}-") and f.endswith(EXTENSION_SHARD)
+    )
+    por_rut: Dict[str, Dict[str, Any]] = {}
+    for shard in shards:
+        ruta = os.path.join(directorio, shard)
+        mtime = os.path.getmtime(ruta)
+        with open(ruta, "rb") as f:
+            for n_linea, linea in enumerate(f, 1):
+                try:
+                    registro = json.loads(linea)
+                except ValueError:
+                    logging.warning(f"Línea inválida en el shard {shard}:{n_linea}, se omite.")
+                    continue
+                rut = str(registro.get("rut", "")).lstrip('0')
+                if rut in nombres:
+                    por_rut[rut] = registro
+                    if mtimes is not None:
+                        mtimes[rut] = mtime
+    logging.info(f"Se cargaron {len(por_rut)} registros desde {len(shards)} shards en '{directorio}'.")
+    return list(por_rut.values())
@@ -0,0 +1,84 @@
+# utils/scheduler.py
+
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from tqdm.asyncio import tqdm as async_tqdm
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+
+async def procesar_en_ventana(
+    items: Iterable[Any],
+    procesar: Callable[[Any], Awaitable[None]],
+    en_vuelo: int,
+    checkpoint_cada: Optional[int] = None,
+    al_checkpoint: Optional[Callable[[int], Awaitable[None]]] = None,
+    desc: Optional[str] = None
+) -> int:
+    """
+    Procesa `items` manteniendo siempre `en_vuelo` en curso: apenas uno termina se admite el
+    siguiente, sin esperar al más lento de un lote (ventana deslizante en vez de lotes con barrera).
+
+    Cada `checkpoint_cada` items terminados se registra el avance y se llama a
+    `al_checkpoint(terminados)` (p. ej. para drenar los escritores de resultados) en una tarea
+    aparte, sin quitarle un cupo a la ventana; si el checkpoint anterior no ha terminado, se
+    omite. Un error en un item se registra y no detiene al resto.
+
+    Returns:
+        Número de items procesados.
+    """
+    items = list(items)
+    total = len(items)
+    iterador = iter(items)
+    terminados = 0
+    inicio = time.perf_counter()
+    barra = async_tqdm(total=total, desc=desc)
+
+    tarea_checkpoint: Optional[asyncio.Task] = None
+
+    async def checkpoint(n: int) -> None:
+        transcurrido = time.perf_counter() - inicio
+        logging.info(f"--- Avance: {n}/{total} ({n / transcurrido if transcurrido else 0.0:.2f} por segundo)")
+        if al_checkpoint is not None:
+            try:
+                await al_checkpoint(n)
+            except Exception as e:
+                logging.error(f"--- Error en el checkpoint de la ventana ({n}/{total}): {e}")
+
+    def lanzar_checkpoint(n: int) -> None:
+        nonlocal tarea_checkpoint
+        if tarea_checkpoint is not None and not tarea_checkpoint.done():
+            return  # sigue el anterior; el próximo checkpoint cubre lo que falte
+        tarea_checkpoint = asyncio.create_task(checkpoint(n))
+
+    async def trabajador() -> None:
+        nonlocal terminados
+        for item in iterador:  # el iterador es compartido: cada item lo toma un solo trabajador
+            try:
+                await procesar(item)
+            except Exception as e:
+                async_tqdm.write(f"--- ERROR CRÍTICO en la ventana de procesamiento: {e}. Continuando con el siguiente.")
+            terminados += 1
+            barra.update(1)
+            if checkpoint_cada and terminados % checkpoint_cada == 0 and terminados < total:
+                lanzar_checkpoint(terminados)  # en otra tarea: el trabajador sigue con el siguiente item
+
+    try:
+        await asyncio.gather(*(trabajador() for _ in range(max(1, min(en_vuelo, total)))))
+    except BaseException:
+        if tarea_checkpoint is not None:
+            tarea_checkpoint.cancel()
+        raise
+    finally:
+        barra.close()
+    if tarea_checkpoint is not None:
+        await tarea_checkpoint
+    if checkpoint_cada:
+        await checkpoint(terminados)
+    return terminados